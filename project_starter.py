@@ -1,15 +1,24 @@
 import pandas as pd
 import numpy as np
+import argparse
 import os
 import re
 import sys
 import time
 import dotenv
 import ast
-from sqlalchemy.sql import text
+import contextvars
+import hashlib
+import json
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from sqlalchemy.sql import bindparam, text
 from datetime import datetime, timedelta
-from typing import Dict, List, Union
-from sqlalchemy import create_engine, Engine
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, Engine
 
 # Regex to strip ANSI escape codes (colors, bold, etc.) from text
 ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m|\x1b\[[\d;]*[A-Za-z]')
@@ -17,10 +26,10 @@ ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m|\x1b\[[\d;]*[A-Za-z]')
 
 class TeeOutput:
     """Writes to both terminal (with colors) and a clean log file (no ANSI codes)."""
-    def __init__(self, log_path):
+    def __init__(self, log_path, mode="w"):
         self.terminal = sys.stdout
-        os.makedirs(os.path.dirname(log_path), exist_ok=True)
-        self.log_file = open(log_path, "w", encoding="utf-8")
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        self.log_file = open(log_path, mode, encoding="utf-8")
 
     def write(self, message):
         self.terminal.write(message)
@@ -36,8 +45,251 @@ class TeeOutput:
         self.log_file.close()
         sys.stdout = self.terminal
 
+# Seconds a connection waits on a locked database before giving up
+SQLITE_BUSY_TIMEOUT = 30
+
+
+def create_ledger_engine(url: str = "sqlite:///munder_difflin.db") -> Engine:
+    """
+    Create a SQLite engine whose transactions start with an explicit BEGIN.
+
+    pysqlite normally defers BEGIN until the first write, so a read-then-write sequence is
+    not one transaction. This follows the SQLAlchemy recipe of taking over BEGIN, and
+    emits BEGIN IMMEDIATE (taking the database write lock up front) on connections with
+    the `sqlite_immediate` execution option, as used by `ledger_write_transaction`.
+
+    Args:
+        url (str, optional): SQLAlchemy database URL.
+
+    Returns:
+        Engine: The configured engine.
+    """
+    engine = create_engine(url, connect_args={"timeout": SQLITE_BUSY_TIMEOUT})
+
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        immediate = conn.get_execution_options().get("sqlite_immediate", False)
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+    return engine
+
+
 # Create an SQLite database
-db_engine = create_engine("sqlite:///munder_difflin.db")
+db_engine = create_ledger_engine("sqlite:///munder_difflin.db")
+
+# Learned customer phrase -> catalog item mappings. Kept in a separate database file so they
+# survive init_database rebuilds and snapshot restores of the main database.
+alias_engine = create_engine("sqlite:///item_aliases.db")
+
+# Prebuilt database snapshots, keyed by seed and source CSV contents
+SNAPSHOT_DIR = ".db_snapshots"
+SNAPSHOT_SOURCE_FILES = ["quote_requests.csv", "quotes.csv"]
+# Bump when the layout produced by init_database changes so old snapshots are ignored
+SNAPSHOT_SCHEMA_VERSION = 6
+
+# Rows per chunk when streaming the quote history CSVs into the database
+CSV_CHUNK_SIZE = 10_000
+
+
+class LedgerCache:
+    """
+    LRU cache for as-of ledger lookups (stock levels, inventory snapshots, cash balance).
+
+    Entries are keyed by (query, item_name, as_of_date). A new transaction for item X dated D
+    can only change lookups for X (or for all items) as of D or later, so `invalidate`
+    drops exactly those entries and leaves the rest warm. Every write also bumps
+    `generation`; a lookup that was computed while a write happened is returned but not
+    stored, so a stale result can never enter the cache.
+    """
+    def __init__(self, max_entries: int = 4096):
+        self.enabled = True
+        self.max_entries = max_entries
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _lookup(self, key):
+        """Return (hit, value, generation) for the key, counting the hit or miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key], None
+            self.misses += 1
+            return False, None, self.generation
+
+    def _store(self, key, generation, value):
+        """Cache `value` unless a write happened since `generation` was read."""
+        with self._lock:
+            if self.generation == generation:
+                self._entries[key] = value
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+    def get_or_compute(self, query: str, item_name, as_of_date: str, compute):
+        """Return the cached value for the key, or call `compute()` and cache its result."""
+        if not self.enabled:
+            return compute()
+
+        key = (query, item_name, as_of_date)
+        hit, value, generation = self._lookup(key)
+        if hit:
+            return value
+        value = compute()
+        self._store(key, generation, value)
+        return value
+
+    async def aget_or_compute(self, query: str, item_name, as_of_date: str, compute):
+        """Async variant of `get_or_compute`: `compute()` returns an awaitable."""
+        if not self.enabled:
+            return await compute()
+
+        key = (query, item_name, as_of_date)
+        hit, value, generation = self._lookup(key)
+        if hit:
+            return value
+        value = await compute()
+        self._store(key, generation, value)
+        return value
+
+    def invalidate(self, item_name, date_str: str):
+        """Drop entries a transaction for `item_name` dated `date_str` could change."""
+        with self._lock:
+            self.generation += 1
+            stale = [
+                key for key in self._entries
+                if key[2] >= date_str and (key[1] is None or key[1] == item_name)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        """Drop every entry, e.g. after the database is rebuilt or restored."""
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and the hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+# Shared cache in front of get_stock_level, get_all_inventory and get_cash_balance
+ledger_cache = LedgerCache()
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls into one execution.
+
+    The first caller for a key runs the computation; callers that arrive with the same key
+    while it is running wait for it and receive the same result (or exception) instead of
+    running it again. Nothing is kept once the call finishes, so this is independent of
+    `ledger_cache` and stays correct with caching disabled. Keys are combined with the
+    `generation` callable's value, so a caller arriving after a ledger write never joins
+    a call that started before it. Results are shared: callers must copy before mutating.
+    """
+    def __init__(self, generation=lambda: 0):
+        self._generation = generation
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+
+    def _join(self, key):
+        """
+        Return (key, future, is_leader) for the key, registering a new call if none is running.
+
+        The returned key includes the current generation and is the one `_execute` must clear.
+        """
+        from concurrent.futures import Future
+
+        key = (key, self._generation())
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                return key, future, False
+            future = Future()
+            self._in_flight[key] = future
+            self.executions += 1
+            return key, future, True
+
+    def _execute(self, key, future, compute):
+        try:
+            future.set_result(compute())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def do(self, key, compute):
+        """Return `compute()`, sharing one execution with concurrent callers of the same key."""
+        key, future, leader = self._join(key)
+        if leader:
+            self._execute(key, future, compute)
+        return future.result()
+
+    async def do_async(self, key, compute):
+        """
+        Async variant of `do`: the leader starts `compute` on `flight_executor`.
+
+        The leader's work gets its own pool rather than `db_executor`, whose workers may be
+        blocked in `do` waiting for this very call; `compute` must therefore not wait on other
+        flights itself. The computation is not tied to any one caller. Each caller awaits its
+        own shielded view of the shared future, so cancelling one waiting task (even the
+        leader's) never cancels the query or the result the other callers are waiting for.
+        """
+        import asyncio
+
+        key, future, leader = self._join(key)
+        if leader:
+            flight_executor.submit(self._execute, key, future, compute)
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def stats(self) -> Dict:
+        """Return call counts and how many duplicate executions were avoided."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.calls - self.executions,
+                "in_flight": len(self._in_flight),
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = 0
+            self.executions = 0
+
+
+# Shares in-flight read queries between concurrent callers (see SingleFlight)
+query_flight = SingleFlight(generation=lambda: ledger_cache.generation)
+
+# Default bulk discount tiers as (minimum units per line, discount rate), seeded into the
+# 'discount_tiers' table by init_database
+DEFAULT_DISCOUNT_TIERS = [(0, 0.0), (100, 0.05), (500, 0.10), (1000, 0.15)]
 
 # List containing the different kinds of papers 
 paper_supplies = [
@@ -153,16 +405,154 @@ def generate_sample_inventory(paper_supplies: list, coverage: float = 0.4, seed:
     # Return inventory as a pandas DataFrame
     return pd.DataFrame(inventory)
 
-def init_database(db_engine: Engine, seed: int = 137) -> Engine:    
+QUOTE_METADATA_FIELDS = ["job_type", "order_size", "event_type"]
+
+
+def _parse_request_metadata(values: pd.Series) -> pd.DataFrame:
+    """Parse a column of `request_metadata` strings into one column per metadata field, in a single pass."""
+    records = [
+        ast.literal_eval(x) if isinstance(x, str) else (x if isinstance(x, dict) else {})
+        for x in values
+    ]
+    return pd.DataFrame.from_records(records, columns=QUOTE_METADATA_FIELDS, index=values.index).fillna("")
+
+
+def load_quote_history(
+    db_engine: Engine,
+    quote_requests_path: str = "quote_requests.csv",
+    quotes_path: str = "quotes.csv",
+    order_date: str = datetime(2025, 1, 1).isoformat(),
+    chunksize: int = CSV_CHUNK_SIZE,
+) -> Dict[str, int]:
     """
-    Set up the Munder Difflin database with all required tables and initial records.
+    Stream the historical quote requests and quotes from CSV into the database.
+
+    Both files are read `chunksize` rows at a time, so peak memory stays bounded by the
+    chunk size rather than the file size. Each quotes chunk has its `request_metadata`
+    parsed once into `job_type`, `order_size` and `event_type` columns. All chunks are
+    inserted inside a single transaction, replacing any existing `quote_requests` and
+    `quotes` tables. Indexes for the join and sort in `search_quote_history` are created
+    with the first chunk, so SQLite maintains them incrementally as later chunks arrive.
+    Its `LIKE '%term%'` text filter cannot use an index and still scans every quote.
+
+    Args:
+        db_engine (Engine): A SQLAlchemy engine connected to the SQLite database.
+        quote_requests_path (str, optional): Path of the customer requests CSV.
+        quotes_path (str, optional): Path of the historical quotes CSV.
+        order_date (str, optional): ISO date stamped on every loaded quote.
+        chunksize (int, optional): Rows per chunk. Default is `CSV_CHUNK_SIZE`.
+
+    Returns:
+        Dict[str, int]: Number of rows loaded per table.
+    """
+    loaded = {"quote_requests": 0, "quotes": 0}
+
+    with db_engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS quote_requests"))
+        conn.execute(text("DROP TABLE IF EXISTS quotes"))
+
+        for chunk in pd.read_csv(quote_requests_path, chunksize=chunksize):
+            start = loaded["quote_requests"] + 1
+            chunk["id"] = range(start, start + len(chunk))
+            chunk.to_sql("quote_requests", conn, if_exists="append", index=False)
+            if start == 1:
+                # Join key for search_quote_history (not its text filter)
+                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_quote_requests_id ON quote_requests (id)"))
+            loaded["quote_requests"] += len(chunk)
+
+        for chunk in pd.read_csv(quotes_path, chunksize=chunksize):
+            start = loaded["quotes"] + 1
+            chunk["request_id"] = range(start, start + len(chunk))
+            chunk["order_date"] = order_date
+
+            # Unpack metadata fields (job_type, order_size, event_type) if present
+            if "request_metadata" in chunk.columns:
+                chunk[QUOTE_METADATA_FIELDS] = _parse_request_metadata(chunk["request_metadata"])
+            else:
+                chunk[QUOTE_METADATA_FIELDS] = ""
+
+            # Retain only relevant columns
+            chunk = chunk[[
+                "request_id",
+                "total_amount",
+                "quote_explanation",
+                "order_date",
+                *QUOTE_METADATA_FIELDS,
+            ]]
+            chunk.to_sql("quotes", conn, if_exists="append", index=False)
+            if start == 1:
+                # Join key and sort column of search_quote_history (not its text filter)
+                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_quotes_request_id ON quotes (request_id)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_quotes_order_date ON quotes (order_date)"))
+            loaded["quotes"] += len(chunk)
+
+    return loaded
+
+
+# Per-item, per-date sales totals, kept in step with the ledger by triggers, so any write
+# path (create_transaction, batched tool writes, to_sql) updates them in its own transaction.
+# The seeded starting-cash row has no item, so its item_key is ''; units stays NULL while
+# every contributing sale has NULL units, matching SUM() over the raw ledger.
+SALES_DAILY_DDL = [
+    """
+    CREATE TABLE sales_daily (
+        item_key TEXT NOT NULL,
+        sale_date TEXT NOT NULL,
+        units REAL,
+        revenue REAL,
+        PRIMARY KEY (item_key, sale_date)
+    )
+    """,
+    "CREATE INDEX idx_sales_daily_date ON sales_daily (sale_date)",
+]
+
+_SALES_DAILY_ADD = """
+    INSERT INTO sales_daily (item_key, sale_date, units, revenue)
+    SELECT COALESCE({row}.item_name, ''), {row}.transaction_date, {row}.units, {row}.price
+    WHERE {row}.transaction_type = 'sales'
+    ON CONFLICT (item_key, sale_date) DO UPDATE SET
+        units = CASE WHEN units IS NULL THEN excluded.units ELSE units + COALESCE(excluded.units, 0) END,
+        revenue = CASE WHEN revenue IS NULL THEN excluded.revenue ELSE revenue + COALESCE(excluded.revenue, 0) END;
+"""
+
+_SALES_DAILY_SUBTRACT = """
+    UPDATE sales_daily
+    SET units = units - COALESCE({row}.units, 0), revenue = revenue - COALESCE({row}.price, 0)
+    WHERE {row}.transaction_type = 'sales'
+      AND item_key = COALESCE({row}.item_name, '') AND sale_date = {row}.transaction_date;
+"""
+
+SALES_DAILY_TRIGGERS = [
+    f"CREATE TRIGGER trg_sales_daily_insert AFTER INSERT ON transactions BEGIN {_SALES_DAILY_ADD.format(row='NEW')} END",
+    f"CREATE TRIGGER trg_sales_daily_delete AFTER DELETE ON transactions BEGIN {_SALES_DAILY_SUBTRACT.format(row='OLD')} END",
+    f"""CREATE TRIGGER trg_sales_daily_update AFTER UPDATE ON transactions BEGIN
+        {_SALES_DAILY_SUBTRACT.format(row='OLD')}
+        {_SALES_DAILY_ADD.format(row='NEW')}
+    END""",
+]
+
+SALES_DAILY_FROM_LEDGER_SQL = """
+    SELECT COALESCE(item_name, '') AS item_key, transaction_date AS sale_date,
+           SUM(units) AS units, SUM(price) AS revenue
+    FROM transactions
+    WHERE transaction_type = 'sales'
+    GROUP BY COALESCE(item_name, ''), transaction_date
+"""
+
+
+def _build_database(db_engine: Engine, seed: int = 137) -> Engine:
+    """
+    Build the Munder Difflin database from scratch with all required tables and initial records.
 
     This function performs the following tasks:
     - Creates the 'transactions' table for logging stock orders and sales
+    - Creates the 'sales_daily' aggregate table and the triggers that maintain it
     - Loads customer inquiries from 'quote_requests.csv' into a 'quote_requests' table
     - Loads previous quotes from 'quotes.csv' into a 'quotes' table, extracting useful metadata
     - Generates a random subset of paper inventory using `generate_sample_inventory`
     - Inserts initial financial records including available cash and starting stock levels
+    - Seeds the 'discount_tiers' table from `DEFAULT_DISCOUNT_TIERS`
+    - Creates the empty 'stock_holds' table for soft holds placed at quote time
 
     Args:
         db_engine (Engine): A SQLAlchemy engine connected to the SQLite database.
@@ -189,43 +579,19 @@ def init_database(db_engine: Engine, seed: int = 137) -> Engine:
         })
         transactions_schema.to_sql("transactions", db_engine, if_exists="replace", index=False)
 
+        # Sales aggregates, maintained from here on by triggers on 'transactions'
+        with db_engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS sales_daily"))
+            for statement in SALES_DAILY_DDL + SALES_DAILY_TRIGGERS:
+                conn.execute(text(statement))
+
         # Set a consistent starting date
         initial_date = datetime(2025, 1, 1).isoformat()
 
         # ----------------------------
-        # 2. Load and initialize 'quote_requests' table
-        # ----------------------------
-        quote_requests_df = pd.read_csv("quote_requests.csv")
-        quote_requests_df["id"] = range(1, len(quote_requests_df) + 1)
-        quote_requests_df.to_sql("quote_requests", db_engine, if_exists="replace", index=False)
-
-        # ----------------------------
-        # 3. Load and transform 'quotes' table
+        # 2-3. Stream 'quote_requests' and 'quotes' tables from CSV
         # ----------------------------
-        quotes_df = pd.read_csv("quotes.csv")
-        quotes_df["request_id"] = range(1, len(quotes_df) + 1)
-        quotes_df["order_date"] = initial_date
-
-        # Unpack metadata fields (job_type, order_size, event_type) if present
-        if "request_metadata" in quotes_df.columns:
-            quotes_df["request_metadata"] = quotes_df["request_metadata"].apply(
-                lambda x: ast.literal_eval(x) if isinstance(x, str) else x
-            )
-            quotes_df["job_type"] = quotes_df["request_metadata"].apply(lambda x: x.get("job_type", ""))
-            quotes_df["order_size"] = quotes_df["request_metadata"].apply(lambda x: x.get("order_size", ""))
-            quotes_df["event_type"] = quotes_df["request_metadata"].apply(lambda x: x.get("event_type", ""))
-
-        # Retain only relevant columns
-        quotes_df = quotes_df[[
-            "request_id",
-            "total_amount",
-            "quote_explanation",
-            "order_date",
-            "job_type",
-            "order_size",
-            "event_type"
-        ]]
-        quotes_df.to_sql("quotes", db_engine, if_exists="replace", index=False)
+        load_quote_history(db_engine, order_date=initial_date)
 
         # ----------------------------
         # 4. Generate inventory and seed stock
@@ -257,15 +623,213 @@ def init_database(db_engine: Engine, seed: int = 137) -> Engine:
         # Commit transactions to database
         pd.DataFrame(initial_transactions).to_sql("transactions", db_engine, if_exists="append", index=False)
 
+        # Index per-item, as-of-date stock lookups
+        with db_engine.begin() as conn:
+            conn.execute(text("CREATE INDEX idx_transactions_item_date ON transactions (item_name, transaction_date)"))
+
         # Save the inventory reference table
         inventory_df.to_sql("inventory", db_engine, if_exists="replace", index=False)
 
+        # ----------------------------
+        # 5. Seed the bulk discount tier table
+        # ----------------------------
+        pd.DataFrame(DEFAULT_DISCOUNT_TIERS, columns=["min_quantity", "discount"]).to_sql(
+            "discount_tiers", db_engine, if_exists="replace", index=False
+        )
+
+        # ----------------------------
+        # 6. Create the (empty) soft stock holds table
+        # ----------------------------
+        with db_engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS stock_holds"))
+            conn.execute(text("""
+                CREATE TABLE stock_holds (
+                    id INTEGER PRIMARY KEY,
+                    hold_id TEXT NOT NULL,
+                    item_name TEXT NOT NULL,
+                    units INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'active'
+                )
+            """))
+            conn.execute(text("CREATE INDEX idx_stock_holds_item ON stock_holds (item_name, status)"))
+
+        ledger_cache.clear()
+        return db_engine
+
+    except Exception as e:
+        print(f"Error initializing database: {e}")
+        raise
+
+def _file_sha256(path: str) -> str:
+    """Return the SHA-256 hex digest of a file, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_snapshot_key(seed: int = 137) -> str:
+    """
+    Compute the cache key identifying a seeded database snapshot.
+
+    The key covers everything `init_database` reads: the seed, the contents of the
+    source CSV files, the `paper_supplies` catalog, and the snapshot schema version.
+
+    Args:
+        seed (int, optional): The inventory seed passed to `init_database`. Default is 137.
+
+    Returns:
+        str: A short hex key, stable for identical inputs.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{SNAPSHOT_SCHEMA_VERSION}|seed={seed}|".encode())
+    for path in SNAPSHOT_SOURCE_FILES:
+        digest.update(f"{path}={_file_sha256(path)}|".encode())
+    digest.update(repr(paper_supplies).encode())
+    return digest.hexdigest()[:16]
+
+
+# Snapshot keys by (seed, source file mtime/size), so unchanged CSVs are hashed only once
+_snapshot_key_cache: Dict[tuple, str] = {}
+
+
+def _snapshot_path(seed: int) -> str:
+    file_stats = tuple(
+        (path, os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in SNAPSHOT_SOURCE_FILES
+    )
+    cache_key = (seed, file_stats)
+    if cache_key not in _snapshot_key_cache:
+        _snapshot_key_cache[cache_key] = get_snapshot_key(seed)
+    return os.path.join(SNAPSHOT_DIR, f"munder_difflin_{_snapshot_key_cache[cache_key]}.db")
+
+
+def save_database_snapshot(db_engine: Engine, snapshot_path: str) -> str:
+    """
+    Copy the database behind `db_engine` into a standalone SQLite snapshot file.
+
+    The copy is written with the SQLite online backup API to a temporary file and then
+    renamed into place, so a crash never leaves a half-written snapshot behind.
+
+    Args:
+        db_engine (Engine): Engine connected to the database to snapshot.
+        snapshot_path (str): Destination path of the snapshot file.
+
+    Returns:
+        str: The snapshot path.
+    """
+    os.makedirs(os.path.dirname(snapshot_path) or ".", exist_ok=True)
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    raw = db_engine.raw_connection()
+    try:
+        dst = sqlite3.connect(tmp_path)
+        try:
+            raw.driver_connection.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        raw.close()
+    os.replace(tmp_path, snapshot_path)
+    return snapshot_path
+
+
+# In-memory copies of snapshot files, so repeated resets never touch the disk
+_snapshot_templates: Dict[str, sqlite3.Connection] = {}
+
+
+def _load_snapshot_template(snapshot_path: str) -> sqlite3.Connection:
+    template = _snapshot_templates.get(snapshot_path)
+    if template is None:
+        template = sqlite3.connect(":memory:", check_same_thread=False)
+        src = sqlite3.connect(snapshot_path)
+        try:
+            src.backup(template)
+        finally:
+            src.close()
+        _snapshot_templates[snapshot_path] = template
+    return template
+
+
+def restore_database_snapshot(db_engine: Engine, snapshot_path: str) -> Engine:
+    """
+    Overwrite the database behind `db_engine` with the contents of a snapshot file.
+
+    Uses the SQLite backup API from an in-memory template of the snapshot, which replaces
+    every table in one step and takes milliseconds for a database of this size.
+
+    Args:
+        db_engine (Engine): Engine connected to the database to overwrite.
+        snapshot_path (str): Path of a snapshot written by `save_database_snapshot`.
+
+    Returns:
+        Engine: The same engine, now holding the snapshot state.
+    """
+    template = _load_snapshot_template(snapshot_path)
+    raw = db_engine.raw_connection()
+    try:
+        template.backup(raw.driver_connection)
+    finally:
+        raw.close()
+    ledger_cache.clear()
+    return db_engine
+
+
+def init_database(db_engine: Engine, seed: int = 137, use_snapshot: bool = True) -> Engine:
+    """
+    Set up the Munder Difflin database with all required tables and initial records.
+
+    On the first call for a given seed and set of source CSV files, the database is built
+    by `_build_database` and saved as a snapshot under `SNAPSHOT_DIR`. Later calls with the
+    same inputs restore that snapshot instead of rebuilding, which skips CSV parsing,
+    inventory generation, and all table writes.
+
+    Args:
+        db_engine (Engine): A SQLAlchemy engine connected to the SQLite database.
+        seed (int, optional): A random seed used to control reproducibility of inventory stock levels.
+                              Default is 137.
+        use_snapshot (bool, optional): Whether to read and write the snapshot cache. Default is True.
+
+    Returns:
+        Engine: The same SQLAlchemy engine, after initializing all necessary tables and records.
+
+    Raises:
+        Exception: If an error occurs during setup, the exception is printed and raised.
+    """
+    if not use_snapshot:
+        return _build_database(db_engine, seed)
+
+    try:
+        snapshot_path = _snapshot_path(seed)
+        if os.path.exists(snapshot_path):
+            return restore_database_snapshot(db_engine, snapshot_path)
+
+        _build_database(db_engine, seed)
+        save_database_snapshot(db_engine, snapshot_path)
         return db_engine
 
     except Exception as e:
         print(f"Error initializing database: {e}")
         raise
 
+
+def reset_database(db_engine: Engine, seed: int = 137) -> Engine:
+    """
+    Return the database to its freshly seeded state, e.g. between evaluation scenarios.
+
+    Equivalent to `init_database(db_engine, seed)`, but the snapshot is kept in memory after
+    the first call, so each reset is a single in-memory backup into the target database.
+
+    Args:
+        db_engine (Engine): A SQLAlchemy engine connected to the SQLite database.
+        seed (int, optional): The inventory seed of the state to restore. Default is 137.
+
+    Returns:
+        Engine: The same engine, holding the seeded state.
+    """
+    return init_database(db_engine, seed)
+
 def create_transaction(
     item_name: str,
     transaction_type: str,
@@ -299,139 +863,604 @@ def create_transaction(
         if transaction_type not in {"stock_orders", "sales"}:
             raise ValueError("Transaction type must be 'stock_orders' or 'sales'")
 
-        # Prepare transaction record as a single-row DataFrame
-        transaction = pd.DataFrame([{
-            "item_name": item_name,
-            "transaction_type": transaction_type,
-            "units": quantity,
-            "price": price,
-            "transaction_date": date_str,
-        }])
-
-        # Insert the record into the database
-        transaction.to_sql("transactions", db_engine, if_exists="append", index=False)
-
-        # Fetch and return the ID of the inserted row
-        result = pd.read_sql("SELECT last_insert_rowid() as id", db_engine)
-        return int(result.iloc[0]["id"])
+        # Insert the record under the ledger write lock and return its ID. The ID is read
+        # on the inserting connection, so concurrent writers cannot mix them up.
+        with ledger_write_transaction() as conn:
+            return _insert_transactions(conn, [{
+                "item_name": item_name,
+                "transaction_type": transaction_type,
+                "units": quantity,
+                "price": price,
+                "transaction_date": date_str,
+            }])[0]
 
     except Exception as e:
         print(f"Error creating transaction: {e}")
         raise
 
-def get_all_inventory(as_of_date: str) -> Dict[str, int]:
+
+# Net stock per item: stock orders add units, sales remove them
+STOCK_DELTA_SQL = """
+    SUM(CASE
+        WHEN transaction_type = 'stock_orders' THEN units
+        WHEN transaction_type = 'sales' THEN -units
+        ELSE 0
+    END)
+"""
+
+# qmark parameters, so the statement runs directly on the sqlite3 cursor
+INSERT_TRANSACTION_SQL = """
+    INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def _stock_levels_in(conn, item_names: List[str], as_of_date: str) -> Dict[str, float]:
+    """Net stock of several items as of a date, read on an open connection in one query."""
+    if not item_names:
+        return {}
+    query = text(f"""
+        SELECT item_name, COALESCE({STOCK_DELTA_SQL}, 0) AS current_stock
+        FROM transactions
+        WHERE item_name IN :item_names
+        AND transaction_date <= :as_of_date
+        GROUP BY item_name
+    """).bindparams(bindparam("item_names", expanding=True))
+    rows = conn.execute(query, {"item_names": list(set(item_names)), "as_of_date": as_of_date})
+    stock = {name: 0.0 for name in item_names}
+    stock.update({row.item_name: row.current_stock for row in rows})
+    return stock
+
+
+def _cash_balance_in(conn, as_of_date: str) -> float:
+    """Cash balance as of a date, read on an open connection."""
+    row = conn.execute(
+        text("""
+            SELECT COALESCE(SUM(CASE
+                WHEN transaction_type = 'sales' THEN price
+                WHEN transaction_type = 'stock_orders' THEN -price
+                ELSE 0
+            END), 0) AS cash
+            FROM transactions
+            WHERE transaction_date <= :as_of_date
+        """),
+        {"as_of_date": as_of_date},
+    ).fetchone()
+    return float(row.cash)
+
+
+def _inventory_rows_in(conn, item_names: List[str]) -> Dict[str, Dict]:
+    """Inventory reference rows (min stock level, unit price) for several items, keyed by item name."""
+    if not item_names:
+        return {}
+    query = text(
+        "SELECT item_name, unit_price, min_stock_level FROM inventory WHERE item_name IN :item_names"
+    ).bindparams(bindparam("item_names", expanding=True))
+    rows = conn.execute(query, {"item_names": list(set(item_names))})
+    return {row.item_name: dict(row._mapping) for row in rows}
+
+
+# Serializes ledger writers within this process, so threads queue on a lock instead of
+# polling SQLite's busy handler; BEGIN IMMEDIATE covers writers in other processes.
+_ledger_write_lock = threading.RLock()
+
+
+@contextmanager
+def ledger_write_transaction():
     """
-    Retrieve a snapshot of available inventory as of a specific date.
+    Open a connection holding the ledger write lock for a check-then-write sequence.
 
-    This function calculates the net quantity of each item by summing 
-    all stock orders and subtracting all sales up to and including the given date.
+    The transaction starts with BEGIN IMMEDIATE, so no other connection or process can
+    write between the caller's stock or cash check and its insert. Rows inserted with
+    `_insert_transactions` are dropped from `ledger_cache` once the transaction commits.
+
+    Yields:
+        Connection: A SQLAlchemy connection inside the write transaction.
+    """
+    with _ledger_write_lock, db_engine.connect() as conn:
+        conn.execution_options(sqlite_immediate=True)
+        try:
+            with conn.begin():
+                yield conn
+        finally:
+            written = conn.info.pop("ledger_rows", [])
+        for row in written:
+            ledger_cache.invalidate(row["item_name"], row["transaction_date"])
 
-    Only items with positive stock are included in the result.
+
+def _insert_transactions(conn, rows: List[Dict]) -> List[int]:
+    """
+    Insert several ledger rows on a connection from `ledger_write_transaction`.
 
     Args:
-        as_of_date (str): ISO-formatted date string (YYYY-MM-DD) representing the inventory cutoff.
+        conn: The connection yielded by `ledger_write_transaction`.
+        rows (List[Dict]): Rows with 'item_name', 'transaction_type', 'units', 'price'
+                           and 'transaction_date' keys.
 
     Returns:
-        Dict[str, int]: A dictionary mapping item names to their current stock levels.
-    """
-    # SQL query to compute stock levels per item as of the given date
-    query = """
-        SELECT
-            item_name,
-            SUM(CASE
-                WHEN transaction_type = 'stock_orders' THEN units
-                WHEN transaction_type = 'sales' THEN -units
-                ELSE 0
-            END) as stock
-        FROM transactions
-        WHERE item_name IS NOT NULL
-        AND transaction_date <= :as_of_date
-        GROUP BY item_name
-        HAVING stock > 0
+        List[int]: The IDs of the inserted transactions, in order.
     """
+    conn.info.setdefault("ledger_rows", []).extend(rows)
+    # Plain tuples on the driver cursor skip SQLAlchemy's per-statement compile and
+    # result wrapping; the cursor shares the connection's open transaction
+    cursor = conn.connection.driver_connection.cursor()
+    try:
+        transaction_ids = []
+        for row in rows:
+            cursor.execute(INSERT_TRANSACTION_SQL, (
+                row["item_name"], row["transaction_type"], row["units"], row["price"], row["transaction_date"],
+            ))
+            transaction_ids.append(cursor.lastrowid)
+        return transaction_ids
+    finally:
+        cursor.close()
 
-    # Execute the query with the date parameter
-    result = pd.read_sql(query, db_engine, params={"as_of_date": as_of_date})
 
-    # Convert the result into a dictionary {item_name: stock}
-    return dict(zip(result["item_name"], result["stock"]))
+# Seconds a soft hold placed at quote time stays active if no sale consumes it
+HOLD_TTL_SECONDS = 15 * 60
 
-def get_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> pd.DataFrame:
+
+def _held_units_in(conn, item_names: List[str], exclude_hold_id: Optional[str] = None) -> Dict[str, int]:
+    """Units of each item under active, unexpired holds, optionally ignoring one hold."""
+    if not item_names:
+        return {}
+    query = text("""
+        SELECT item_name, SUM(units) AS held
+        FROM stock_holds
+        WHERE item_name IN :item_names
+        AND status = 'active'
+        AND expires_at > :now
+        AND hold_id != :exclude_hold_id
+        GROUP BY item_name
+    """).bindparams(bindparam("item_names", expanding=True))
+    rows = conn.execute(query, {
+        "item_names": list(set(item_names)),
+        "now": time.time(),
+        "exclude_hold_id": exclude_hold_id or "",
+    })
+    held = {name: 0 for name in item_names}
+    held.update({row.item_name: int(row.held) for row in rows})
+    return held
+
+
+def _available_stock_in(
+    conn, item_names: List[str], as_of_date: str, hold_id: Optional[str] = None
+) -> Dict[str, float]:
+    """Stock of each item minus units held for other customers."""
+    stock = _stock_levels_in(conn, item_names, as_of_date)
+    held = _held_units_in(conn, item_names, exclude_hold_id=hold_id)
+    return {name: stock[name] - held[name] for name in item_names}
+
+
+# ----------------------------
+# Typed fast path for single-item lookups
+# ----------------------------
+# Tools checking or selling one item need a number or one row back, not a DataFrame.
+# These helpers run qmark SQL on the raw sqlite3 connection, which keeps each prepared
+# statement in its per-connection statement cache, and return small typed records.
+# The pandas helpers stay for reporting and multi-row results.
+
+ITEM_STOCK_SQL = f"""
+    SELECT COALESCE({STOCK_DELTA_SQL}, 0)
+    FROM transactions
+    WHERE item_name = ? AND transaction_date <= ?
+"""
+
+ITEM_HELD_SQL = """
+    SELECT COALESCE(SUM(units), 0)
+    FROM stock_holds
+    WHERE item_name = ? AND status = 'active' AND expires_at > ? AND hold_id != ?
+"""
+
+
+class StockRecord(NamedTuple):
+    """Net stock of one item as of a date."""
+    item_name: str
+    as_of_date: str
+    current_stock: int
+
+
+class InventoryItem(NamedTuple):
+    """One row of the inventory reference table."""
+    item_name: str
+    category: str
+    unit_price: float
+    min_stock_level: int
+
+
+@contextmanager
+def _raw_cursor():
+    """Borrow a pooled connection and yield a plain sqlite3 cursor on it (autocommit reads)."""
+    raw = db_engine.raw_connection()
+    try:
+        cursor = raw.driver_connection.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+    finally:
+        raw.close()
+
+
+def fetch_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> StockRecord:
     """
-    Retrieve the stock level of a specific item as of a given date.
+    Typed counterpart of `get_stock_level` for a single lookup, without pandas.
 
-    This function calculates the net stock by summing all 'stock_orders' and 
-    subtracting all 'sales' transactions for the specified item up to the given date.
+    Results are immutable, so they are served from `ledger_cache` without copying.
 
     Args:
         item_name (str): The name of the item to look up.
         as_of_date (str or datetime): The cutoff date (inclusive) for calculating stock.
 
     Returns:
-        pd.DataFrame: A single-row DataFrame with columns 'item_name' and 'current_stock'.
+        StockRecord: The item, the date and its whole-unit stock.
     """
-    # Convert date to ISO string format if it's a datetime object
     if isinstance(as_of_date, datetime):
         as_of_date = as_of_date.isoformat()
 
-    # SQL query to compute net stock level for the item
-    stock_query = """
-        SELECT
-            item_name,
-            COALESCE(SUM(CASE
-                WHEN transaction_type = 'stock_orders' THEN units
-                WHEN transaction_type = 'sales' THEN -units
-                ELSE 0
-            END), 0) AS current_stock
-        FROM transactions
-        WHERE item_name = :item_name
-        AND transaction_date <= :as_of_date
-    """
+    def compute():
+        with _raw_cursor() as cursor:
+            stock = cursor.execute(ITEM_STOCK_SQL, (item_name, as_of_date)).fetchone()[0]
+        return StockRecord(item_name, as_of_date, int(stock))
 
-    # Execute query and return result as a DataFrame
-    return pd.read_sql(
-        stock_query,
-        db_engine,
-        params={"item_name": item_name, "as_of_date": as_of_date},
-    )
+    return ledger_cache.get_or_compute("stock_record", item_name, as_of_date, compute)
 
-def get_supplier_delivery_date(input_date_str: str, quantity: int) -> str:
+
+def fetch_inventory_item(item_name: str) -> Optional[InventoryItem]:
     """
-    Estimate the supplier delivery date based on the requested order quantity and a starting date.
+    Look up one item in the inventory reference table.
 
-    Delivery lead time increases with order size:
-        - ≤10 units: same day
-        - 11–100 units: 1 day
-        - 101–1000 units: 4 days
-        - >1000 units: 7 days
+    The table is read once into records keyed by item name and then served from
+    `ledger_cache`, like `get_inventory_reference`.
 
     Args:
-        input_date_str (str): The starting date in ISO format (YYYY-MM-DD).
-        quantity (int): The number of units in the order.
+        item_name (str): The exact catalog name.
 
     Returns:
-        str: Estimated delivery date in ISO format (YYYY-MM-DD).
+        Optional[InventoryItem]: The item's reference row, or None if it is not stocked.
     """
-    # Debug log (comment out in production if needed)
-    print(f"FUNC (get_supplier_delivery_date): Calculating for qty {quantity} from date string '{input_date_str}'")
+    def compute():
+        with _raw_cursor() as cursor:
+            rows = cursor.execute("SELECT item_name, category, unit_price, min_stock_level FROM inventory")
+            return {
+                name: InventoryItem(name, category, float(unit_price), int(min_level))
+                for name, category, unit_price, min_level in rows
+            }
 
-    # Attempt to parse the input date
+    items = ledger_cache.get_or_compute(
+        "inventory_items", "", "", lambda: query_flight.do("inventory_items", compute)
+    )
+    return items.get(item_name)
+
+
+def _available_units_in(conn, item_name: str, as_of_date: str, hold_id: Optional[str] = None) -> float:
+    """Stock of one item minus units held for other customers, read inside a write transaction."""
+    cursor = conn.connection.driver_connection.cursor()
     try:
-        input_date_dt = datetime.fromisoformat(input_date_str.split("T")[0])
-    except (ValueError, TypeError):
-        # Fallback to current date on format error
-        print(f"WARN (get_supplier_delivery_date): Invalid date format '{input_date_str}', using today as base.")
-        input_date_dt = datetime.now()
+        stock = cursor.execute(ITEM_STOCK_SQL, (item_name, as_of_date)).fetchone()[0]
+        held = cursor.execute(ITEM_HELD_SQL, (item_name, time.time(), hold_id or "")).fetchone()[0]
+    finally:
+        cursor.close()
+    return stock - held
 
-    # Determine delivery delay based on quantity
-    if quantity <= 10:
-        days = 0
-    elif quantity <= 100:
-        days = 1
-    elif quantity <= 1000:
-        days = 4
-    else:
-        days = 7
+
+def create_stock_hold(
+    items: Dict[str, int], as_of_date: str, ttl_seconds: float = HOLD_TTL_SECONDS
+) -> Tuple[Optional[str], Dict[str, float]]:
+    """
+    Place a soft hold on stock for a quoted order.
+
+    Held units count as unavailable to every other sale until the hold is consumed by a
+    sale passing its ID, released, or expires after `ttl_seconds`.
+
+    Args:
+        items (Dict[str, int]): Units to hold per exact item name.
+        as_of_date (str): Date the stock is checked for, in ISO format.
+        ttl_seconds (float, optional): Lifetime of the hold. Default is `HOLD_TTL_SECONDS`.
+
+    Returns:
+        Tuple[Optional[str], Dict[str, float]]: The new hold ID (None if any item lacks
+        available stock) and the available stock per item before the hold.
+    """
+    now = time.time()
+    with ledger_write_transaction() as conn:
+        available = _available_stock_in(conn, list(items), as_of_date)
+        if any(available[name] < units for name, units in items.items()):
+            return None, available
+        hold_id = uuid.uuid4().hex[:8]
+        conn.execute(
+            text("""
+                INSERT INTO stock_holds (hold_id, item_name, units, created_at, expires_at)
+                VALUES (:hold_id, :item_name, :units, :created_at, :expires_at)
+            """),
+            [
+                {"hold_id": hold_id, "item_name": name, "units": units,
+                 "created_at": now, "expires_at": now + ttl_seconds}
+                for name, units in items.items()
+            ],
+        )
+    return hold_id, available
+
+
+def _consume_hold_in(conn, hold_id: str):
+    """Mark a hold as consumed by a sale, inside the sale's write transaction."""
+    conn.execute(
+        text("UPDATE stock_holds SET status = 'consumed' WHERE hold_id = :hold_id AND status = 'active'"),
+        {"hold_id": hold_id},
+    )
+
+
+def release_stock_hold(hold_id: str, status: str = "released") -> int:
+    """
+    End an active hold, e.g. when a customer declines a quote.
+
+    Args:
+        hold_id (str): ID returned by `create_stock_hold`.
+        status (str, optional): Final status to record ('released' or 'consumed').
+
+    Returns:
+        int: Number of held lines ended.
+    """
+    with db_engine.begin() as conn:
+        return conn.execute(
+            text("UPDATE stock_holds SET status = :status WHERE hold_id = :hold_id AND status = 'active'"),
+            {"status": status, "hold_id": hold_id},
+        ).rowcount
+
+
+def get_inventory_reference() -> pd.DataFrame:
+    """
+    Retrieve the inventory reference table (item name, category, unit price, min stock level).
+
+    The table only changes when the database is rebuilt or restored, which clears
+    `ledger_cache`, so it is read once and then served from the cache.
+
+    Returns:
+        pd.DataFrame: One row per stocked item.
+    """
+    reference = ledger_cache.get_or_compute(
+        "inventory_reference", "", "",
+        lambda: query_flight.do("inventory_reference", lambda: pd.read_sql("SELECT * FROM inventory", db_engine)),
+    )
+    return reference.copy()
+
+
+# Items at or below their minimum stock level are reordered up to this multiple of it
+REORDER_UP_TO_FACTOR = 2
+
+
+def plan_reorders(
+    as_of_date: str,
+    pending_demand: Optional[Dict[str, int]] = None,
+    place_orders: bool = True,
+    hold_id: Optional[str] = None,
+) -> Dict:
+    """
+    Plan, and optionally place, every stock order needed as of a date in one pass.
+
+    For each stocked item (plus any item in `pending_demand`) the projected stock is the
+    current stock minus units under active holds and minus the pending demand. If the
+    pending order already holds its stock, pass `hold_id` so those units are not counted
+    twice, once as held and once as demand. Items whose
+    projected stock is at or below their minimum level are reordered up to
+    `REORDER_UP_TO_FACTOR` times that level (or just the shortfall for items with no
+    minimum). Orders are grouped by supplier delivery date. Stock, holds and cash are read
+    and the orders written in one ledger transaction, and the combined cost is checked
+    against cash once: either every order is placed or none is.
+
+    Args:
+        as_of_date (str): Date the orders are placed (ISO format).
+        pending_demand (Dict[str, int], optional): Units about to be sold per catalog item,
+            e.g. the order being processed.
+        place_orders (bool, optional): Record the stock orders. If False, only plan them.
+        hold_id (str, optional): The pending order's stock hold, left out of the held units.
+
+    Returns:
+        Dict: 'orders' (one dict per item to reorder, with stock, held, demand,
+              min_stock_level, projected, quantity, cost and delivery_date),
+              'by_delivery_date' (item names per delivery date), 'total_cost', 'cash',
+              'placed' (whether the orders were recorded) and 'transaction_ids'.
+
+    Raises:
+        ValueError: If `pending_demand` names an item that is not in the catalog.
+    """
+    pending_demand = pending_demand or {}
+    catalog = {p["item_name"]: p for p in paper_supplies}
+    unknown = [name for name in pending_demand if name not in catalog]
+    if unknown:
+        raise ValueError(f"Not in the product catalog: {', '.join(unknown)}")
+
+    reference = get_inventory_reference()
+    min_levels = dict(zip(reference["item_name"], reference["min_stock_level"]))
+    names = list(dict.fromkeys(list(min_levels) + list(pending_demand)))
+
+    transaction = ledger_write_transaction() if place_orders else db_engine.connect()
+    with transaction as conn:
+        stock = _stock_levels_in(conn, names, as_of_date)
+        held = _held_units_in(conn, names, exclude_hold_id=hold_id)
+        cash = _cash_balance_in(conn, as_of_date)
+
+        orders = []
+        for name in names:
+            min_level = int(min_levels.get(name, 0))
+            projected = int(stock[name]) - held[name] - pending_demand.get(name, 0)
+            if projected > min_level:
+                continue
+            quantity = REORDER_UP_TO_FACTOR * min_level - projected if min_level else -projected
+            if quantity <= 0:
+                continue
+            orders.append({
+                "item_name": name,
+                "stock": int(stock[name]),
+                "held": held[name],
+                "demand": pending_demand.get(name, 0),
+                "min_stock_level": min_level,
+                "projected": projected,
+                "quantity": quantity,
+                "cost": quantity * catalog[name]["unit_price"],
+                "delivery_date": get_supplier_delivery_date(as_of_date, quantity),
+            })
+
+        total_cost = sum(order["cost"] for order in orders)
+        placed = place_orders and bool(orders) and total_cost <= cash
+        transaction_ids = []
+        if placed:
+            transaction_ids = _insert_transactions(conn, [
+                {
+                    "item_name": order["item_name"],
+                    "transaction_type": "stock_orders",
+                    "units": order["quantity"],
+                    "price": order["cost"],
+                    "transaction_date": as_of_date,
+                }
+                for order in orders
+            ])
+
+    by_delivery_date = {}
+    for order in sorted(orders, key=lambda order: order["delivery_date"]):
+        by_delivery_date.setdefault(order["delivery_date"], []).append(order["item_name"])
+
+    return {
+        "as_of_date": as_of_date,
+        "orders": orders,
+        "by_delivery_date": by_delivery_date,
+        "total_cost": total_cost,
+        "cash": cash,
+        "placed": placed,
+        "transaction_ids": transaction_ids,
+    }
+
+def _query_all_inventory(as_of_date: str) -> Dict[str, int]:
+    """Run the inventory snapshot query behind `get_all_inventory`, uncached."""
+    # SQL query to compute stock levels per item as of the given date
+    query = """
+        SELECT
+            item_name,
+            SUM(CASE
+                WHEN transaction_type = 'stock_orders' THEN units
+                WHEN transaction_type = 'sales' THEN -units
+                ELSE 0
+            END) as stock
+        FROM transactions
+        WHERE item_name IS NOT NULL
+        AND transaction_date <= :as_of_date
+        GROUP BY item_name
+        HAVING stock > 0
+    """
+
+    # Execute the query with the date parameter
+    result = pd.read_sql(query, db_engine, params={"as_of_date": as_of_date})
+
+    # Convert the result into a dictionary {item_name: stock}
+    return dict(zip(result["item_name"], result["stock"]))
+
+
+def get_all_inventory(as_of_date: str) -> Dict[str, int]:
+    """
+    Retrieve a snapshot of available inventory as of a specific date.
+
+    This function calculates the net quantity of each item by summing 
+    all stock orders and subtracting all sales up to and including the given date.
+
+    Only items with positive stock are included in the result. Repeated lookups between
+    writes are served from `ledger_cache`.
+
+    Args:
+        as_of_date (str): ISO-formatted date string (YYYY-MM-DD) representing the inventory cutoff.
+
+    Returns:
+        Dict[str, int]: A dictionary mapping item names to their current stock levels.
+    """
+    # Serve repeated lookups from the ledger cache and share concurrent misses;
+    # copy so callers can't mutate the shared result
+    return dict(ledger_cache.get_or_compute(
+        "all_inventory", None, as_of_date,
+        lambda: query_flight.do(("all_inventory", as_of_date), lambda: _query_all_inventory(as_of_date)),
+    ))
+
+def get_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> pd.DataFrame:
+    """
+    Retrieve the stock level of a specific item as of a given date.
+
+    This function calculates the net stock by summing all 'stock_orders' and 
+    subtracting all 'sales' transactions for the specified item up to the given date.
+    Repeated lookups between writes are served from `ledger_cache`.
+
+    Args:
+        item_name (str): The name of the item to look up.
+        as_of_date (str or datetime): The cutoff date (inclusive) for calculating stock.
+
+    Returns:
+        pd.DataFrame: A single-row DataFrame with columns 'item_name' and 'current_stock'.
+    """
+    # Convert date to ISO string format if it's a datetime object
+    if isinstance(as_of_date, datetime):
+        as_of_date = as_of_date.isoformat()
+
+    # SQL query to compute net stock level for the item
+    stock_query = """
+        SELECT
+            item_name,
+            COALESCE(SUM(CASE
+                WHEN transaction_type = 'stock_orders' THEN units
+                WHEN transaction_type = 'sales' THEN -units
+                ELSE 0
+            END), 0) AS current_stock
+        FROM transactions
+        WHERE item_name = :item_name
+        AND transaction_date <= :as_of_date
+    """
+
+    # Execute query (or serve it from the ledger cache) and return result as a DataFrame
+    stock_df = ledger_cache.get_or_compute(
+        "stock_level",
+        item_name,
+        as_of_date,
+        lambda: pd.read_sql(
+            stock_query,
+            db_engine,
+            params={"item_name": item_name, "as_of_date": as_of_date},
+        ),
+    )
+    return stock_df.copy()
+
+def get_supplier_delivery_date(input_date_str: str, quantity: int) -> str:
+    """
+    Estimate the supplier delivery date based on the requested order quantity and a starting date.
+
+    Delivery lead time increases with order size:
+        - ≤10 units: same day
+        - 11–100 units: 1 day
+        - 101–1000 units: 4 days
+        - >1000 units: 7 days
+
+    Args:
+        input_date_str (str): The starting date in ISO format (YYYY-MM-DD).
+        quantity (int): The number of units in the order.
+
+    Returns:
+        str: Estimated delivery date in ISO format (YYYY-MM-DD).
+    """
+    # Debug log (comment out in production if needed)
+    print(f"FUNC (get_supplier_delivery_date): Calculating for qty {quantity} from date string '{input_date_str}'")
+
+    # Attempt to parse the input date
+    try:
+        input_date_dt = datetime.fromisoformat(input_date_str.split("T")[0])
+    except (ValueError, TypeError):
+        # Fallback to current date on format error
+        print(f"WARN (get_supplier_delivery_date): Invalid date format '{input_date_str}', using today as base.")
+        input_date_dt = datetime.now()
+
+    # Determine delivery delay based on quantity
+    if quantity <= 10:
+        days = 0
+    elif quantity <= 100:
+        days = 1
+    elif quantity <= 1000:
+        days = 4
+    else:
+        days = 7
 
     # Add delivery days to the starting date
     delivery_date_dt = input_date_dt + timedelta(days=days)
@@ -439,12 +1468,31 @@ def get_supplier_delivery_date(input_date_str: str, quantity: int) -> str:
     # Return formatted delivery date
     return delivery_date_dt.strftime("%Y-%m-%d")
 
+def _query_cash_balance(as_of_date: str) -> float:
+    """Run the cash balance query behind `get_cash_balance`, uncached."""
+    # Query all transactions on or before the specified date
+    transactions = pd.read_sql(
+        "SELECT * FROM transactions WHERE transaction_date <= :as_of_date",
+        db_engine,
+        params={"as_of_date": as_of_date},
+    )
+
+    # Compute the difference between sales and stock purchases
+    if not transactions.empty:
+        total_sales = transactions.loc[transactions["transaction_type"] == "sales", "price"].sum()
+        total_purchases = transactions.loc[transactions["transaction_type"] == "stock_orders", "price"].sum()
+        return float(total_sales - total_purchases)
+
+    return 0.0
+
+
 def get_cash_balance(as_of_date: Union[str, datetime]) -> float:
     """
     Calculate the current cash balance as of a specified date.
 
     The balance is computed by subtracting total stock purchase costs ('stock_orders')
     from total revenue ('sales') recorded in the transactions table up to the given date.
+    Repeated lookups between writes are served from `ledger_cache`.
 
     Args:
         as_of_date (str or datetime): The cutoff date (inclusive) in ISO format or as a datetime object.
@@ -457,21 +1505,11 @@ def get_cash_balance(as_of_date: Union[str, datetime]) -> float:
         if isinstance(as_of_date, datetime):
             as_of_date = as_of_date.isoformat()
 
-        # Query all transactions on or before the specified date
-        transactions = pd.read_sql(
-            "SELECT * FROM transactions WHERE transaction_date <= :as_of_date",
-            db_engine,
-            params={"as_of_date": as_of_date},
+        return ledger_cache.get_or_compute(
+            "cash_balance", None, as_of_date,
+            lambda: query_flight.do(("cash_balance", as_of_date), lambda: _query_cash_balance(as_of_date)),
         )
 
-        # Compute the difference between sales and stock purchases
-        if not transactions.empty:
-            total_sales = transactions.loc[transactions["transaction_type"] == "sales", "price"].sum()
-            total_purchases = transactions.loc[transactions["transaction_type"] == "stock_orders", "price"].sum()
-            return float(total_sales - total_purchases)
-
-        return 0.0
-
     except Exception as e:
         print(f"Error getting cash balance: {e}")
         return 0.0
@@ -508,7 +1546,7 @@ def generate_financial_report(as_of_date: Union[str, datetime]) -> Dict:
     cash = get_cash_balance(as_of_date)
 
     # Get current inventory snapshot
-    inventory_df = pd.read_sql("SELECT * FROM inventory", db_engine)
+    inventory_df = get_inventory_reference()
     inventory_value = 0.0
     inventory_summary = []
 
@@ -527,16 +1565,7 @@ def generate_financial_report(as_of_date: Union[str, datetime]) -> Dict:
         })
 
     # Identify top-selling products by revenue
-    top_sales_query = """
-        SELECT item_name, SUM(units) as total_units, SUM(price) as total_revenue
-        FROM transactions
-        WHERE transaction_type = 'sales' AND transaction_date <= :date
-        GROUP BY item_name
-        ORDER BY total_revenue DESC
-        LIMIT 5
-    """
-    top_sales = pd.read_sql(top_sales_query, db_engine, params={"date": as_of_date})
-    top_selling_products = top_sales.to_dict(orient="records")
+    top_selling_products = get_top_selling_products(as_of_date).to_dict(orient="records")
 
     return {
         "as_of_date": as_of_date,
@@ -548,28 +1577,99 @@ def generate_financial_report(as_of_date: Union[str, datetime]) -> Dict:
     }
 
 
-def search_quote_history(search_terms: List[str], limit: int = 5) -> List[Dict]:
+def get_top_selling_products(as_of_date: Union[str, datetime], limit: int = 5) -> pd.DataFrame:
     """
-    Retrieve a list of historical quotes that match any of the provided search terms.
+    Retrieve the best-selling products by revenue up to a date, from the `sales_daily` aggregates.
 
-    The function searches both the original customer request (from `quote_requests`) and
-    the explanation for the quote (from `quotes`) for each keyword. Results are sorted by
-    most recent order date and limited by the `limit` parameter.
+    Args:
+        as_of_date (str or datetime): The cutoff date (inclusive).
+        limit (int, optional): Number of products to return. Default is 5.
+
+    Returns:
+        pd.DataFrame: Columns 'item_name', 'total_units' and 'total_revenue', highest revenue first.
+    """
+    if isinstance(as_of_date, datetime):
+        as_of_date = as_of_date.isoformat()
+
+    query = """
+        SELECT NULLIF(item_key, '') AS item_name, SUM(units) AS total_units, SUM(revenue) AS total_revenue
+        FROM sales_daily
+        WHERE sale_date <= :date
+        GROUP BY item_key
+        ORDER BY total_revenue DESC
+        LIMIT :limit
+    """
+    return pd.read_sql(query, db_engine, params={"date": as_of_date, "limit": limit})
+
+
+def get_sales_revenue(
+    start_date: Union[str, datetime],
+    end_date: Union[str, datetime],
+    item_name: Optional[str] = None,
+) -> Dict:
+    """
+    Total sales units and revenue in a date range, from the `sales_daily` aggregates.
 
     Args:
-        search_terms (List[str]): List of terms to match against customer requests and explanations.
-        limit (int, optional): Maximum number of quote records to return. Default is 5.
+        start_date (str or datetime): First date of the range (inclusive).
+        end_date (str or datetime): Last date of the range (inclusive).
+        item_name (str, optional): Restrict to one item. Default is all items.
 
     Returns:
-        List[Dict]: A list of matching quotes, each represented as a dictionary with fields:
-            - original_request
-            - total_amount
-            - quote_explanation
-            - job_type
-            - order_size
-            - event_type
-            - order_date
+        Dict: 'units' and 'revenue' sold in the range (0 if nothing was sold).
+    """
+    if isinstance(start_date, datetime):
+        start_date = start_date.isoformat()
+    if isinstance(end_date, datetime):
+        end_date = end_date.isoformat()
+
+    query = """
+        SELECT COALESCE(SUM(units), 0) AS units, COALESCE(SUM(revenue), 0) AS revenue
+        FROM sales_daily
+        WHERE sale_date >= :start AND sale_date <= :end
+    """
+    params = {"start": start_date, "end": end_date}
+    if item_name is not None:
+        query += " AND item_key = :item"
+        params["item"] = item_name
+    with db_engine.connect() as conn:
+        units, revenue = conn.execute(text(query), params).one()
+    return {"units": units, "revenue": revenue}
+
+
+def check_sales_aggregates(repair: bool = False, tolerance: float = 1e-6) -> pd.DataFrame:
+    """
+    Rebuild the sales aggregates from the raw ledger and compare them with `sales_daily`.
+
+    Args:
+        repair (bool, optional): Replace `sales_daily` with the rebuilt totals if they differ.
+        tolerance (float, optional): Largest allowed absolute difference per units/revenue value.
+
+    Returns:
+        pd.DataFrame: One row per (item_key, sale_date) that differs, with the stored and
+                      rebuilt values side by side. Empty if the aggregates are consistent.
     """
+    rebuilt = pd.read_sql(SALES_DAILY_FROM_LEDGER_SQL, db_engine)
+    stored = pd.read_sql("SELECT item_key, sale_date, units, revenue FROM sales_daily", db_engine)
+
+    # Missing keys, NULL totals and totals deleted back to zero all mean "no sales"
+    merged = stored.merge(rebuilt, on=["item_key", "sale_date"], how="outer", suffixes=("_stored", "_rebuilt"))
+    totals = merged[["units_stored", "units_rebuilt", "revenue_stored", "revenue_rebuilt"]].astype(float).fillna(0.0)
+    differs = (
+        ((totals["units_stored"] - totals["units_rebuilt"]).abs() > tolerance)
+        | ((totals["revenue_stored"] - totals["revenue_rebuilt"]).abs() > tolerance)
+    )
+    mismatches = merged[differs].reset_index(drop=True)
+
+    if repair and not mismatches.empty:
+        with ledger_write_transaction() as conn:
+            conn.execute(text("DELETE FROM sales_daily"))
+            conn.execute(text(f"INSERT INTO sales_daily (item_key, sale_date, units, revenue) {SALES_DAILY_FROM_LEDGER_SQL}"))
+    return mismatches
+
+
+def _query_quote_history(search_terms: List[str], limit: int) -> List[Dict]:
+    """Run the quote history search behind `search_quote_history`, uncoalesced."""
     conditions = []
     params = {}
 
@@ -607,36 +1707,1354 @@ def search_quote_history(search_terms: List[str], limit: int = 5) -> List[Dict]:
         result = conn.execute(text(query), params)
         return [dict(row._mapping) for row in result]
 
-########################
-########################
-########################
-# YOUR MULTI AGENT STARTS HERE
-########################
-########################
-########################
-
 
-# Set up and load your env parameters and instantiate your model.
+def search_quote_history(search_terms: List[str], limit: int = 5) -> List[Dict]:
+    """
+    Retrieve a list of historical quotes that match any of the provided search terms.
 
-dotenv.load_dotenv()
+    The function searches both the original customer request (from `quote_requests`) and
+    the explanation for the quote (from `quotes`) for each keyword. Results are sorted by
+    most recent order date and limited by the `limit` parameter.
 
-api_key = os.getenv("UDACITY_OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("Missing UDACITY_OPENAI_API_KEY in .env file")
+    Args:
+        search_terms (List[str]): List of terms to match against customer requests and explanations.
+        limit (int, optional): Maximum number of quote records to return. Default is 5.
 
-from smolagents import OpenAIServerModel, ToolCallingAgent, CodeAgent, tool
+    Returns:
+        List[Dict]: A list of matching quotes, each represented as a dictionary with fields:
+            - original_request
+            - total_amount
+            - quote_explanation
+            - job_type
+            - order_size
+            - event_type
+            - order_date
+    """
+    # Share the query with identical concurrent searches
+    matches = query_flight.do(
+        ("search_quote_history", tuple(search_terms), limit), lambda: _query_quote_history(search_terms, limit)
+    )
+    return [dict(match) for match in matches]
 
-model = OpenAIServerModel(
-    model_id="gpt-4o",
-    api_base="https://openai.vocareum.com/v1",
-    api_key=api_key,
-)
 
-"""Set up tools for your agents to use, these should be methods that combine the database functions above
- and apply criteria to them to ensure that the flow of the system is correct."""
+def get_discount_tiers() -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the bulk discount tiers from the 'discount_tiers' table.
 
+    Falls back to `DEFAULT_DISCOUNT_TIERS` if the table does not exist yet.
 
-# Tools for inventory agent
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Tier minimum quantities (ascending) and their discount rates.
+    """
+    try:
+        tiers = pd.read_sql("SELECT min_quantity, discount FROM discount_tiers ORDER BY min_quantity", db_engine)
+    except Exception:
+        tiers = pd.DataFrame(DEFAULT_DISCOUNT_TIERS, columns=["min_quantity", "discount"])
+    return tiers["min_quantity"].to_numpy(dtype=np.int64), tiers["discount"].to_numpy(dtype=np.float64)
+
+
+def price_quote_lines(
+    quote_ids: List,
+    item_names: List[str],
+    quantities: List[int],
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Price many quote lines, across any number of quotes, in one vectorized pass.
+
+    Item names are matched to the catalog case-insensitively with a single index lookup,
+    and each line's discount tier is found with `np.searchsorted` over the tier table
+    from `get_discount_tiers`. No Python loop runs per line.
+
+    Args:
+        quote_ids (List): The quote each line belongs to (any hashable labels).
+        item_names (List[str]): Item name of each line.
+        quantities (List[int]): Units of each line.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]:
+            - Per-line pricing with columns 'quote_id', 'requested_name', 'item_name', 'quantity',
+              'unit_price', 'subtotal', 'discount', 'discount_amount', 'line_total' and 'found'
+              (False for items not in the catalog; their amounts are NaN).
+            - Per-quote totals with columns 'quote_id' and 'total', summing the found lines.
+    """
+    catalog_names = [p["item_name"] for p in paper_supplies]
+    catalog_index = pd.Index([name.lower() for name in catalog_names])
+    catalog_prices = np.array([p["unit_price"] for p in paper_supplies], dtype=np.float64)
+
+    requested = pd.Series(item_names, dtype=object).astype(str)
+    quantity = np.asarray(quantities, dtype=np.int64)
+
+    # Catalog lookup: -1 marks names that are not in the catalog
+    positions = catalog_index.get_indexer(requested.str.lower())
+    found = positions >= 0
+    unit_price = np.where(found, catalog_prices[positions.clip(0)], np.nan)
+
+    # Discount tier lookup: index of the last tier whose minimum is <= quantity
+    tier_min, tier_discount = get_discount_tiers()
+    tier = np.searchsorted(tier_min, quantity, side="right") - 1
+    discount = np.where(tier >= 0, tier_discount[tier.clip(0)], 0.0)
+
+    subtotal = quantity * unit_price
+    discount_amount = subtotal * discount
+    line_total = subtotal - discount_amount
+
+    lines = pd.DataFrame({
+        "quote_id": list(quote_ids),
+        "requested_name": requested.to_numpy(),
+        "item_name": np.where(found, np.asarray(catalog_names, dtype=object)[positions.clip(0)], requested.to_numpy()),
+        "quantity": quantity,
+        "unit_price": unit_price,
+        "subtotal": subtotal,
+        "discount": discount,
+        "discount_amount": discount_amount,
+        "line_total": line_total,
+        "found": found,
+    })
+
+    codes, quote_labels = pd.factorize(lines["quote_id"])
+    totals = np.bincount(codes[found], weights=line_total[found], minlength=len(quote_labels))
+    quote_totals = pd.DataFrame({"quote_id": quote_labels, "total": totals})
+
+    return lines, quote_totals
+
+
+# Columnar (Parquet) snapshots of the ledger for offline analytics
+LEDGER_EXPORT_DIR = "ledger_export"
+
+# Source query and partition column for each exported table. The transactions table has no
+# populated id column, so its SQLite rowid is exported instead.
+LEDGER_EXPORT_TABLES = {
+    "transactions": (
+        "SELECT rowid AS id, item_name, transaction_type, units, price, transaction_date FROM transactions",
+        "transaction_date",
+    ),
+    "quotes": (
+        "SELECT request_id, total_amount, quote_explanation, order_date, job_type, order_size, event_type FROM quotes",
+        "order_date",
+    ),
+    "inventory": (
+        "SELECT item_name, category, unit_price, current_stock, min_stock_level FROM inventory",
+        None,
+    ),
+}
+
+
+def _ledger_export_schemas() -> Dict:
+    import pyarrow as pa
+
+    return {
+        "transactions": pa.schema([
+            ("id", pa.int64()),
+            ("item_name", pa.string()),
+            ("transaction_type", pa.string()),
+            ("units", pa.float64()),
+            ("price", pa.float64()),
+            ("transaction_date", pa.string()),
+            ("month", pa.string()),
+        ]),
+        "quotes": pa.schema([
+            ("request_id", pa.int64()),
+            ("total_amount", pa.float64()),
+            ("quote_explanation", pa.string()),
+            ("order_date", pa.string()),
+            ("job_type", pa.string()),
+            ("order_size", pa.string()),
+            ("event_type", pa.string()),
+            ("month", pa.string()),
+        ]),
+        "inventory": pa.schema([
+            ("item_name", pa.string()),
+            ("category", pa.string()),
+            ("unit_price", pa.float64()),
+            ("current_stock", pa.int64()),
+            ("min_stock_level", pa.int64()),
+        ]),
+    }
+
+
+def export_ledger_snapshot(out_dir: str = LEDGER_EXPORT_DIR, chunksize: int = CSV_CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Export the `transactions`, `quotes` and `inventory` tables to partitioned Parquet files.
+
+    Each table is read from the database `chunksize` rows at a time and written under
+    `out_dir/<table>/`. Transactions and quotes are partitioned by month (hive-style
+    `month=YYYY-MM` directories) so date-bounded reads can skip whole partitions. The
+    export is written to a temporary directory and swapped into place at the end, so
+    readers never see a partially written snapshot.
+
+    Requires `pyarrow`.
+
+    Args:
+        out_dir (str, optional): Destination directory. Default is `LEDGER_EXPORT_DIR`.
+        chunksize (int, optional): Rows read from SQLite per batch. Default is `CSV_CHUNK_SIZE`.
+
+    Returns:
+        Dict[str, int]: Number of rows exported per table.
+    """
+    import shutil
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    schemas = _ledger_export_schemas()
+    tmp_dir = f"{out_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    exported = {}
+
+    for table, (query, date_column) in LEDGER_EXPORT_TABLES.items():
+        schema = schemas[table]
+        exported[table] = 0
+
+        def batches():
+            for chunk in pd.read_sql(query, db_engine, chunksize=chunksize):
+                if date_column is not None:
+                    chunk["month"] = chunk[date_column].astype(str).str[:7]
+                exported[table] += len(chunk)
+                yield from pa.Table.from_pandas(chunk, schema=schema, preserve_index=False).to_batches()
+
+        ds.write_dataset(
+            batches(),
+            os.path.join(tmp_dir, table),
+            schema=schema,
+            format="parquet",
+            partitioning=["month"] if date_column is not None else None,
+            partitioning_flavor="hive" if date_column is not None else None,
+        )
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return exported
+
+
+def open_ledger_snapshot(snapshot_dir: str = LEDGER_EXPORT_DIR) -> Dict:
+    """
+    Open an exported ledger snapshot for reading, with files memory-mapped.
+
+    No data is loaded by this call; scans over the returned datasets read memory-mapped
+    Parquet pages on demand and never touch the operational database.
+
+    Requires `pyarrow`.
+
+    Args:
+        snapshot_dir (str, optional): Directory written by `export_ledger_snapshot`.
+
+    Returns:
+        Dict: Maps 'transactions', 'quotes' and 'inventory' to `pyarrow.dataset.Dataset` objects.
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    filesystem = fs.LocalFileSystem(use_mmap=True)
+    schemas = _ledger_export_schemas()
+    return {
+        table: ds.dataset(
+            os.path.join(snapshot_dir, table),
+            schema=schemas[table],
+            format="parquet",
+            filesystem=filesystem,
+            partitioning="hive" if date_column is not None else None,
+        )
+        for table, (_, date_column) in LEDGER_EXPORT_TABLES.items()
+    }
+
+
+def aggregate_ledger_snapshot(
+    dataset,
+    group_by: List[str],
+    sum_columns: List[str],
+    filter=None,
+) -> pd.DataFrame:
+    """
+    Sum columns of a snapshot dataset per group, one record batch at a time.
+
+    Only the grouping and summed columns are read, and each batch is reduced to partial
+    sums before the next one is scanned, so memory use is bounded by the number of groups
+    rather than the size of the ledger.
+
+    Args:
+        dataset (pyarrow.dataset.Dataset): A dataset from `open_ledger_snapshot`.
+        group_by (List[str]): Columns to group on.
+        sum_columns (List[str]): Numeric columns to sum per group.
+        filter (pyarrow.dataset.Expression, optional): Row filter, e.g. a date bound.
+
+    Returns:
+        pd.DataFrame: One row per group with the `group_by` columns and the summed columns.
+    """
+    import pyarrow as pa
+
+    aggregations = [(col, "sum") for col in sum_columns]
+    partials = []
+    for batch in dataset.to_batches(columns=group_by + sum_columns, filter=filter):
+        if batch.num_rows:
+            partials.append(pa.Table.from_batches([batch]).group_by(group_by).aggregate(aggregations))
+
+    if not partials:
+        return pd.DataFrame(columns=group_by + sum_columns)
+
+    # Combine the per-batch partial sums; nulls are skipped, like SQL SUM
+    combined = pa.concat_tables(partials).rename_columns(group_by + sum_columns)
+    totals = combined.group_by(group_by).aggregate(aggregations).rename_columns(group_by + sum_columns)
+    return totals.to_pandas()
+
+
+def snapshot_financial_report(as_of_date: Union[str, datetime], snapshot_dir: str = LEDGER_EXPORT_DIR) -> Dict:
+    """
+    Build a `generate_financial_report`-style report from an exported ledger snapshot.
+
+    Runs entirely over the memory-mapped Parquet files: month partitions after the report
+    date are skipped, and the ledger is reduced batch by batch.
+
+    Args:
+        as_of_date (str or datetime): The date (inclusive) for which to generate the report.
+        snapshot_dir (str, optional): Directory written by `export_ledger_snapshot`.
+
+    Returns:
+        Dict: The same fields as `generate_financial_report`.
+    """
+    import pyarrow.dataset as ds
+
+    if isinstance(as_of_date, datetime):
+        as_of_date = as_of_date.isoformat()
+
+    snapshot = open_ledger_snapshot(snapshot_dir)
+    transactions = snapshot["transactions"]
+    date_filter = (ds.field("month") <= as_of_date[:7]) & (ds.field("transaction_date") <= as_of_date)
+
+    by_type = aggregate_ledger_snapshot(transactions, ["transaction_type"], ["price"], date_filter)
+    type_totals = dict(zip(by_type["transaction_type"], by_type["price"]))
+    cash = float(type_totals.get("sales", 0.0) - type_totals.get("stock_orders", 0.0))
+
+    by_item = aggregate_ledger_snapshot(
+        transactions, ["item_name", "transaction_type"], ["units", "price"], date_filter
+    )
+    stock = {}
+    for row in by_item.itertuples(index=False):
+        sign = 1 if row.transaction_type == "stock_orders" else -1 if row.transaction_type == "sales" else 0
+        stock[row.item_name] = stock.get(row.item_name, 0.0) + sign * (row.units or 0.0)
+
+    inventory_df = snapshot["inventory"].to_table(columns=["item_name", "unit_price"]).to_pandas()
+    inventory_value = 0.0
+    inventory_summary = []
+    for item in inventory_df.itertuples(index=False):
+        item_stock = stock.get(item.item_name, 0.0)
+        item_value = item_stock * item.unit_price
+        inventory_value += item_value
+        inventory_summary.append({
+            "item_name": item.item_name,
+            "stock": item_stock,
+            "unit_price": item.unit_price,
+            "value": item_value,
+        })
+
+    sales = by_item[by_item["transaction_type"] == "sales"]
+    top_sales = (
+        sales.rename(columns={"units": "total_units", "price": "total_revenue"})
+        .sort_values("total_revenue", ascending=False)
+        .head(5)[["item_name", "total_units", "total_revenue"]]
+    )
+
+    return {
+        "as_of_date": as_of_date,
+        "cash_balance": cash,
+        "inventory_value": inventory_value,
+        "total_assets": cash + inventory_value,
+        "inventory_summary": inventory_summary,
+        "top_selling_products": top_sales.to_dict(orient="records"),
+    }
+
+
+# Confidence assigned to a mapping the first time an agent records it, and the boost it
+# gets each time the same mapping is confirmed again
+LEARNED_ALIAS_CONFIDENCE = 0.8
+ALIAS_CONFIRMATION_BOOST = 0.05
+
+
+def normalize_item_phrase(phrase: str) -> str:
+    """Lowercase a customer item phrase and collapse punctuation and whitespace."""
+    return " ".join(re.sub(r"[^\w\s-]", " ", phrase.lower()).split())
+
+
+class ItemAliasStore:
+    """
+    Persistent map from customer item phrases to exact catalog item names.
+
+    Each mapping records a confidence and a hit count. Exact catalog names always resolve
+    to themselves without touching the database; they are counted as catalog matches, not
+    as hits, so the hit rate only covers phrases that needed a learned mapping.
+    `reset_stats` starts a new run.
+    """
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._lock = threading.RLock()
+        self._aliases = None  # phrase -> item_name, loaded lazily
+        self._pattern = None
+        self.hits = 0
+        self.misses = 0
+        self.catalog_matches = 0
+
+    def _load(self) -> Dict[str, str]:
+        with self._lock:
+            if self._aliases is None:
+                with self.engine.begin() as conn:
+                    conn.execute(text("""
+                        CREATE TABLE IF NOT EXISTS item_aliases (
+                            phrase TEXT PRIMARY KEY,
+                            item_name TEXT NOT NULL,
+                            confidence REAL NOT NULL,
+                            hits INTEGER NOT NULL DEFAULT 0,
+                            created_at TEXT NOT NULL,
+                            last_used_at TEXT
+                        )
+                    """))
+                    rows = conn.execute(text("SELECT phrase, item_name FROM item_aliases")).fetchall()
+                self._aliases = {row.phrase: row.item_name for row in rows}
+            return self._aliases
+
+    def lookup(self, phrase: str) -> Union[Dict, None]:
+        """
+        Resolve a customer phrase to a catalog item.
+
+        Args:
+            phrase (str): The item phrase as written by the customer.
+
+        Returns:
+            Dict or None: 'phrase', 'item_name' and 'confidence' if the phrase is a catalog
+            name or a learned mapping, otherwise None.
+        """
+        key = normalize_item_phrase(phrase)
+        catalog_name = _catalog_names_by_key().get(key)
+        if catalog_name is not None:
+            with self._lock:
+                self.catalog_matches += 1
+            return {"phrase": key, "item_name": catalog_name, "confidence": 1.0}
+
+        if key not in self._load():
+            with self._lock:
+                self.misses += 1
+            return None
+
+        now = datetime.now().isoformat()
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("UPDATE item_aliases SET hits = hits + 1, last_used_at = :now WHERE phrase = :phrase"),
+                {"now": now, "phrase": key},
+            )
+            row = conn.execute(
+                text("SELECT item_name, confidence FROM item_aliases WHERE phrase = :phrase"),
+                {"phrase": key},
+            ).fetchone()
+        with self._lock:
+            self.hits += 1
+        return {"phrase": key, "item_name": row.item_name, "confidence": row.confidence}
+
+    def record(self, phrase: str, item_name: str) -> Dict:
+        """
+        Store (or confirm) a mapping from a customer phrase to a catalog item.
+
+        Confirming an existing mapping raises its confidence; mapping a known phrase to a
+        different item replaces it and resets the confidence.
+
+        Args:
+            phrase (str): The item phrase as written by the customer.
+            item_name (str): The catalog item it refers to (matched case-insensitively).
+
+        Returns:
+            Dict: The stored 'phrase', 'item_name' and 'confidence'.
+
+        Raises:
+            ValueError: If `item_name` is not in the product catalog.
+        """
+        catalog_name = _catalog_names_by_key().get(normalize_item_phrase(item_name))
+        if catalog_name is None:
+            raise ValueError(f"'{item_name}' is not in the product catalog")
+
+        key = normalize_item_phrase(phrase)
+        aliases = self._load()
+        now = datetime.now().isoformat()
+        with self._lock, self.engine.begin() as conn:
+            row = conn.execute(
+                text("SELECT item_name, confidence FROM item_aliases WHERE phrase = :phrase"),
+                {"phrase": key},
+            ).fetchone()
+            if row is not None and row.item_name == catalog_name:
+                confidence = min(1.0, row.confidence + ALIAS_CONFIRMATION_BOOST)
+            else:
+                confidence = LEARNED_ALIAS_CONFIDENCE
+            conn.execute(
+                text("""
+                    INSERT INTO item_aliases (phrase, item_name, confidence, hits, created_at)
+                    VALUES (:phrase, :item_name, :confidence, 0, :now)
+                    ON CONFLICT (phrase) DO UPDATE SET item_name = :item_name, confidence = :confidence
+                """),
+                {"phrase": key, "item_name": catalog_name, "confidence": confidence, "now": now},
+            )
+            aliases[key] = catalog_name
+            self._pattern = None
+        return {"phrase": key, "item_name": catalog_name, "confidence": confidence}
+
+    def match_text(self, request_text: str) -> Dict[str, str]:
+        """
+        Find every learned phrase that appears in a free-text request.
+
+        Used to hand the agents known mappings before any model call. Each phrase found
+        counts as a hit.
+
+        Args:
+            request_text (str): The customer's request.
+
+        Returns:
+            Dict[str, str]: Matched phrase -> catalog item name.
+        """
+        aliases = self._load()
+        with self._lock:
+            if self._pattern is None and aliases:
+                phrases = sorted(aliases, key=len, reverse=True)
+                self._pattern = re.compile(r"\b(" + "|".join(re.escape(p) for p in phrases) + r")\b")
+            pattern = self._pattern
+        if pattern is None:
+            return {}
+
+        matches = {}
+        for phrase in pattern.findall(normalize_item_phrase(request_text)):
+            if phrase not in matches:
+                matches[phrase] = self.lookup(phrase)["item_name"]
+        return matches
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.catalog_matches = 0
+
+    def stats(self) -> Dict:
+        """Return learned-mapping hits, misses and hit rate, exact catalog matches, and learned phrase count."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "catalog_matches": self.catalog_matches,
+                "learned_phrases": len(self._aliases or {}),
+            }
+
+
+def _catalog_names_by_key() -> Dict[str, str]:
+    """Map each normalized catalog item name to its exact name."""
+    return {normalize_item_phrase(p["item_name"]): p["item_name"] for p in paper_supplies}
+
+
+item_alias_store = ItemAliasStore(alias_engine)
+
+# ----------------------------
+# Async data access
+# ----------------------------
+
+# Threads doing database work for async callers; kept within the engine's connection pool size (5)
+DB_EXECUTOR_WORKERS = 4
+
+
+class AsyncThreadExecutor:
+    """
+    Runs blocking functions on a small dedicated thread pool for asyncio callers.
+
+    At most `max_workers` calls run at once (for `db_executor`, at most that many hold a
+    database connection); further calls queue without blocking the event loop. Cancelling
+    the awaiting task drops a call that is still queued; a call that has already started
+    runs to completion, so a write is never left half-done. The caller's context variables
+    are carried into the worker thread. The pool is created on first use, so forked worker
+    processes start without one.
+    """
+
+    def __init__(self, max_workers: int = DB_EXECUTOR_WORKERS, name: str = "db"):
+        self.max_workers = max_workers
+        self.name = name
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            return self._pool
+
+    async def run(self, fn, *args, **kwargs):
+        """Await `fn(*args, **kwargs)` run on the pool."""
+        import asyncio
+        import functools
+
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._executor(), call)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Start `fn(*args, **kwargs)` on the pool and return its `concurrent.futures.Future`.
+
+        Unlike `run`, the call is not tied to an awaiting task and is never dropped by a
+        cancellation.
+        """
+        return self._executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def close(self, cancel_pending: bool = True):
+        """Shut the pool down, dropping queued calls unless `cancel_pending` is False."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=cancel_pending)
+                self._pool = None
+
+
+# Shared by the async helpers below
+db_executor = AsyncThreadExecutor()
+
+# Runs `SingleFlight.do_async` leaders; separate from db_executor, whose workers may be the
+# ones blocked waiting for a leader's result
+flight_executor = AsyncThreadExecutor(name="flight")
+
+
+def _async_helper(fn):
+    """Async counterpart of a blocking helper: same arguments and result, run on `db_executor`."""
+    import functools
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await db_executor.run(fn, *args, **kwargs)
+
+    wrapper.__doc__ = f"Async version of `{fn.__name__}`; awaits it on `db_executor`.\n\n{fn.__doc__ or ''}"
+    return wrapper
+
+
+async def aget_all_inventory(as_of_date: str) -> Dict[str, int]:
+    """
+    Async version of `get_all_inventory`.
+
+    Shares `ledger_cache` with the blocking helper, and a cache miss joins the same
+    `query_flight` call as concurrent thread or asyncio callers for that date.
+    """
+    inventory = await ledger_cache.aget_or_compute(
+        "all_inventory", None, as_of_date,
+        lambda: query_flight.do_async(("all_inventory", as_of_date), lambda: _query_all_inventory(as_of_date)),
+    )
+    return dict(inventory)
+
+
+async def aget_cash_balance(as_of_date: Union[str, datetime]) -> float:
+    """
+    Async version of `get_cash_balance`.
+
+    Shares `ledger_cache` and `query_flight` with the blocking helper, and likewise returns
+    0.0 if the query fails.
+    """
+    try:
+        if isinstance(as_of_date, datetime):
+            as_of_date = as_of_date.isoformat()
+
+        return await ledger_cache.aget_or_compute(
+            "cash_balance", None, as_of_date,
+            lambda: query_flight.do_async(("cash_balance", as_of_date), lambda: _query_cash_balance(as_of_date)),
+        )
+
+    except Exception as e:
+        print(f"Error getting cash balance: {e}")
+        return 0.0
+
+
+async def asearch_quote_history(search_terms: List[str], limit: int = 5) -> List[Dict]:
+    """Async version of `search_quote_history`; identical concurrent searches share one query."""
+    matches = await query_flight.do_async(
+        ("search_quote_history", tuple(search_terms), limit), lambda: _query_quote_history(search_terms, limit)
+    )
+    return [dict(match) for match in matches]
+
+
+aget_stock_level = _async_helper(get_stock_level)
+acreate_transaction = _async_helper(create_transaction)
+agenerate_financial_report = _async_helper(generate_financial_report)
+aget_top_selling_products = _async_helper(get_top_selling_products)
+aplan_reorders = _async_helper(plan_reorders)
+
+
+# ----------------------------
+# Partitioned multi-process ledger execution
+# ----------------------------
+
+# Events sent to a shard per message, and message batches a shard may have queued
+SHARD_BATCH_SIZE = 256
+SHARD_MAX_IN_FLIGHT = 8
+
+
+def generate_synthetic_workload(
+    num_events: int = 20000,
+    seed: int = 7,
+    start_date: str = "2025-01-02",
+    days: int = 180,
+    sale_ratio: float = 0.85,
+) -> List[Dict]:
+    """
+    Generate a date-ordered stream of sale and restock events across the whole catalog.
+
+    Args:
+        num_events (int, optional): Number of events.
+        seed (int, optional): Random seed for reproducibility.
+        start_date (str, optional): Date of the first event (ISO format).
+        days (int, optional): Number of days the events are spread over.
+        sale_ratio (float, optional): Fraction of events that are sales; the rest are restocks.
+
+    Returns:
+        List[Dict]: Events with 'seq', 'type' ('sale' or 'restock'), 'item_name', 'units',
+                    'price' (total) and 'date' keys, in processing order.
+    """
+    rng = np.random.default_rng(seed)
+    item_index = rng.integers(0, len(paper_supplies), num_events)
+    is_sale = rng.random(num_events) < sale_ratio
+    sale_units = rng.integers(1, 300, num_events)
+    restock_units = rng.integers(200, 2000, num_events)
+    start = datetime.fromisoformat(start_date)
+
+    events = []
+    for seq in range(num_events):
+        item = paper_supplies[item_index[seq]]
+        units = int(sale_units[seq] if is_sale[seq] else restock_units[seq])
+        events.append({
+            "seq": seq,
+            "type": "sale" if is_sale[seq] else "restock",
+            "item_name": item["item_name"],
+            "units": units,
+            "price": units * item["unit_price"],
+            "date": (start + timedelta(days=seq * days // num_events)).strftime("%Y-%m-%d"),
+        })
+    return events
+
+
+def _event_row(event: Dict) -> Dict:
+    return {
+        "item_name": event["item_name"],
+        "transaction_type": "sales" if event["type"] == "sale" else "stock_orders",
+        "units": event["units"],
+        "price": event["price"],
+        "transaction_date": event["date"],
+    }
+
+
+def run_workload_sequential(events: List[Dict], batch_size: int = SHARD_BATCH_SIZE) -> Dict[int, bool]:
+    """
+    Apply a workload in one process, in order, with the same checks as the tools.
+
+    A sale succeeds if the item has enough stock as of its date; a restock succeeds if the
+    cash balance as of its date covers it. This does the same work as `run_workload_sharded`
+    without the extra processes: the same stock and insert statements, cash kept as a
+    running balance from the first event's date (events are in date order), and
+    `batch_size` events per commit. `batch_size=1` commits every event on its own, as the
+    tools do.
+
+    Args:
+        events (List[Dict]): Events from `generate_synthetic_workload`.
+        batch_size (int, optional): Events per write transaction.
+
+    Returns:
+        Dict[int, bool]: Whether each event (by 'seq') was applied.
+    """
+    with db_engine.connect() as conn:
+        cash = _cash_balance_in(conn, min(event["date"] for event in events))
+
+    outcomes = {}
+    for start in range(0, len(events), batch_size):
+        with ledger_write_transaction() as conn:
+            cursor = conn.connection.driver_connection.cursor()
+            try:
+                for event in events[start:start + batch_size]:
+                    if event["type"] == "sale":
+                        stock = cursor.execute(ITEM_STOCK_SQL, (event["item_name"], event["date"])).fetchone()[0]
+                        ok = stock >= event["units"]
+                    else:
+                        ok = event["price"] <= cash
+                    if ok:
+                        _insert_transactions(conn, [_event_row(event)])
+                        cash += event["price"] if event["type"] == "sale" else -event["price"]
+                    outcomes[event["seq"]] = ok
+            finally:
+                cursor.close()
+    return outcomes
+
+
+def _ledger_shard_worker(shard_id: int, db_path: str, inbox, outbox):
+    """
+    Process loop of one ledger shard.
+
+    Owns a private copy of the ledger for its items. Receives batches of events in
+    workload order; sales are checked against the shard's own stock, restocks arrive
+    already approved by the cash coordinator. Each batch is committed in one transaction
+    and answered with the (seq, applied) outcome of every event.
+    """
+    db = sqlite3.connect(db_path, isolation_level=None)
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            break
+        outcomes = []
+        db.execute("BEGIN")
+        for event in batch:
+            if event["type"] == "sale":
+                ok = db.execute(ITEM_STOCK_SQL, (event["item_name"], event["date"])).fetchone()[0] >= event["units"]
+                tx_type = "sales"
+            else:
+                ok, tx_type = True, "stock_orders"
+            if ok:
+                db.execute(INSERT_TRANSACTION_SQL, (event["item_name"], tx_type, event["units"], event["price"], event["date"]))
+            outcomes.append((event["seq"], ok))
+        db.execute("COMMIT")
+        outbox.put((shard_id, outcomes))
+    db.close()
+
+
+def shard_for_items(num_shards: int, shard_key: str = "category") -> Dict[str, int]:
+    """
+    Assign every catalog item to a shard.
+
+    Args:
+        num_shards (int): Number of shards.
+        shard_key (str, optional): 'category' (one shard per catalog category, wrapping
+            around if there are fewer shards) or 'hash' (stable hash of the item name).
+
+    Returns:
+        Dict[str, int]: Shard index per item name.
+    """
+    import zlib
+
+    if shard_key == "category":
+        categories = list(dict.fromkeys(p["category"] for p in paper_supplies))
+        return {p["item_name"]: categories.index(p["category"]) % num_shards for p in paper_supplies}
+    if shard_key == "hash":
+        return {p["item_name"]: zlib.crc32(p["item_name"].encode()) % num_shards for p in paper_supplies}
+    raise ValueError("shard_key must be 'category' or 'hash'")
+
+
+def run_workload_sharded(
+    events: List[Dict],
+    num_shards: int = 4,
+    shard_key: str = "category",
+    batch_size: int = SHARD_BATCH_SIZE,
+) -> Dict[int, bool]:
+    """
+    Apply a workload across a pool of shard processes, with results identical to `run_workload_sequential`.
+
+    Each shard process owns the stock of its items (see `shard_for_items`) and a private
+    copy of the ledger. Stock for one item only depends on events for that item, so every
+    shard can check its sales independently. The cash balance is shared, so this process
+    acts as the cash coordinator. It approves a restock at once if the cash confirmed so
+    far covers it. Pending sales can only add cash, so that approval always matches the
+    sequential run. Otherwise it waits for every outstanding sale outcome and decides on
+    the exact balance.
+
+    Only the stock checks and the writes to the shard copies run in parallel. When the run
+    finishes, this process writes the applied events to the main ledger serially, in
+    workload order, and that merge is part of the elapsed time.
+
+    Args:
+        events (List[Dict]): Events from `generate_synthetic_workload`, in date order.
+        num_shards (int, optional): Number of shard processes.
+        shard_key (str, optional): 'category' or 'hash'; see `shard_for_items`.
+        batch_size (int, optional): Events per message sent to a shard.
+
+    Returns:
+        Dict[int, bool]: Whether each event (by 'seq') was applied.
+    """
+    import multiprocessing
+    import shutil
+    import tempfile
+
+    shard_of = shard_for_items(num_shards, shard_key)
+    start_date = min(event["date"] for event in events)
+    with db_engine.connect() as conn:
+        confirmed_cash = _cash_balance_in(conn, start_date)
+
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    work_dir = tempfile.mkdtemp(prefix="ledger_shards_")
+    base_path = save_database_snapshot(db_engine, os.path.join(work_dir, "base.db"))
+    outbox = context.Queue()
+    inboxes, workers = [], []
+    for shard_id in range(num_shards):
+        shard_path = os.path.join(work_dir, f"shard_{shard_id}.db")
+        shutil.copyfile(base_path, shard_path)
+        inbox = context.Queue()
+        worker = context.Process(target=_ledger_shard_worker, args=(shard_id, shard_path, inbox, outbox))
+        worker.start()
+        inboxes.append(inbox)
+        workers.append(worker)
+
+    by_seq = {event["seq"]: event for event in events}
+    outcomes = {}
+    buffers = [[] for _ in range(num_shards)]
+    in_flight = [0] * num_shards
+
+    def receive_one():
+        nonlocal confirmed_cash
+        shard_id, shard_outcomes = outbox.get()
+        in_flight[shard_id] -= 1
+        for seq, ok in shard_outcomes:
+            outcomes[seq] = ok
+            if ok and by_seq[seq]["type"] == "sale":
+                confirmed_cash += by_seq[seq]["price"]
+
+    def flush(shard_id):
+        if buffers[shard_id]:
+            while in_flight[shard_id] >= SHARD_MAX_IN_FLIGHT:
+                receive_one()
+            inboxes[shard_id].put(buffers[shard_id])
+            in_flight[shard_id] += 1
+            buffers[shard_id] = []
+
+    def drain():
+        for shard_id in range(num_shards):
+            flush(shard_id)
+        while any(in_flight):
+            receive_one()
+
+    try:
+        for event in events:
+            shard_id = shard_of[event["item_name"]]
+            if event["type"] == "restock":
+                if event["price"] > confirmed_cash:
+                    # Not covered by confirmed cash: wait for every earlier sale, then decide exactly
+                    drain()
+                if event["price"] > confirmed_cash:
+                    outcomes[event["seq"]] = False
+                    continue
+                confirmed_cash -= event["price"]
+            buffers[shard_id].append(event)
+            if len(buffers[shard_id]) >= batch_size:
+                flush(shard_id)
+        drain()
+    finally:
+        for inbox in inboxes:
+            inbox.put(None)
+        for worker in workers:
+            worker.join()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Merge the applied events into the main ledger in workload order
+    rows = [_event_row(by_seq[seq]) for seq in sorted(outcomes) if outcomes[seq]]
+    with ledger_write_transaction() as conn:
+        _insert_transactions(conn, rows)
+    return outcomes
+
+########################
+########################
+########################
+# YOUR MULTI AGENT STARTS HERE
+########################
+########################
+########################
+
+
+# Set up and load your env parameters and instantiate your model.
+
+dotenv.load_dotenv()
+
+api_key = os.getenv("UDACITY_OPENAI_API_KEY")
+if not api_key:
+    raise ValueError("Missing UDACITY_OPENAI_API_KEY in .env file")
+
+from smolagents import OpenAIServerModel, ToolCallingAgent, CodeAgent, tool
+from smolagents.models import Model
+
+# OpenAI-compatible endpoint and model, overridable e.g. to point at a local stand-in server
+MODEL_API_BASE = os.getenv("OPENAI_API_BASE", "https://openai.vocareum.com/v1")
+MODEL_ID = os.getenv("OPENAI_MODEL_ID", "gpt-4o")
+
+model = OpenAIServerModel(
+    model_id=MODEL_ID,
+    api_base=MODEL_API_BASE,
+    api_key=api_key,
+)
+
+
+# ----------------------------
+# Per-agent model routing
+# ----------------------------
+
+# JSON routing config, or a path to a JSON file, e.g.
+# {"models": {"fast": {"model_id": "gpt-4o-mini"}, "strong": {"model_id": "gpt-4o"}},
+#  "agents": {"inventory_agent": ["fast", "strong"], "order_agent": ["fast", "strong"]},
+#  "default": ["strong"]}
+# Each agent tries its models in order, falling back on errors and malformed tool calls.
+MODEL_ROUTING_ENV = "MODEL_ROUTING"
+
+
+class ModelCallStats:
+    """Thread-safe per-model counters of calls, failures, latency and tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.models = {}
+        self.fallbacks = {}
+
+    def record(self, model_name: str, seconds: float, outcome: str, token_usage=None):
+        with self._lock:
+            stats = self.models.setdefault(model_name, {
+                "calls": 0, "ok": 0, "malformed": 0, "errors": 0,
+                "seconds": 0.0, "input_tokens": 0, "output_tokens": 0,
+            })
+            stats["calls"] += 1
+            stats[outcome] += 1
+            stats["seconds"] += seconds
+            if token_usage is not None:
+                stats["input_tokens"] += token_usage.input_tokens
+                stats["output_tokens"] += token_usage.output_tokens
+
+    def record_fallback(self, agent_name: str):
+        with self._lock:
+            self.fallbacks[agent_name] = self.fallbacks.get(agent_name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.models = {}
+            self.fallbacks = {}
+
+    def summary(self) -> pd.DataFrame:
+        """One row per model with call counts, failure rate and mean latency."""
+        with self._lock:
+            rows = [{"model": name, **stats} for name, stats in self.models.items()]
+        summary = pd.DataFrame(rows)
+        if not summary.empty:
+            summary["failure_rate"] = (summary["malformed"] + summary["errors"]) / summary["calls"]
+            summary["mean_seconds"] = summary["seconds"] / summary["calls"]
+        return summary
+
+
+# Shared by every RoutedModel unless one is given its own
+model_call_stats = ModelCallStats()
+
+
+def _tool_call_problem(chat_message, tools_to_call_from) -> Optional[str]:
+    """Describe what is wrong with a model reply's tool calls, or return None if they are usable."""
+    if not tools_to_call_from:
+        return None
+    tool_calls = chat_message.tool_calls
+    if not tool_calls:
+        return "no tool call"
+    tools = {t.name: t for t in tools_to_call_from}
+    for tool_call in tool_calls:
+        name, arguments = tool_call.function.name, tool_call.function.arguments
+        if name not in tools:
+            return f"unknown tool '{name}'"
+        single_input = len(tools[name].inputs) == 1
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments) if arguments.strip() else {}
+            except ValueError:
+                if single_input:
+                    continue  # smolagents passes a bare value to single-input tools
+                return f"arguments for '{name}' are not valid JSON"
+        if not isinstance(arguments, dict):
+            if single_input:
+                continue
+            return f"arguments for '{name}' are not an object"
+        missing = [
+            key for key, spec in tools[name].inputs.items()
+            if not spec.get("nullable") and key not in arguments
+        ]
+        if missing:
+            return f"'{name}' is missing {', '.join(missing)}"
+    return None
+
+
+class RoutedModel(Model):
+    """
+    Model that tries a chain of models in order for one agent.
+
+    The first model whose reply has usable tool calls wins. A reply with no tool call, an
+    unknown tool, unparsable arguments or missing required arguments counts as malformed,
+    and like an exception it moves on to the next (usually stronger) model. Every attempt
+    is recorded in `stats`. If every model fails, the last error is raised.
+    """
+
+    def __init__(self, candidates: List[Tuple[str, Model]], agent_name: str = "agent", stats: Optional[ModelCallStats] = None):
+        super().__init__(model_id=" > ".join(name for name, _ in candidates))
+        self.candidates = candidates
+        self.agent_name = agent_name
+        self.stats = stats or model_call_stats
+
+    @property
+    def can_stream(self) -> bool:
+        """Whether any model in the chain implements `generate_stream`."""
+        return any(hasattr(candidate, "generate_stream") for _, candidate in self.candidates)
+
+    def _attempt(self, name, candidate, messages, tools_to_call_from=None, **kwargs):
+        """Call one model and return its reply; raise if it errors or the reply is malformed."""
+        started = time.perf_counter()
+        try:
+            chat_message = candidate.generate(messages, tools_to_call_from=tools_to_call_from, **kwargs)
+            if not chat_message.tool_calls and chat_message.content and tools_to_call_from:
+                chat_message = candidate.parse_tool_calls(chat_message)
+        except Exception:
+            self.stats.record(name, time.perf_counter() - started, "errors")
+            raise
+        problem = _tool_call_problem(chat_message, tools_to_call_from)
+        self.stats.record(name, time.perf_counter() - started, "malformed" if problem else "ok", chat_message.token_usage)
+        if problem:
+            raise ValueError(f"{name} returned a malformed tool call: {problem}")
+        return chat_message
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        last_error = None
+        for position, (name, candidate) in enumerate(self.candidates):
+            if position:
+                self.stats.record_fallback(self.agent_name)
+            try:
+                return self._attempt(
+                    name,
+                    candidate,
+                    messages,
+                    stop_sequences=stop_sequences,
+                    response_format=response_format,
+                    tools_to_call_from=tools_to_call_from,
+                    **kwargs,
+                )
+            except Exception as e:
+                last_error = e
+        raise last_error or ValueError(f"No models are routed for {self.agent_name}")
+
+    def generate_stream(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        """
+        Stream the reply of the first model in the chain that gives a usable one.
+
+        A streaming model's deltas are held back until its first tool call names a known
+        tool; from then on they pass straight through. A model that errors, names an
+        unknown tool or ends without a usable tool call before that point is recorded and
+        the next model is tried, as in `generate`, and none of its output reaches the
+        agent. Models without `generate_stream` are called with `generate` and their reply
+        is sent as one delta. Arguments are only complete at the end of a stream, so a
+        problem found there is recorded as malformed and left to the agent, like any bad
+        tool call from a single model.
+        """
+        from smolagents.models import (
+            ChatMessageStreamDelta, ChatMessageToolCallFunction, ChatMessageToolCallStreamDelta, agglomerate_stream_deltas,
+        )
+
+        call_kwargs = dict(
+            stop_sequences=stop_sequences, response_format=response_format, tools_to_call_from=tools_to_call_from, **kwargs
+        )
+        tool_names = {t.name for t in tools_to_call_from or []}
+        last_error = None
+        for position, (name, candidate) in enumerate(self.candidates):
+            if position:
+                self.stats.record_fallback(self.agent_name)
+
+            if not hasattr(candidate, "generate_stream"):
+                try:
+                    chat_message = self._attempt(name, candidate, messages, **call_kwargs)
+                except Exception as e:
+                    last_error = e
+                    continue
+                yield ChatMessageStreamDelta(
+                    content=chat_message.content,
+                    tool_calls=[
+                        ChatMessageToolCallStreamDelta(
+                            index=index,
+                            id=call.id,
+                            type=call.type,
+                            function=ChatMessageToolCallFunction(
+                                name=call.function.name,
+                                arguments=call.function.arguments if isinstance(call.function.arguments, str)
+                                else json.dumps(call.function.arguments),
+                            ),
+                        )
+                        for index, call in enumerate(chat_message.tool_calls or [])
+                    ] or None,
+                    token_usage=chat_message.token_usage,
+                )
+                return
+
+            # The last model has nothing to fall back to, so it streams from the start
+            committed = not tool_names or position == len(self.candidates) - 1
+            received, problem = [], None
+            started = time.perf_counter()
+            try:
+                for delta in candidate.generate_stream(messages, **call_kwargs):
+                    received.append(delta)
+                    if not committed:
+                        names = [c.function.name for c in delta.tool_calls or [] if c.function and c.function.name]
+                        unknown = [n for n in names if n not in tool_names]
+                        if unknown:
+                            problem = f"unknown tool '{unknown[0]}'"
+                            break
+                        if not names:
+                            continue
+                        committed = True
+                        yield from received[:-1]
+                    yield delta
+            except Exception as e:
+                self.stats.record(name, time.perf_counter() - started, "errors")
+                if committed:
+                    raise
+                last_error = e
+                continue
+
+            chat_message = agglomerate_stream_deltas(received)
+            if problem is None:
+                if not chat_message.tool_calls and chat_message.content and tool_names:
+                    try:
+                        chat_message = candidate.parse_tool_calls(chat_message)
+                    except Exception:
+                        pass
+                problem = _tool_call_problem(chat_message, tools_to_call_from)
+            self.stats.record(
+                name, time.perf_counter() - started, "malformed" if problem else "ok", chat_message.token_usage
+            )
+            if committed or not problem:
+                if not committed:
+                    yield from received
+                return
+            last_error = ValueError(f"{name} returned a malformed tool call: {problem}")
+        raise last_error or ValueError(f"No models are routed for {self.agent_name}")
+
+
+def load_routing_config(source: Optional[str] = None) -> Optional[Dict]:
+    """
+    Read the routing config from `source`, or the MODEL_ROUTING environment variable.
+
+    Args:
+        source (str, optional): A JSON string or the path of a JSON file.
+
+    Returns:
+        Optional[Dict]: The config, or None if no routing is configured.
+    """
+    source = source or os.getenv(MODEL_ROUTING_ENV)
+    if not source:
+        return None
+    if os.path.exists(source):
+        with open(source, encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(source)
+
+
+def build_routed_models(
+    config: Dict,
+    registry: Optional[Dict[str, Model]] = None,
+    stats: Optional[ModelCallStats] = None,
+) -> Dict[str, RoutedModel]:
+    """
+    Create one RoutedModel per agent from a routing config.
+
+    Args:
+        config (Dict): 'models' (name -> {'model_id', optional 'api_base'}), 'agents'
+            (agent name -> list of model names, tried in order) and 'default' (the list
+            for agents not named).
+        registry (Dict[str, Model], optional): Ready-made models by name, e.g. local
+            stand-ins; these take precedence over 'models'.
+        stats (ModelCallStats, optional): Where to record calls. Defaults to `model_call_stats`.
+
+    Returns:
+        Dict[str, RoutedModel]: Models for inventory_agent, quoting_agent, order_agent and orchestrator.
+
+    Raises:
+        ValueError: If a route names no models, or a model that is neither in 'models' nor
+            in `registry`.
+    """
+    registry = dict(registry or {})
+    for name, spec in config.get("models", {}).items():
+        if name not in registry:
+            registry[name] = OpenAIServerModel(
+                model_id=spec["model_id"],
+                api_base=spec.get("api_base", MODEL_API_BASE),
+                api_key=api_key,
+            )
+
+    routed = {}
+    for agent_name in ["inventory_agent", "quoting_agent", "order_agent", "orchestrator"]:
+        chain = config.get("agents", {}).get(agent_name) or config.get("default") or list(registry)[:1]
+        if not chain:
+            raise ValueError(f"Routing for {agent_name} names no models; set 'agents', 'default' or 'models'")
+        unknown = [name for name in chain if name not in registry]
+        if unknown:
+            raise ValueError(f"Routing for {agent_name} names unknown models: {', '.join(unknown)}")
+        routed[agent_name] = RoutedModel([(name, registry[name]) for name in chain], agent_name, stats)
+    return routed
+
+
+def _stand_in_tool_call(tool_names: List[str], steps_taken: int) -> Tuple[str, Dict]:
+    """Tool call a stand-in model makes: a manager calls each managed agent once, then everyone answers."""
+    managed = [name for name in tool_names if name.endswith("_agent")]
+    if steps_taken < len(managed):
+        return managed[steps_taken], {"task": "Handle your part of the customer request above."}
+    return "final_answer", {"answer": "Your order has been processed."}
+
+
+class StandInModel(Model):
+    """
+    In-process stand-in for a chat model, for exercising routing without an API.
+
+    Replies after `latency` seconds with the tool call from `_stand_in_tool_call`; a
+    `malformed_rate` share of replies (drawn from `seed`) names a tool that does not exist.
+    """
+
+    def __init__(self, model_id: str = "stand-in", latency: float = 0.0, malformed_rate: float = 0.0, seed: int = 0):
+        super().__init__(model_id=model_id)
+        self.latency = latency
+        self.malformed_rate = malformed_rate
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        from smolagents.models import ChatMessage, ChatMessageToolCall, ChatMessageToolCallFunction, MessageRole
+        from smolagents.monitoring import TokenUsage
+
+        time.sleep(self.latency)
+        with self._lock:
+            malformed = self._rng.random() < self.malformed_rate
+        # One tool-call message per finished step (a streamed step adds an empty assistant message too)
+        steps_taken = sum(1 for m in messages if m.role == MessageRole.TOOL_CALL)
+        name, arguments = _stand_in_tool_call([t.name for t in tools_to_call_from or []], steps_taken)
+        if malformed:
+            name = "nonexistent_tool"
+        return ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content=None,
+            tool_calls=[ChatMessageToolCall(
+                id=f"call_{uuid.uuid4().hex[:12]}",
+                type="function",
+                function=ChatMessageToolCallFunction(name=name, arguments=arguments),
+            )],
+            token_usage=TokenUsage(input_tokens=sum(len(str(m)) for m in messages) // 4, output_tokens=20),
+        )
+
+    def generate_stream(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        """Yield the same reply as `generate` as a stream of small tool-call argument deltas."""
+        from smolagents.models import ChatMessageStreamDelta, ChatMessageToolCallFunction, ChatMessageToolCallStreamDelta
+
+        message = self.generate(messages, stop_sequences, response_format, tools_to_call_from, **kwargs)
+        tool_call = message.tool_calls[0]
+        arguments = json.dumps(tool_call.function.arguments)
+        for start in range(0, len(arguments), 8):
+            yield ChatMessageStreamDelta(tool_calls=[ChatMessageToolCallStreamDelta(
+                index=0,
+                id=tool_call.id if start == 0 else None,
+                type="function",
+                function=ChatMessageToolCallFunction(
+                    name=tool_call.function.name if start == 0 else "", arguments=arguments[start:start + 8]
+                ),
+            )])
+        yield ChatMessageStreamDelta(token_usage=message.token_usage)
+
+"""Set up tools for your agents to use, these should be methods that combine the database functions above
+ and apply criteria to them to ensure that the flow of the system is correct."""
+
+
+# Receives progress events from tools for the request being handled in the current context
+# (thread or asyncio task); smolagents copies the context into its parallel tool threads.
+_progress_sink = contextvars.ContextVar("progress_sink", default=None)
+
+
+def emit_progress(event: str, **data):
+    """Report a pipeline milestone (e.g. 'quote_computed') to the current request's stream, if any."""
+    sink = _progress_sink.get()
+    if sink is not None:
+        sink({"type": event, **data})
+
+
+
+# Tools for inventory agent
 
 @tool
 def check_inventory(as_of_date: str) -> str:
@@ -649,7 +3067,7 @@ def check_inventory(as_of_date: str) -> str:
         A summary of all inventory levels and any items needing restocking.
     """
     inventory = get_all_inventory(as_of_date)
-    inventory_df = pd.read_sql("SELECT * FROM inventory", db_engine)
+    inventory_df = get_inventory_reference()
     min_levels = dict(zip(inventory_df["item_name"], inventory_df["min_stock_level"]))
 
     lines = ["=== Inventory Report ==="]
@@ -662,6 +3080,7 @@ def check_inventory(as_of_date: str) -> str:
             low_stock.append(item_name)
         lines.append(f"  {item_name}: {stock} units (min: {min_level}) [{status}]")
 
+    emit_progress("stock_checked", stock={name: int(units) for name, units in inventory.items()}, low_stock=low_stock)
     if low_stock:
         lines.append(f"\nItems needing restock: {', '.join(low_stock)}")
     else:
@@ -681,29 +3100,131 @@ def check_item_stock(item_name: str, as_of_date: str) -> str:
     Returns:
         The current stock level and whether restocking is needed.
     """
-    stock_df = get_stock_level(item_name, as_of_date)
-    current_stock = int(stock_df["current_stock"].iloc[0])
+    current_stock = fetch_stock_level(item_name, as_of_date).current_stock
 
-    inventory_df = pd.read_sql(
-        "SELECT * FROM inventory WHERE item_name = :name",
-        db_engine,
-        params={"name": item_name},
+    item = fetch_inventory_item(item_name)
+    if item is None:
+        return f"'{item_name}' is NOT in our inventory catalog. It must be ordered from supplier first."
+
+    min_level = item.min_stock_level
+    unit_price = item.unit_price
+
+    status = "OK" if current_stock > min_level else "LOW - RESTOCK NEEDED"
+    emit_progress("stock_checked", stock={item_name: current_stock}, low_stock=[item_name] if current_stock <= min_level else [])
+    return (
+        f"Item: {item_name}\n"
+        f"Current Stock: {current_stock} units\n"
+        f"Min Stock Level: {min_level}\n"
+        f"Unit Price: ${unit_price:.2f}\n"
+        f"Status: {status}"
     )
 
-    if inventory_df.empty:
-        return f"'{item_name}' is NOT in our inventory catalog. It must be ordered from supplier first."
 
-    min_level = int(inventory_df["min_stock_level"].iloc[0])
-    unit_price = float(inventory_df["unit_price"].iloc[0])
+def _parse_order_lines(lines_text: str, fields: int) -> Tuple[List[tuple], List[str]]:
+    """
+    Parse "item_name: quantity" (fields=2) or "item_name: quantity: price" (fields=3) lines.
+
+    Returns the parsed (name, quantity[, price]) tuples and an error message per bad line.
+    """
+    parsed, errors = [], []
+    for entry in lines_text.strip().split("\n"):
+        parts = [part.strip() for part in entry.rsplit(":", fields - 1)]
+        if len(parts) != fields or not parts[0]:
+            if entry.strip():
+                errors.append(f"  Could not parse line '{entry.strip()}'")
+            continue
+        try:
+            quantity = int(parts[1])
+            price = float(parts[2].lstrip("$")) if fields == 3 else None
+        except ValueError:
+            errors.append(f"  {parts[0]}: INVALID NUMBER in '{entry.strip()}'")
+            continue
+        if quantity <= 0:
+            errors.append(f"  {parts[0]}: quantity must be positive")
+            continue
+        parsed.append((parts[0], quantity, price) if fields == 3 else (parts[0], quantity))
+    return parsed, errors
+
+
+@tool
+def check_items_stock(item_names: str, as_of_date: str) -> str:
+    """Check the stock levels of several items in one call. Prefer this over calling check_item_stock once per item.
+
+    Args:
+        item_names: Comma-separated exact catalog item names (e.g. "A4 paper, Cardstock, Glossy paper").
+        as_of_date: The date to check stock for, in YYYY-MM-DD format.
+
+    Returns:
+        One line per item with current stock, minimum stock level, unit price and status.
+    """
+    names = [name.strip() for name in item_names.split(",") if name.strip()]
+    with db_engine.connect() as conn:
+        stock = _stock_levels_in(conn, names, as_of_date)
+        inventory = _inventory_rows_in(conn, names)
+    emit_progress("stock_checked", stock={name: int(stock[name]) for name in names})
+
+    lines = ["=== Stock Check ==="]
+    for name in names:
+        current_stock = int(stock[name])
+        info = inventory.get(name)
+        if info is None:
+            lines.append(f"  {name}: {current_stock} units [NOT IN INVENTORY CATALOG - order from supplier first]")
+            continue
+        status = "OK" if current_stock > info["min_stock_level"] else "LOW - RESTOCK NEEDED"
+        lines.append(
+            f"  {name}: {current_stock} units (min: {int(info['min_stock_level'])}, "
+            f"${info['unit_price']:.2f}/unit) [{status}]"
+        )
+    return "\n".join(lines)
+
+
+@tool
+def restock_items(items_and_quantities: str, date: str) -> str:
+    """Order stock from the supplier for several items in one call. Checks the combined cost against the cash balance once; either every line is ordered or none is. Prefer this over calling restock_item once per item.
+
+    Args:
+        items_and_quantities: One item per line, formatted as "item_name: quantity". Example: "A4 paper: 500\nCardstock: 200"
+        date: The date of the order, in YYYY-MM-DD format.
 
-    status = "OK" if current_stock > min_level else "LOW - RESTOCK NEEDED"
-    return (
-        f"Item: {item_name}\n"
-        f"Current Stock: {current_stock} units\n"
-        f"Min Stock Level: {min_level}\n"
-        f"Unit Price: ${unit_price:.2f}\n"
-        f"Status: {status}"
-    )
+    Returns:
+        Confirmation of each restock order with delivery dates, or an error if nothing was ordered.
+    """
+    entries, errors = _parse_order_lines(items_and_quantities, fields=2)
+    catalog = {p["item_name"].lower(): p for p in paper_supplies}
+    for name, _ in entries:
+        if name.lower() not in catalog:
+            errors.append(f"  {name}: not found in the product catalog")
+    if errors or not entries:
+        return "No stock ordered.\n" + ("\n".join(errors) or "  No valid lines given.")
+
+    rows = [
+        {
+            "item_name": catalog[name.lower()]["item_name"],
+            "transaction_type": "stock_orders",
+            "units": quantity,
+            "price": quantity * catalog[name.lower()]["unit_price"],
+            "transaction_date": date,
+        }
+        for name, quantity in entries
+    ]
+    total_cost = sum(row["price"] for row in rows)
+
+    with ledger_write_transaction() as conn:
+        cash = _cash_balance_in(conn, date)
+        if total_cost > cash:
+            return f"Insufficient funds. Need ${total_cost:.2f} but only ${cash:.2f} available. No stock ordered."
+        tx_ids = _insert_transactions(conn, rows)
+
+    emit_progress("restock_placed", items={row["item_name"]: row["units"] for row in rows}, total_cost=total_cost)
+    lines = ["Restock orders placed!"]
+    for row, tx_id in zip(rows, tx_ids):
+        delivery_date = get_supplier_delivery_date(date, row["units"])
+        lines.append(
+            f"  {row['item_name']}: {row['units']} units, ${row['price']:.2f}, "
+            f"delivery {delivery_date} (transaction {tx_id})"
+        )
+    lines.append(f"Total Cost: ${total_cost:.2f}")
+    return "\n".join(lines)
 
 
 @tool
@@ -726,16 +3247,24 @@ def restock_item(item_name: str, quantity: int, date: str) -> str:
     unit_price = item_info["unit_price"]
     total_cost = quantity * unit_price
 
-    # Check if we have enough cash
-    cash = get_cash_balance(date)
-    if total_cost > cash:
-        return f"Insufficient funds. Need ${total_cost:.2f} but only ${cash:.2f} available."
+    # Check cash and record the order atomically, so concurrent restocks cannot overspend
+    with ledger_write_transaction() as conn:
+        cash = _cash_balance_in(conn, date)
+        if total_cost > cash:
+            return f"Insufficient funds. Need ${total_cost:.2f} but only ${cash:.2f} available."
+
+        # Create the stock order transaction
+        tx_id = _insert_transactions(conn, [{
+            "item_name": item_name,
+            "transaction_type": "stock_orders",
+            "units": quantity,
+            "price": total_cost,
+            "transaction_date": date,
+        }])[0]
 
     # Get delivery date
     delivery_date = get_supplier_delivery_date(date, quantity)
-
-    # Create the stock order transaction
-    tx_id = create_transaction(item_name, "stock_orders", quantity, total_cost, date)
+    emit_progress("restock_placed", items={item_name: quantity}, total_cost=total_cost, delivery_date=delivery_date)
 
     return (
         f"Restock order placed!\n"
@@ -747,6 +3276,107 @@ def restock_item(item_name: str, quantity: int, date: str) -> str:
     )
 
 
+@tool
+def restock_low_items(date: str, pending_order: Optional[str] = None, hold_id: Optional[str] = None) -> str:
+    """Plan and place every restock order needed in one call: checks all items against their minimum stock level, held stock and the pending order, then orders them all at once if cash covers the total. Prefer this over deciding restocks item by item.
+
+    Args:
+        date: The date of the orders, in YYYY-MM-DD format.
+        pending_order: The customer's items about to be sold, one per line as "exact catalog name: quantity". Example: "A4 paper: 500\nCardstock: 200"
+        hold_id: The stock hold ID from hold_quoted_items, if the pending order's stock is already held.
+
+    Returns:
+        The stock orders placed, grouped by delivery date, or why nothing was ordered.
+    """
+    demand = {}
+    if pending_order:
+        entries, errors = _parse_order_lines(pending_order, fields=2)
+        if errors:
+            return "No stock ordered.\n" + "\n".join(errors)
+        catalog = {p["item_name"].lower(): p["item_name"] for p in paper_supplies}
+        unknown = [name for name, _ in entries if name.lower() not in catalog]
+        if unknown:
+            return "No stock ordered.\n" + "\n".join(f"  {name}: not found in the product catalog" for name in unknown)
+        for name, quantity in entries:
+            demand[catalog[name.lower()]] = demand.get(catalog[name.lower()], 0) + quantity
+
+    plan = plan_reorders(date, pending_demand=demand, hold_id=hold_id)
+    if not plan["orders"]:
+        return "No restock needed. Every item is above its minimum level after the pending order."
+    if not plan["placed"]:
+        return (
+            f"Insufficient funds. Need ${plan['total_cost']:.2f} for {len(plan['orders'])} restock orders "
+            f"but only ${plan['cash']:.2f} available. No stock ordered."
+        )
+
+    emit_progress(
+        "restock_placed",
+        items={order["item_name"]: order["quantity"] for order in plan["orders"]},
+        total_cost=plan["total_cost"],
+        delivery_dates=plan["by_delivery_date"],
+    )
+    orders = {order["item_name"]: order for order in plan["orders"]}
+    tx_ids = dict(zip([order["item_name"] for order in plan["orders"]], plan["transaction_ids"]))
+    lines = ["Restock orders placed!"]
+    for delivery_date, names in plan["by_delivery_date"].items():
+        lines.append(f"Delivery {delivery_date}:")
+        for name in names:
+            order = orders[name]
+            lines.append(
+                f"  {name}: {order['quantity']} units, ${order['cost']:.2f} "
+                f"(stock {order['stock']}, needed {order['demand']}, min {order['min_stock_level']}; "
+                f"transaction {tx_ids[name]})"
+            )
+    lines.append(f"Total Cost: ${plan['total_cost']:.2f}")
+    return "\n".join(lines)
+
+
+@tool
+def resolve_item_names(customer_phrases: str) -> str:
+    """Look up exact catalog names for the customer's item phrases from previously learned mappings.
+    Call this BEFORE get_product_catalog; only phrases it cannot resolve need the catalog.
+
+    Args:
+        customer_phrases: Comma-separated item phrases as the customer wrote them (e.g. "printer paper, poster board").
+
+    Returns:
+        The catalog name for each known phrase, and the phrases that still need to be mapped.
+    """
+    lines = ["=== Resolved Item Names ==="]
+    resolved, unresolved = {}, []
+    for phrase in [p.strip() for p in customer_phrases.split(",") if p.strip()]:
+        match = item_alias_store.lookup(phrase)
+        if match:
+            resolved[phrase] = match["item_name"]
+            lines.append(f"  {phrase} -> {match['item_name']} (confidence {match['confidence']:.2f})")
+        else:
+            unresolved.append(phrase)
+    emit_progress("items_resolved", items=resolved, unresolved=unresolved)
+
+    if unresolved:
+        lines.append(f"\nUnresolved (use get_product_catalog, then remember_item_mapping): {', '.join(unresolved)}")
+    return "\n".join(lines)
+
+
+@tool
+def remember_item_mapping(customer_phrase: str, catalog_name: str) -> str:
+    """Save a mapping from a customer's item phrase to the exact catalog item name, so future requests resolve it instantly.
+
+    Args:
+        customer_phrase: The item phrase as the customer wrote it (e.g. "printer paper").
+        catalog_name: The exact catalog item name it refers to (e.g. "A4 paper").
+
+    Returns:
+        Confirmation of the stored mapping, or an error if the catalog name does not exist.
+    """
+    try:
+        mapping = item_alias_store.record(customer_phrase, catalog_name)
+    except ValueError as e:
+        return f"Error: {e}. Use exact item names from get_product_catalog."
+    emit_progress("items_resolved", items={customer_phrase: mapping["item_name"]}, unresolved=[])
+    return f"Remembered: '{mapping['phrase']}' -> {mapping['item_name']} (confidence {mapping['confidence']:.2f})"
+
+
 # Tools for quoting agent
 
 @tool
@@ -796,231 +3426,886 @@ def get_product_catalog() -> str:
 def calculate_quote(items_and_quantities: str, as_of_date: str) -> str:
     """Calculate a price quote for a list of items with bulk discounts applied.
 
-    Bulk discount rules:
-    - 100-499 units: 5% discount
-    - 500-999 units: 10% discount
-    - 1000+ units: 15% discount
+    Bulk discounts are applied per line from the discount tier table: larger quantities of an item get larger discounts.
 
     Args:
         items_and_quantities: A string of items and quantities, one per line, formatted as "item_name: quantity". Example: "A4 paper: 500\nCardstock: 200"
         as_of_date: The date of the quote, in YYYY-MM-DD format.
 
-    Returns:
-        A detailed quote breakdown with per-item costs, discounts, and total.
-    """
-    lines = ["=== Quote Breakdown ==="]
-    total = 0.0
+    Returns:
+        A detailed quote breakdown with per-item costs, discounts, and total.
+    """
+    # Parse "name: quantity" lines, keeping invalid quantities in their original position
+    entries = []
+    for entry in items_and_quantities.strip().split("\n"):
+        if ":" not in entry:
+            continue
+        name, qty_str = entry.rsplit(":", 1)
+        name = name.strip()
+        try:
+            entries.append((name, int(qty_str.strip())))
+        except ValueError:
+            entries.append((name, qty_str.strip()))
+
+    valid = [(name, qty) for name, qty in entries if isinstance(qty, int)]
+    priced, totals = price_quote_lines(
+        [0] * len(valid), [name for name, _ in valid], [qty for _, qty in valid]
+    )
+
+    lines = ["=== Quote Breakdown ==="]
+    priced_rows = priced.itertuples(index=False)
+    for name, qty in entries:
+        if not isinstance(qty, int):
+            lines.append(f"  {name}: INVALID QUANTITY '{qty}'")
+            continue
+
+        line = next(priced_rows)
+        if not line.found:
+            lines.append(f"  {name}: NOT FOUND in catalog")
+            continue
+
+        lines.append(
+            f"  {name}: {qty} x ${line.unit_price:.2f} = ${line.subtotal:.2f}"
+            + (f" (-{line.discount*100:.0f}% = ${line.line_total:.2f})" if line.discount > 0 else "")
+        )
+
+    total = float(totals["total"].iloc[0]) if len(totals) else 0.0
+    emit_progress(
+        "quote_computed",
+        lines=[
+            {"item_name": row.item_name, "quantity": int(row.quantity), "line_total": float(row.line_total)}
+            for row in priced.itertuples(index=False) if row.found
+        ],
+        total=total,
+    )
+    lines.append(f"\nTotal Quote Amount: ${total:.2f}")
+    return "\n".join(lines)
+
+
+@tool
+def hold_quoted_items(items_and_quantities: str, as_of_date: str) -> str:
+    """Reserve stock for a quoted order so concurrent orders cannot take it before the sale. The hold expires if no sale uses it.
+
+    Args:
+        items_and_quantities: One item per line, formatted as "item_name: quantity", using exact catalog names. Example: "A4 paper: 500\nCardstock: 200"
+        as_of_date: The date of the quote, in YYYY-MM-DD format.
+
+    Returns:
+        The hold ID to pass to process_order, or the items that lack available stock.
+    """
+    entries, errors = _parse_order_lines(items_and_quantities, fields=2)
+    if errors or not entries:
+        return "No stock held.\n" + ("\n".join(errors) or "  No valid lines given.")
+
+    items = {}
+    for name, quantity in entries:
+        items[name] = items.get(name, 0) + quantity
+    hold_id, available = create_stock_hold(items, as_of_date)
+    if hold_id is None:
+        shortfalls = [
+            f"  {name}: available {int(available[name])}, need {units}"
+            for name, units in items.items() if available[name] < units
+        ]
+        return "No stock held; not enough available stock.\n" + "\n".join(shortfalls)
+    return (
+        f"Stock held. Hold ID: {hold_id} (expires in {HOLD_TTL_SECONDS // 60} minutes). "
+        f"Pass this hold_id to process_order."
+    )
+
+
+# Tools for ordering agent
+
+@tool
+def process_sale(item_name: str, quantity: int, price: float, date: str, hold_id: Optional[str] = None) -> str:
+    """Process a sale transaction for a customer order. Records the sale in the database.
+
+    Args:
+        item_name: The exact name of the item being sold (must match database names).
+        quantity: The number of units sold.
+        price: The total sale price for this line item.
+        date: The date of the sale, in YYYY-MM-DD format.
+        hold_id: The stock hold ID from hold_quoted_items, if stock was held for this order.
+
+    Returns:
+        Confirmation of the sale or an error if insufficient stock.
+    """
+    # Check stock (minus units held for other orders) and record the sale atomically,
+    # so concurrent sales cannot oversell
+    with ledger_write_transaction() as conn:
+        current_stock = int(_available_units_in(conn, item_name, date, hold_id=hold_id))
+        if current_stock < quantity:
+            return f"Insufficient stock for '{item_name}'. Have {current_stock}, need {quantity}. Restock first."
+
+        tx_id = _insert_transactions(conn, [{
+            "item_name": item_name,
+            "transaction_type": "sales",
+            "units": quantity,
+            "price": price,
+            "transaction_date": date,
+        }])[0]
+        if hold_id:
+            _consume_hold_in(conn, hold_id)
+
+    emit_progress("sale_recorded", items={item_name: quantity}, total=price, transaction_ids=[tx_id])
+    return (
+        f"Sale processed!\n"
+        f"Item: {item_name}\n"
+        f"Quantity: {quantity}\n"
+        f"Sale Price: ${price:.2f}\n"
+        f"Transaction ID: {tx_id}"
+    )
+
+
+@tool
+def process_order(order_lines: str, date: str, hold_id: Optional[str] = None) -> str:
+    """Process a whole customer order in one call. Checks stock for every line first; either every line is sold or none is. Prefer this over calling process_sale once per item.
+
+    Args:
+        order_lines: One item per line, formatted as "item_name: quantity: total line price". Example: "A4 paper: 500: 22.50\nCardstock: 200: 28.50"
+        date: The date of the sale, in YYYY-MM-DD format.
+        hold_id: The stock hold ID from hold_quoted_items, if stock was held for this order.
+
+    Returns:
+        Confirmation of every sale line, or the stock shortfalls if nothing was sold.
+    """
+    entries, errors = _parse_order_lines(order_lines, fields=3)
+    if errors or not entries:
+        return "Order not processed.\n" + ("\n".join(errors) or "  No valid lines given.")
+
+    required = {}
+    for name, quantity, _ in entries:
+        required[name] = required.get(name, 0) + quantity
+    rows = [
+        {"item_name": name, "transaction_type": "sales", "units": quantity, "price": price, "transaction_date": date}
+        for name, quantity, price in entries
+    ]
+
+    with ledger_write_transaction() as conn:
+        stock = _available_stock_in(conn, list(required), date, hold_id=hold_id)
+        shortfalls = [
+            f"  {name}: have {int(stock[name])}, need {quantity}"
+            for name, quantity in required.items() if stock[name] < quantity
+        ]
+        if shortfalls:
+            return "Insufficient stock. Restock first; no sales recorded.\n" + "\n".join(shortfalls)
+        tx_ids = _insert_transactions(conn, rows)
+        if hold_id:
+            _consume_hold_in(conn, hold_id)
+
+    emit_progress(
+        "sale_recorded",
+        items={row["item_name"]: row["units"] for row in rows},
+        total=sum(row["price"] for row in rows),
+        transaction_ids=tx_ids,
+    )
+    lines = ["Order processed!"]
+    for row, tx_id in zip(rows, tx_ids):
+        lines.append(f"  {row['item_name']}: {row['units']} units, ${row['price']:.2f} (transaction {tx_id})")
+    lines.append(f"Order Total: ${sum(row['price'] for row in rows):.2f}")
+    return "\n".join(lines)
+
+
+@tool
+def check_delivery_estimate(order_date: str, quantity: int) -> str:
+    """Estimate the supplier delivery date based on order quantity.
+
+    Args:
+        order_date: The date the order is placed, in YYYY-MM-DD format.
+        quantity: The number of units being ordered.
+
+    Returns:
+        The estimated delivery date.
+    """
+    delivery = get_supplier_delivery_date(order_date, quantity)
+    emit_progress("delivery_estimated", quantity=quantity, delivery_date=delivery)
+    return f"Estimated delivery date for {quantity} units ordered on {order_date}: {delivery}"
+
+
+@tool
+def get_balance(as_of_date: str) -> str:
+    """Get the current cash balance as of a specific date.
+
+    Args:
+        as_of_date: The date to check the balance for, in YYYY-MM-DD format.
+
+    Returns:
+        The current cash balance.
+    """
+    cash = get_cash_balance(as_of_date)
+    return f"Cash balance as of {as_of_date}: ${cash:.2f}"
+
+
+@tool
+def get_financial_report(as_of_date: str) -> str:
+    """Generate a full financial report including cash balance, inventory value, and top selling products.
+
+    Args:
+        as_of_date: The date to generate the report for, in YYYY-MM-DD format.
+
+    Returns:
+        A formatted financial report with cash, inventory value, total assets, and top sellers.
+    """
+    report = generate_financial_report(as_of_date)
+    lines = [
+        "=== Financial Report ===",
+        f"Date: {report['as_of_date']}",
+        f"Cash Balance: ${report['cash_balance']:.2f}",
+        f"Inventory Value: ${report['inventory_value']:.2f}",
+        f"Total Assets: ${report['total_assets']:.2f}",
+        "",
+        "Top Selling Products:",
+    ]
+    for item in report["top_selling_products"]:
+        lines.append(f"  {item['item_name']}: {item['total_units']} units, ${item['total_revenue']:.2f} revenue")
+
+    return "\n".join(lines)
+
+
+# Set up your agents and create an orchestration agent that will manage them.
+
+def _cached_input_tokens(chat_message) -> int:
+    """Prompt tokens the provider served from its prompt cache, from the raw OpenAI-style usage."""
+    raw = getattr(chat_message, "raw", None)
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    return int(cached or 0)
+
+
+class AgentUsageTracker:
+    """
+    Step callback that counts model steps, tool calls and tokens per agent.
+
+    smolagents resets an agent's own monitor on every run, and managed agents can be run
+    several times per request, so usage is accumulated here instead. Call `reset` before
+    each request and `totals` after it. `calls` keeps one record per model call with the
+    cached and uncached input tokens and the step duration.
+    """
+    def __init__(self):
+        self.usage = {}
+        self.calls = []
+
+    def __call__(self, memory_step, agent=None):
+        name = getattr(agent, "name", None) or "agent"
+        usage = self.usage.setdefault(
+            name, {"steps": 0, "tool_calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0}
+        )
+        usage["steps"] += 1
+        usage["tool_calls"] += len(memory_step.tool_calls or [])
+        if memory_step.token_usage is not None:
+            cached = _cached_input_tokens(memory_step.model_output_message)
+            usage["input_tokens"] += memory_step.token_usage.input_tokens
+            usage["cached_input_tokens"] += cached
+            usage["output_tokens"] += memory_step.token_usage.output_tokens
+            self.calls.append({
+                "agent": name,
+                "input_tokens": memory_step.token_usage.input_tokens,
+                "cached_input_tokens": cached,
+                "uncached_input_tokens": memory_step.token_usage.input_tokens - cached,
+                "output_tokens": memory_step.token_usage.output_tokens,
+                "seconds": memory_step.timing.duration,
+            })
+
+    def reset(self):
+        self.usage = {}
+        self.calls = []
+
+    def totals(self) -> Dict[str, int]:
+        totals = {"steps": 0, "tool_calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0}
+        for usage in self.usage.values():
+            for key in totals:
+                totals[key] += usage[key]
+        return totals
+
+
+def _catalog_snapshot() -> str:
+    """Compact, fixed-order product catalog for the static part of agent prompts."""
+    lines = ["Product catalog (exact name | category | unit price):"]
+    for item in paper_supplies:
+        lines.append(f"- {item['item_name']} | {item['category']} | ${item['unit_price']:.2f}")
+    return "\n".join(lines)
+
+
+def build_agents(
+    model,
+    use_batch_tools: bool = True,
+    use_stock_holds: bool = False,
+    models: Optional[Dict[str, Model]] = None,
+    stream_outputs: bool = False,
+) -> Dict[str, ToolCallingAgent]:
+    """
+    Create the inventory, quoting and order agents and the orchestrator that manages them.
+
+    Args:
+        model: The smolagents model every agent uses, unless `models` names another.
+        use_batch_tools: Give the agents the multi-item tools (check_items_stock, restock_items,
+            process_order) and tell them to prefer those. Set to False to build the
+            single-item-tool setup, e.g. for `measure_batch_tool_savings`.
+        use_stock_holds: Have the quoting agent hold quoted stock with hold_quoted_items and the
+            order agent consume the hold. Useful when requests are processed concurrently.
+        models: Model per agent name (e.g. from `build_routed_models`), overriding `model`.
+        stream_outputs: Have the orchestrator stream its model output, so `stream_request` can
+            relay the final customer message as it is generated. Ignored if the orchestrator's
+            model cannot stream.
+
+    Returns:
+        Dict[str, ToolCallingAgent]: The agents by name, plus the shared 'usage_tracker'.
+    """
+    usage_tracker = AgentUsageTracker()
+    models = models or {}
+
+    inventory_tools = [
+        check_inventory, check_item_stock, restock_item, get_product_catalog,
+        resolve_item_names, remember_item_mapping,
+    ]
+    order_tools = [process_sale, check_delivery_estimate, get_balance, get_financial_report]
+    if use_batch_tools:
+        inventory_tools += [check_items_stock, restock_items, restock_low_items]
+        order_tools += [process_order]
+        stock_instructions = (
+            "Then call check_items_stock ONCE with ALL the EXACT catalog names to see current stock. "
+            "If any stock is low or too small for the order, call restock_low_items ONCE with every ordered item "
+            "as 'exact catalog name: quantity' and the DATE from the request; it restocks everything that needs it. "
+        )
+        sale_instructions = (
+            "Call process_order ONCE with every line as 'exact catalog name: quantity: quoted line price' "
+            "and the DATE from the customer's original request. "
+        )
+    else:
+        stock_instructions = (
+            "Then use check_item_stock with the EXACT catalog name to see current stock. "
+            "If stock is low or zero, call restock_item with the EXACT catalog name and the DATE from the request. "
+        )
+        sale_instructions = (
+            "For each item, call process_sale with the exact catalog name, quantity, quoted price, "
+            "and the DATE from the customer's original request. "
+        )
+
+    # Each agent's instructions go into its own system prompt, which holds nothing that varies
+    # between steps or requests, so the provider can cache it as a prompt prefix. Request
+    # text, dates and tool results only ever appear after it. The descriptions are what
+    # the orchestrator sees about each agent.
+    catalog = _catalog_snapshot()
+
+    inventory_agent = ToolCallingAgent(
+        tools=inventory_tools,
+        model=models.get("inventory_agent", model),
+        name="inventory_agent",
+        step_callbacks=[usage_tracker],
+        description=(
+            "Manages warehouse inventory: maps the customer's item phrases to exact catalog names, checks stock "
+            "and restocks if needed. Give it the items, quantities and the request date; it returns the EXACT "
+            "catalog names."
+        ),
+        instructions=(
+            "ALWAYS call resolve_item_names FIRST with the customer's item phrases to get exact catalog names from "
+            "previously learned mappings. Customers use informal names like 'A4 printer paper' but the catalog name "
+            "is 'A4 paper', so map each phrase it reports as unresolved to the closest name in the catalog below "
+            "(call get_product_catalog only if the catalog below is not enough) and save it with "
+            "remember_item_mapping. "
+            + stock_instructions +
+            "In your response, always list the EXACT catalog names you found so other agents can use them.\n\n"
+            + catalog
+        ),
+    )
+
+    quoting_tools = [search_past_quotes, get_product_catalog, calculate_quote]
+    hold_instructions = ""
+    if use_stock_holds:
+        quoting_tools.append(hold_quoted_items)
+        hold_instructions = (
+            " After calculate_quote, call hold_quoted_items with the same items and quantities, and report the "
+            "Hold ID so order_agent can use it."
+        )
+        sale_instructions += "If a Hold ID was given, pass it as hold_id. "
+
+    quoting_agent = ToolCallingAgent(
+        tools=quoting_tools,
+        model=models.get("quoting_agent", model),
+        name="quoting_agent",
+        step_callbacks=[usage_tracker],
+        description=(
+            "Handles pricing and quotes with bulk discounts. Give it the EXACT catalog item names from "
+            "inventory_agent, the quantities and the request date."
+        ),
+        instructions=(
+            "Use the EXACT catalog item names you are given. "
+            "First call search_past_quotes for similar orders, then call calculate_quote with the exact catalog names "
+            "and quantities. Always use the DATE from the customer's original request when calling calculate_quote."
+            + hold_instructions + "\n\n" + catalog
+        ),
+    )
+
+    order_agent = ToolCallingAgent(
+        tools=order_tools,
+        model=models.get("order_agent", model),
+        name="order_agent",
+        step_callbacks=[usage_tracker],
+        description=(
+            "Processes sales and manages finances. Give it the EXACT catalog item names, quantities, the quoted "
+            "prices and the request date; it records the sale and estimates delivery."
+        ),
+        instructions=(
+            "Use the EXACT catalog item names and the quoted prices from quoting_agent. "
+            + sale_instructions +
+            "Also call check_delivery_estimate using the request date. "
+            "IMPORTANT: Always use the date from the customer request (e.g. 2025-04-05), not any other date."
+        ),
+    )
+
+    orchestrator_model = models.get("orchestrator", model)
+    orchestrator = ToolCallingAgent(
+        tools=[],
+        model=orchestrator_model,
+        stream_outputs=stream_outputs and (
+            orchestrator_model.can_stream if isinstance(orchestrator_model, RoutedModel)
+            else hasattr(orchestrator_model, "generate_stream")
+        ),
+        managed_agents=[inventory_agent, quoting_agent, order_agent],
+        name="orchestrator",
+        step_callbacks=[usage_tracker],
+        description="Orchestrator for Munder Difflin Paper Company.",
+        instructions=(
+            "You are the orchestrator for Munder Difflin Paper Company. Coordinate customer requests by calling agents in this order:\n"
+            "1) inventory_agent — Tell it the items the customer wants AND the request date. It will look up the product "
+            "catalog to find exact matching names, check stock, and restock if needed. Note the EXACT catalog names it returns.\n"
+            "2) quoting_agent — Pass the EXACT catalog item names from inventory_agent (not the customer's informal names) "
+            "and the quantities. It will calculate pricing with bulk discounts.\n"
+            "3) order_agent — Pass the EXACT catalog item names, quantities, the quoted prices, and the request date. "
+            "It will process the sale transactions and check delivery estimates.\n"
+            "After all agents respond, combine results into a professional customer response with items ordered, "
+            "itemized quote with any discounts applied, total price, and estimated delivery date."
+        ),
+    )
+
+    return {
+        "inventory_agent": inventory_agent,
+        "quoting_agent": quoting_agent,
+        "order_agent": order_agent,
+        "orchestrator": orchestrator,
+        "usage_tracker": usage_tracker,
+    }
+
+
+def prompt_prefix_fingerprints(agents: Dict) -> Dict[str, str]:
+    """
+    Hash each agent's static prompt prefix: its system prompt plus its tool schemas.
+
+    The fingerprints only change when instructions, tools or the catalog change, which
+    makes it easy to check that nothing request-specific leaked into the prefix.
+    """
+    from smolagents.models import get_tool_json_schema
+
+    fingerprints = {}
+    for name, agent in agents.items():
+        if not isinstance(agent, ToolCallingAgent):
+            continue
+        schemas = [get_tool_json_schema(t) for t in agent.tools_and_managed_agents]
+        prefix = agent.system_prompt + json.dumps(schemas, sort_keys=True)
+        fingerprints[name] = hashlib.sha256(prefix.encode()).hexdigest()[:16]
+    return fingerprints
+
+
+def prewarm_prompt_cache(agents: Dict) -> Dict[str, int]:
+    """
+    Send each agent's static prompt prefix once, so the provider caches it before real traffic.
+
+    Each call carries the agent's exact system message and tool list, the same bytes every
+    real step starts with, followed by a throwaway user message and a tiny token limit.
+    For a routed agent the call goes straight to the first model of its chain, so it is
+    neither recorded in the routing stats nor checked for a tool call (a reply without
+    one cannot trigger a fallback).
+
+    Returns:
+        Dict[str, int]: Prompt tokens sent per agent (0 if the call failed).
+    """
+    from smolagents.models import ChatMessage, MessageRole
+
+    sent = {}
+    for name, agent in agents.items():
+        if not isinstance(agent, ToolCallingAgent):
+            continue
+        messages = agent.memory.system_prompt.to_messages() + [
+            ChatMessage(role=MessageRole.USER, content=[{"type": "text", "text": "New task:\nReply OK."}])
+        ]
+        target = agent.model.candidates[0][1] if isinstance(agent.model, RoutedModel) else agent.model
+        try:
+            response = target.generate(
+                messages,
+                stop_sequences=["Observation:", "Calling tools:"],
+                tools_to_call_from=agent.tools_and_managed_agents,
+                max_tokens=16,
+            )
+            sent[name] = response.token_usage.input_tokens if response.token_usage else 0
+        except Exception as e:
+            print(f"Prompt pre-warm failed for {name}: {e}")
+            sent[name] = 0
+    return sent
+
+
+routing_config = load_routing_config()
+agents = build_agents(model, models=build_routed_models(routing_config) if routing_config else None)
+inventory_agent = agents["inventory_agent"]
+quoting_agent = agents["quoting_agent"]
+order_agent = agents["order_agent"]
+orchestrator = agents["orchestrator"]
+usage_tracker = agents["usage_tracker"]
+
+
+# Run your test scenarios by writing them here. Make sure to keep track of them.
+
+def load_test_scenarios(path: str = "quote_requests_sample.csv") -> pd.DataFrame:
+    """Load the test scenarios CSV with parsed request dates, sorted by date."""
+    scenarios = pd.read_csv(path)
+    scenarios["request_date"] = pd.to_datetime(
+        scenarios["request_date"], format="%m/%d/%y", errors="coerce"
+    )
+    scenarios.dropna(subset=["request_date"], inplace=True)
+    return scenarios.sort_values("request_date")
+
+
+def format_request(row: pd.Series) -> str:
+    """Build the orchestrator prompt for one scenario: the request, its date, and any known catalog names."""
+    request_date = row["request_date"].strftime("%Y-%m-%d")
+    request_with_date = f"{row['request']} (Date of request: {request_date})"
 
-    for entry in items_and_quantities.strip().split("\n"):
-        if ":" not in entry:
-            continue
-        name, qty_str = entry.rsplit(":", 1)
-        name = name.strip()
-        try:
-            qty = int(qty_str.strip())
-        except ValueError:
-            lines.append(f"  {name}: INVALID QUANTITY '{qty_str.strip()}'")
-            continue
+    # Hand over catalog names already learned for phrases in this request
+    known_items = item_alias_store.match_text(row["request"])
+    if known_items:
+        hints = "; ".join(f"'{phrase}' = {item}" for phrase, item in known_items.items())
+        request_with_date += f" (Known catalog names: {hints})"
+    return request_with_date
 
-        # Look up unit price
-        item_info = next((p for p in paper_supplies if p["item_name"].lower() == name.lower()), None)
-        if not item_info:
-            lines.append(f"  {name}: NOT FOUND in catalog")
-            continue
 
-        unit_price = item_info["unit_price"]
-        subtotal = qty * unit_price
+# Sent when every attempt at a request failed before anything was recorded
+UNAVAILABLE_RESPONSE = (
+    "We apologize, but we are currently unable to process your request due to a temporary system issue. "
+    "Please try again later or contact our support team for assistance."
+)
 
-        # Apply bulk discount
-        if qty >= 1000:
-            discount = 0.15
-        elif qty >= 500:
-            discount = 0.10
-        elif qty >= 100:
-            discount = 0.05
-        else:
-            discount = 0.0
 
-        discount_amount = subtotal * discount
-        item_total = subtotal - discount_amount
-        total += item_total
+def run_with_retries(orchestrator: ToolCallingAgent, request: str, max_retries: int = 3) -> str:
+    """Run the orchestrator on one request, retrying with backoff and falling back to an apology."""
+    response = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            response = orchestrator.run(request)
+            break  # Success — exit retry loop
+        except Exception as e:
+            print(f"[Attempt {attempt}/{max_retries}] Error: {e}")
+            if attempt < max_retries:
+                print(f"Retrying in {attempt * 2} seconds...")
+                time.sleep(attempt * 2)  # Exponential backoff: 2s, 4s
+            else:
+                print(f"All {max_retries} attempts failed.")
+                response = UNAVAILABLE_RESPONSE
+    return response
 
-        lines.append(
-            f"  {name}: {qty} x ${unit_price:.2f} = ${subtotal:.2f}"
-            + (f" (-{discount*100:.0f}% = ${item_total:.2f})" if discount > 0 else "")
-        )
 
-    lines.append(f"\nTotal Quote Amount: ${total:.2f}")
-    return "\n".join(lines)
+# Threads running whole agent pipelines for async callers, separate from db_executor so a
+# pipeline waiting on its own database calls can never starve them
+agent_executor = AsyncThreadExecutor(max_workers=8, name="agent")
 
 
-# Tools for ordering agent
+async def arun_with_retries(orchestrator: ToolCallingAgent, request: str, max_retries: int = 3) -> str:
+    """Async version of `run_with_retries`: runs the orchestrator on `agent_executor` without blocking the event loop."""
+    return await agent_executor.run(run_with_retries, orchestrator, request, max_retries)
 
-@tool
-def process_sale(item_name: str, quantity: int, price: float, date: str) -> str:
-    """Process a sale transaction for a customer order. Records the sale in the database.
 
-    Args:
-        item_name: The exact name of the item being sold (must match database names).
-        quantity: The number of units sold.
-        price: The total sale price for this line item.
-        date: The date of the sale, in YYYY-MM-DD format.
+def _partial_json_string(text: str, key: str) -> str:
+    """
+    Decode as much of the string value of `key` as has arrived in a partial JSON object.
 
-    Returns:
-        Confirmation of the sale or an error if insufficient stock.
+    Used to relay the final_answer argument while the model is still generating it.
+    Stops before an incomplete escape sequence, so every returned prefix is final.
     """
-    # Check stock first
-    stock_df = get_stock_level(item_name, date)
-    current_stock = int(stock_df["current_stock"].iloc[0])
+    match = re.search(r'"%s"\s*:\s*"' % re.escape(key), text)
+    if not match:
+        return ""
+    raw, position = [], match.end()
+    while position < len(text):
+        char = text[position]
+        if char == '"':
+            break
+        if char == "\\":
+            length = 6 if text[position + 1:position + 2] == "u" else 2
+            if position + length > len(text):
+                break
+            raw.append(text[position:position + length])
+            position += length
+            continue
+        raw.append(char)
+        position += 1
+    try:
+        return json.loads('"' + "".join(raw) + '"')
+    except ValueError:
+        return ""
 
-    if current_stock < quantity:
-        return f"Insufficient stock for '{item_name}'. Have {current_stock}, need {quantity}. Restock first."
 
-    tx_id = create_transaction(item_name, "sales", quantity, price, date)
-    return (
-        f"Sale processed!\n"
-        f"Item: {item_name}\n"
-        f"Quantity: {quantity}\n"
-        f"Sale Price: ${price:.2f}\n"
-        f"Transaction ID: {tx_id}"
-    )
+_streaming_agents = None
+_streaming_agents_lock = threading.Lock()
 
 
-@tool
-def check_delivery_estimate(order_date: str, quantity: int) -> str:
-    """Estimate the supplier delivery date based on order quantity.
+def get_streaming_agents() -> Dict:
+    """Agents like the module-level ones, but with a streaming orchestrator; built on first use."""
+    global _streaming_agents
+    with _streaming_agents_lock:
+        if _streaming_agents is None:
+            _streaming_agents = build_agents(
+                model,
+                models=build_routed_models(routing_config) if routing_config else None,
+                stream_outputs=True,
+            )
+        return _streaming_agents
 
-    Args:
-        order_date: The date the order is placed, in YYYY-MM-DD format.
-        quantity: The number of units being ordered.
 
-    Returns:
-        The estimated delivery date.
+# Sent by stream_request when a run fails after its agents started calling tools
+PARTIAL_FAILURE_RESPONSE = (
+    "We apologize, but an error interrupted your request after part of it was processed. "
+    "Our support team will review it and confirm the status of your order."
+)
+
+
+def stream_request(request: str, agents: Optional[Dict] = None, max_retries: int = 3):
     """
-    delivery = get_supplier_delivery_date(order_date, quantity)
-    return f"Estimated delivery date for {quantity} units ordered on {order_date}: {delivery}"
+    Handle one request and yield progress events as the pipeline runs.
 
+    The orchestrator runs in a background thread. Tools report milestones through
+    `emit_progress`, and these arrive as events like 'items_resolved', 'stock_checked',
+    'restock_placed', 'quote_computed', 'sale_recorded' and 'delivery_estimated'. While
+    the orchestrator writes its final answer, 'response_delta' events carry the new text
+    as the model generates it. If the model cannot stream, the finished text is sent in
+    word-sized pieces instead. The last event is 'response' with the full text.
 
-@tool
-def get_balance(as_of_date: str) -> str:
-    """Get the current cash balance as of a specific date.
+    Each failed attempt sends an 'error' event. A failure before any agent or tool was
+    called is retried with the same backoff as `run_with_retries` (a 'response_reset'
+    event drops text streamed by the failed attempt), ending in the usual apology once
+    `max_retries` attempts failed. After a tool has run the request is not run again,
+    since a restock or sale may already be recorded, and the response says so.
+
+    Every event is a dict with 'type' and 'elapsed' (seconds since the call) plus its
+    own fields. One agent set handles one request at a time; pass separate `agents` from
+    `build_agents(..., stream_outputs=True)` to stream requests concurrently.
 
     Args:
-        as_of_date: The date to check the balance for, in YYYY-MM-DD format.
+        request (str): The formatted request, as from `format_request`.
+        agents (Dict, optional): Agents from `build_agents`. Defaults to `get_streaming_agents()`.
+        max_retries (int, optional): Attempts made while no tool has run. Default is 3.
 
-    Returns:
-        The current cash balance.
+    Yields:
+        Dict: Progress events, ending with the 'response' event.
     """
-    cash = get_cash_balance(as_of_date)
-    return f"Cash balance as of {as_of_date}: ${cash:.2f}"
+    import queue
+    from smolagents.memory import FinalAnswerStep, ToolCall
+    from smolagents.models import ChatMessageStreamDelta
 
+    orchestrator = (agents or get_streaming_agents())["orchestrator"]
+    events = queue.Queue()
+    done = object()
+    started = time.perf_counter()
 
-@tool
-def get_financial_report(as_of_date: str) -> str:
-    """Generate a full financial report including cash balance, inventory value, and top selling products.
+    def put(event):
+        events.put({**event, "elapsed": time.perf_counter() - started})
 
-    Args:
-        as_of_date: The date to generate the report for, in YYYY-MM-DD format.
+    def run():
+        streamed, response, tools_started = "", None, False
 
-    Returns:
-        A formatted financial report with cash, inventory value, total assets, and top sellers.
+        def sink(event):
+            # Every tool event means the agents got as far as running a tool
+            nonlocal tools_started
+            tools_started = True
+            put(event)
+
+        _progress_sink.set(sink)
+        for attempt in range(1, max_retries + 1):
+            try:
+                if orchestrator.stream_outputs:
+                    tool_calls = {}
+                    for step in orchestrator.run(request, stream=True):
+                        if isinstance(step, ToolCall) and step.name != "final_answer":
+                            tools_started = True
+                        elif isinstance(step, FinalAnswerStep):
+                            response = step.output
+                        elif isinstance(step, ChatMessageStreamDelta) and step.tool_calls:
+                            for delta in step.tool_calls:
+                                call = tool_calls.setdefault(delta.index, {"name": "", "arguments": ""})
+                                if delta.function and delta.function.name:
+                                    call = tool_calls[delta.index] = {"name": delta.function.name, "arguments": ""}
+                                if delta.function and delta.function.arguments:
+                                    call["arguments"] += delta.function.arguments
+                                if call["name"] == "final_answer":
+                                    text_so_far = _partial_json_string(call["arguments"], "answer")
+                                    if len(text_so_far) > len(streamed):
+                                        put({"type": "response_delta", "text": text_so_far[len(streamed):]})
+                                        streamed = text_so_far
+                else:
+                    response = orchestrator.run(request)
+                break
+            except Exception as e:
+                put({"type": "error", "message": str(e)})
+                if tools_started:
+                    # Agents may already have restocked or recorded a sale; running the request
+                    # again could repeat those writes, so stop here
+                    response = PARTIAL_FAILURE_RESPONSE
+                    break
+                if attempt == max_retries:
+                    response = UNAVAILABLE_RESPONSE
+                    break
+                if streamed:
+                    put({"type": "response_reset"})
+                    streamed = ""
+                time.sleep(attempt * 2)  # Same backoff as run_with_retries: 2s, 4s
+
+        response = str(response)
+        if not streamed or not response.startswith(streamed):
+            if streamed:
+                put({"type": "response_reset"})
+            for piece in re.findall(r"\S+\s*|\s+", response):
+                put({"type": "response_delta", "text": piece})
+        elif len(response) > len(streamed):
+            put({"type": "response_delta", "text": response[len(streamed):]})
+        put({"type": "response", "text": response})
+        events.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        event = events.get()
+        if event is done:
+            return
+        yield event
+
+
+
+# Durable per-request record of a scenario run, used by --resume
+RESULTS_JOURNAL_PATH = "test_results.jsonl"
+
+
+class ResultsJournal:
     """
-    report = generate_financial_report(as_of_date)
-    lines = [
-        "=== Financial Report ===",
-        f"Date: {report['as_of_date']}",
-        f"Cash Balance: ${report['cash_balance']:.2f}",
-        f"Inventory Value: ${report['inventory_value']:.2f}",
-        f"Total Assets: ${report['total_assets']:.2f}",
-        "",
-        "Top Selling Products:",
-    ]
-    for item in report["top_selling_products"]:
-        lines.append(f"  {item['item_name']}: {item['total_units']} units, ${item['total_revenue']:.2f} revenue")
+    Append-only JSONL journal of a scenario run, fsynced after every entry.
 
-    return "\n".join(lines)
+    The first entry of a run is a 'start' marker; each completed request adds a 'result'
+    entry. Both record the ledger's last transaction rowid, so a resumed run can drop
+    writes made by a request that crashed before it was journaled.
+    """
 
+    def __init__(self, path: str = RESULTS_JOURNAL_PATH):
+        self.path = path
+
+    def load(self) -> List[Dict]:
+        """Read all complete entries. A torn final line from a crash mid-write is dropped from the file."""
+        if not os.path.exists(self.path):
+            return []
+        entries, good_bytes = [], 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+                good_bytes += len(line)
+        if good_bytes < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good_bytes)
+        return entries
+
+    def start(self, entry: Dict):
+        """Begin a new run, discarding any previous journal."""
+        with open(self.path, "w", encoding="utf-8"):
+            pass
+        self.append({"type": "start", **entry})
+
+    def append(self, entry: Dict):
+        """Write one entry and force it to disk before returning."""
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=float) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _last_ledger_rowid() -> int:
+    with db_engine.connect() as conn:
+        return conn.execute(text("SELECT COALESCE(MAX(rowid), 0) FROM transactions")).scalar()
 
-# Set up your agents and create an orchestration agent that will manage them.
 
-inventory_agent = ToolCallingAgent(
-    tools=[check_inventory, check_item_stock, restock_item, get_product_catalog],
-    model=model,
-    name="inventory_agent",
-    description=(
-        "Manages warehouse inventory. ALWAYS call get_product_catalog FIRST to find the exact catalog item names "
-        "that match what the customer is asking for. Customers use informal names like 'A4 printer paper' but the "
-        "catalog name is 'A4 paper'. Map each requested item to the closest matching catalog name. "
-        "Then use check_item_stock with the EXACT catalog name to see current stock. "
-        "If stock is low or zero, call restock_item with the EXACT catalog name and the DATE from the request. "
-        "In your response, always list the EXACT catalog names you found so other agents can use them."
-    ),
-)
+def _restore_journaled_state(entries: List[Dict], initial_date: str) -> Tuple[float, float]:
+    """
+    Bring the ledger back to the state recorded by the last journal entry and verify it.
 
-quoting_agent = ToolCallingAgent(
-    tools=[search_past_quotes, get_product_catalog, calculate_quote],
-    model=model,
-    name="quoting_agent",
-    description=(
-        "Handles pricing and quotes. Use the EXACT catalog item names provided by inventory_agent. "
-        "First call search_past_quotes for similar orders, then call calculate_quote with the exact catalog names "
-        "and quantities. Always use the DATE from the customer's original request when calling calculate_quote."
-    ),
-)
+    Transactions written after the last journaled rowid belong to a request that did not
+    finish, and are deleted. The cash balance, inventory value and per-item stock are then
+    compared with the journal.
 
-order_agent = ToolCallingAgent(
-    tools=[process_sale, check_delivery_estimate, get_balance, get_financial_report],
-    model=model,
-    name="order_agent",
-    description=(
-        "Processes sales and manages finances. Use the EXACT catalog item names and the quoted prices from "
-        "quoting_agent. For each item, call process_sale with the exact catalog name, quantity, quoted price, "
-        "and the DATE from the customer's original request. Also call check_delivery_estimate using the request date. "
-        "IMPORTANT: Always use the date from the customer request (e.g. 2025-04-05), not any other date."
-    ),
-)
+    Returns:
+        Tuple[float, float]: Cash balance and inventory value to continue from.
 
-orchestrator = ToolCallingAgent(
-    tools=[],
-    model=model,
-    managed_agents=[inventory_agent, quoting_agent, order_agent],
-    name="orchestrator",
-    description=(
-        "Orchestrator for Munder Difflin Paper Company. Coordinates customer requests by calling agents in this order:\n"
-        "1) inventory_agent — Tell it the items the customer wants AND the request date. It will look up the product "
-        "catalog to find exact matching names, check stock, and restock if needed. Note the EXACT catalog names it returns.\n"
-        "2) quoting_agent — Pass the EXACT catalog item names from inventory_agent (not the customer's informal names) "
-        "and the quantities. It will calculate pricing with bulk discounts.\n"
-        "3) order_agent — Pass the EXACT catalog item names, quantities, the quoted prices, and the request date. "
-        "It will process the sale transactions and check delivery estimates.\n"
-        "After all agents respond, combine results into a professional customer response with items ordered, "
-        "itemized quote with any discounts applied, total price, and estimated delivery date."
-    ),
-)
+    Raises:
+        RuntimeError: If the ledger is older than the journal or does not match it.
+    """
+    last = entries[-1]
+    with ledger_write_transaction() as conn:
+        current_rowid = conn.execute(text("SELECT COALESCE(MAX(rowid), 0) FROM transactions")).scalar()
+        if current_rowid < last["ledger_rowid"]:
+            raise RuntimeError(
+                f"Database has fewer transactions than the journal (rowid {current_rowid} < {last['ledger_rowid']}); "
+                "run without --resume to start over."
+            )
+        dropped = conn.execute(text("DELETE FROM transactions WHERE rowid > :rowid"), {"rowid": last["ledger_rowid"]}).rowcount
+    ledger_cache.clear()
+    if dropped:
+        print(f"Dropped {dropped} transactions from the unfinished request.")
+
+    as_of_date = last.get("request_date", initial_date)
+    report = generate_financial_report(as_of_date)
+    mismatches = [
+        f"{key}: journal {last[key]:.2f}, database {report[key]:.2f}"
+        for key in ("cash_balance", "inventory_value") if round(report[key] - last[key], 2) != 0
+    ]
+    stock = get_all_inventory(as_of_date)
+    mismatches += [
+        f"{item}: journal {units} units, database {stock.get(item, 0)} units"
+        for item, units in last["stock"].items() if stock.get(item, 0) != units
+    ]
+    if mismatches:
+        raise RuntimeError("Database does not match the journal; run without --resume to start over.\n" + "\n".join(mismatches))
+    return report["cash_balance"], report["inventory_value"]
 
 
-# Run your test scenarios by writing them here. Make sure to keep track of them.
+def run_test_scenarios(resume: bool = False, journal_path: str = RESULTS_JOURNAL_PATH):
+    """
+    Run the sample scenarios through the orchestrator and write test_results.csv.
 
-def run_test_scenarios():
-    
-    print("Initializing Database...")
-    init_database(db_engine)
+    Every finished request is journaled to `journal_path` before the next one starts. With
+    `resume`, requests already in the journal are skipped and the database is checked
+    against (and rolled back to) the last journaled state instead of being re-initialized.
+    """
+    journal = ResultsJournal(journal_path)
+    entries = journal.load() if resume else []
+    if resume and not entries:
+        print(f"No journal at {journal_path}; starting a fresh run.")
+        resume = False
+
+    if not resume:
+        print("Initializing Database...")
+        init_database(db_engine)
     try:
-        quote_requests_sample = pd.read_csv("quote_requests_sample.csv")
-        quote_requests_sample["request_date"] = pd.to_datetime(
-            quote_requests_sample["request_date"], format="%m/%d/%y", errors="coerce"
-        )
-        quote_requests_sample.dropna(subset=["request_date"], inplace=True)
-        quote_requests_sample = quote_requests_sample.sort_values("request_date")
+        quote_requests_sample = load_test_scenarios("quote_requests_sample.csv")
     except Exception as e:
         print(f"FATAL: Error loading test data: {e}")
         return
 
     # Get initial state
     initial_date = quote_requests_sample["request_date"].min().strftime("%Y-%m-%d")
-    report = generate_financial_report(initial_date)
-    current_cash = report["cash_balance"]
-    current_inventory = report["inventory_value"]
+    if resume:
+        current_cash, current_inventory = _restore_journaled_state(entries, initial_date)
+        print(f"Resuming after {len(entries) - 1} journaled requests.")
+    else:
+        report = generate_financial_report(initial_date)
+        current_cash = report["cash_balance"]
+        current_inventory = report["inventory_value"]
+        journal.start({"ledger_rowid": _last_ledger_rowid(), "cash_balance": current_cash,
+                       "inventory_value": current_inventory, "stock": get_all_inventory(initial_date)})
+        entries = journal.load()
 
     ############
     ############
@@ -1032,8 +4317,16 @@ def run_test_scenarios():
     ############
     ############
 
-    results = []
+    item_alias_store.reset_stats()
+
+    results = [
+        {key: value for key, value in entry.items() if key not in ("type", "ledger_rowid", "stock")}
+        for entry in entries if entry["type"] == "result"
+    ]
+    completed = {result["request_id"] for result in results}
     for idx, row in quote_requests_sample.iterrows():
+        if idx + 1 in completed:
+            continue
         request_date = row["request_date"].strftime("%Y-%m-%d")
 
         print(f"\n=== Request {idx+1} ===")
@@ -1043,7 +4336,7 @@ def run_test_scenarios():
         print(f"Inventory Value: ${current_inventory:.2f}")
 
         # Process request
-        request_with_date = f"{row['request']} (Date of request: {request_date})"
+        request_with_date = format_request(row)
 
         ############
         ############
@@ -1053,23 +4346,9 @@ def run_test_scenarios():
         ############
         ############
 
-        max_retries = 3
-        response = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                response = orchestrator.run(request_with_date)
-                break  # Success — exit retry loop
-            except Exception as e:
-                print(f"[Attempt {attempt}/{max_retries}] Error: {e}")
-                if attempt < max_retries:
-                    print(f"Retrying in {attempt * 2} seconds...")
-                    time.sleep(attempt * 2)  # Exponential backoff: 2s, 4s
-                else:
-                    print(f"All {max_retries} attempts failed.")
-                    response = (
-                        "We apologize, but we are currently unable to process your request due to a temporary system issue. "
-                        "Please try again later or contact our support team for assistance."
-                    )
+        usage_tracker.reset()
+        response = run_with_retries(orchestrator, request_with_date)
+        usage = usage_tracker.totals()
 
         # Update state
         report = generate_financial_report(request_date)
@@ -1079,16 +4358,19 @@ def run_test_scenarios():
         print(f"Response: {response}")
         print(f"Updated Cash: ${current_cash:.2f}")
         print(f"Updated Inventory: ${current_inventory:.2f}")
-
-        results.append(
-            {
-                "request_id": idx + 1,
-                "request_date": request_date,
-                "cash_balance": current_cash,
-                "inventory_value": current_inventory,
-                "response": response,
-            }
-        )
+        print(f"Agent steps: {usage['steps']} | Input tokens: {usage['input_tokens']:,}")
+
+        result = {
+            "request_id": idx + 1,
+            "request_date": request_date,
+            "cash_balance": current_cash,
+            "inventory_value": current_inventory,
+            "response": response,
+            **usage,
+        }
+        journal.append({"type": "result", **result, "ledger_rowid": _last_ledger_rowid(),
+                        "stock": get_all_inventory(request_date)})
+        results.append(result)
 
         time.sleep(1)
 
@@ -1099,15 +4381,803 @@ def run_test_scenarios():
     print(f"Final Cash: ${final_report['cash_balance']:.2f}")
     print(f"Final Inventory: ${final_report['inventory_value']:.2f}")
 
+    alias_stats = item_alias_store.stats()
+    print(
+        f"Item name mappings: {alias_stats['hits']} hits / {alias_stats['misses']} misses "
+        f"({alias_stats['hit_rate']:.0%} hit rate, {alias_stats['learned_phrases']} learned phrases; "
+        f"{alias_stats['catalog_matches']} exact catalog names)"
+    )
+
+    cache_stats = ledger_cache.stats()
+    print(
+        f"Ledger cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%} hit rate)"
+    )
+
+    flight_stats = query_flight.stats()
+    print(
+        f"Coalesced reads: {flight_stats['coalesced']} of {flight_stats['calls']} queries shared "
+        f"an identical in-flight query"
+    )
+
     # Save results
     pd.DataFrame(results).to_csv("test_results.csv", index=False)
     return results
 
 
+def measure_batch_tool_savings(
+    sample_path: str = "quote_requests_sample.csv",
+    output_path: str = "batch_tool_savings.csv",
+) -> pd.DataFrame:
+    """
+    Measure model steps, tool calls and tokens with and without the multi-item tools.
+
+    Runs every scenario in `sample_path` twice from the same seeded database: once with
+    the single-item tools only, and once with check_items_stock, restock_items and
+    process_order preferred. Per-request usage of both runs is written to `output_path`
+    and the totals are printed.
+
+    Args:
+        sample_path (str, optional): Scenario CSV to replay.
+        output_path (str, optional): Where to write the per-request comparison.
+
+    Returns:
+        pd.DataFrame: One row per (variant, request) with the usage counters.
+    """
+    scenarios = load_test_scenarios(sample_path)
+    rows = []
+    for variant, use_batch_tools in [("single_item_tools", False), ("batch_tools", True)]:
+        reset_database(db_engine)
+        variant_agents = build_agents(model, use_batch_tools=use_batch_tools)
+        tracker = variant_agents["usage_tracker"]
+        for idx, row in scenarios.iterrows():
+            print(f"\n=== {variant}: Request {idx+1} ===")
+            tracker.reset()
+            run_with_retries(variant_agents["orchestrator"], format_request(row))
+            rows.append({"variant": variant, "request_id": idx + 1, **tracker.totals()})
+
+    usage = pd.DataFrame(rows)
+    usage.to_csv(output_path, index=False)
+
+    totals = usage.groupby("variant")[["steps", "tool_calls", "input_tokens", "cached_input_tokens", "output_tokens"]].sum()
+    print("\n===== BATCH TOOL SAVINGS =====")
+    print(totals.to_string())
+    for column in totals.columns:
+        before = totals.loc["single_item_tools", column]
+        after = totals.loc["batch_tools", column]
+        saved = before - after
+        print(f"{column}: {saved:,} saved ({saved / before:.0%})" if before else f"{column}: n/a")
+    return usage
+
+
+class PromptCacheStandInServer:
+    """
+    Local OpenAI-compatible chat completions server that imitates provider prompt caching.
+
+    Every request's tools and messages are serialized in order; the longest prefix shared
+    with an earlier request counts as cached, in `cache_increment` token steps once it
+    reaches `min_cached_tokens` (roughly 4 characters per token). Latency grows with the
+    uncached tokens only, so the effect of a stable prefix shows up in both the reported
+    usage and the wall time. Replies drive the agents without a real model: an agent that
+    manages others calls each of them once, and every agent then gives a final answer
+    (see `_stand_in_tool_call`).
+
+    Use as a context manager; `url` is the api_base to give the model.
+    """
+
+    def __init__(
+        self,
+        cache_enabled: bool = True,
+        min_cached_tokens: int = 1024,
+        cache_increment: int = 128,
+        base_latency: float = 0.02,
+        seconds_per_1k_uncached: float = 0.05,
+        max_cached_prompts: int = 256,
+    ):
+        self.cache_enabled = cache_enabled
+        self.min_cached_tokens = min_cached_tokens
+        self.cache_increment = cache_increment
+        self.base_latency = base_latency
+        self.seconds_per_1k_uncached = seconds_per_1k_uncached
+        self._prompts = []
+        self._max_cached_prompts = max_cached_prompts
+        self._lock = threading.Lock()
+        self._server = None
+        self.stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+    def _cached_tokens(self, prompt: str) -> int:
+        if not self.cache_enabled:
+            return 0
+        with self._lock:
+            shared = max((len(os.path.commonprefix([prompt, seen])) for seen in self._prompts), default=0)
+            self._prompts.append(prompt)
+            del self._prompts[:-self._max_cached_prompts]
+        tokens = shared // 4
+        if tokens < self.min_cached_tokens:
+            return 0
+        return tokens // self.cache_increment * self.cache_increment
+
+    def _reply(self, body: Dict) -> Dict:
+        prompt = json.dumps(body.get("tools", [])) + json.dumps(body["messages"])
+        prompt_tokens = len(prompt) // 4
+        cached_tokens = min(self._cached_tokens(prompt), prompt_tokens)
+        time.sleep(self.base_latency + (prompt_tokens - cached_tokens) / 1000 * self.seconds_per_1k_uncached)
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["cached_tokens"] += cached_tokens
+
+        # smolagents sends each finished step's tool calls as an assistant "Calling tools:" message
+        tool_call_messages = [
+            m for m in body["messages"]
+            if m["role"] == "assistant" and json.dumps(m.get("content")).startswith(('"Calling tools:', '[{"type": "text", "text": "Calling tools:'))
+        ]
+        name, arguments = _stand_in_tool_call([t["function"]["name"] for t in body.get("tools", [])], len(tool_call_messages))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stand-in"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [{
+                        "id": f"call_{uuid.uuid4().hex[:12]}",
+                        "type": "function",
+                        "function": {"name": name, "arguments": json.dumps(arguments)},
+                    }],
+                },
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 20,
+                "total_tokens": prompt_tokens + 20,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    def __enter__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                payload = json.dumps(stand_in._reply(body)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+
+def measure_prompt_caching(
+    sample_path: str = "quote_requests_sample.csv",
+    max_requests: int = 5,
+    output_path: str = "prompt_cache_savings.csv",
+) -> pd.DataFrame:
+    """
+    Measure cached versus uncached input tokens and latency against `PromptCacheStandInServer`.
+
+    Replays the first `max_requests` scenarios three times through the full agent setup,
+    each time against a fresh stand-in server: with prompt caching off, with caching on,
+    and with caching on after `prewarm_prompt_cache`. Per-call usage is written to
+    `output_path` and the totals are printed.
+
+    Args:
+        sample_path (str, optional): Scenario CSV to replay.
+        max_requests (int, optional): Number of scenarios per run.
+        output_path (str, optional): Where to write the per-call records.
+
+    Returns:
+        pd.DataFrame: Totals per run.
+    """
+    scenarios = load_test_scenarios(sample_path).head(max_requests)
+    calls, totals = [], []
+    for run, cache_enabled, prewarm in [("no_cache", False, False), ("cache", True, False), ("cache_prewarmed", True, True)]:
+        reset_database(db_engine)
+        with PromptCacheStandInServer(cache_enabled=cache_enabled) as server:
+            stand_in_model = OpenAIServerModel(model_id="stand-in", api_base=server.url, api_key="stand-in")
+            run_agents = build_agents(stand_in_model)
+            tracker = run_agents["usage_tracker"]
+            if prewarm:
+                prewarm_prompt_cache(run_agents)
+            started = time.perf_counter()
+            for idx, row in scenarios.iterrows():
+                run_with_retries(run_agents["orchestrator"], format_request(row))
+            seconds = time.perf_counter() - started
+        calls += [{"run": run, **call} for call in tracker.calls]
+        usage = pd.DataFrame(tracker.calls)
+        totals.append({
+            "run": run,
+            "model_calls": len(usage),
+            "input_tokens": int(usage["input_tokens"].sum()),
+            "cached_input_tokens": int(usage["cached_input_tokens"].sum()),
+            "uncached_input_tokens": int(usage["uncached_input_tokens"].sum()),
+            "seconds": seconds,
+        })
+
+    pd.DataFrame(calls).to_csv(output_path, index=False)
+    totals = pd.DataFrame(totals)
+    totals["cached_share"] = totals["cached_input_tokens"] / totals["input_tokens"]
+    print("\n===== PROMPT CACHING =====")
+    print(totals.to_string(index=False))
+    return totals
+
+
+def measure_model_routing(
+    sample_path: str = "quote_requests_sample.csv",
+    max_requests: int = 5,
+    fast_latency: float = 0.05,
+    strong_latency: float = 0.25,
+    fast_malformed_rate: float = 0.2,
+) -> pd.DataFrame:
+    """
+    Compare one strong model for every agent with routing the worker agents to a fast model.
+
+    Uses `StandInModel`s instead of the API: a slow, reliable "strong" model and a fast
+    "fast" model that produces malformed tool calls at `fast_malformed_rate`. The routed run
+    sends inventory_agent and order_agent to fast with strong as fallback. Prints wall time
+    and the per-model latency, token and failure statistics of both runs.
+
+    Returns:
+        pd.DataFrame: Per-model statistics of both runs.
+    """
+    scenarios = load_test_scenarios(sample_path).head(max_requests)
+    registry = {
+        "strong": StandInModel("strong", latency=strong_latency),
+        "fast": StandInModel("fast", latency=fast_latency, malformed_rate=fast_malformed_rate, seed=1),
+    }
+    configs = {
+        "strong_only": {"default": ["strong"]},
+        "routed": {
+            "agents": {"inventory_agent": ["fast", "strong"], "order_agent": ["fast", "strong"]},
+            "default": ["strong"],
+        },
+    }
+    summaries = []
+    for run, config in configs.items():
+        reset_database(db_engine)
+        stats = ModelCallStats()
+        run_agents = build_agents(model, models=build_routed_models(config, registry=registry, stats=stats))
+        started = time.perf_counter()
+        for idx, row in scenarios.iterrows():
+            run_with_retries(run_agents["orchestrator"], format_request(row))
+        seconds = time.perf_counter() - started
+        summary = stats.summary()
+        summary.insert(0, "run", run)
+        summaries.append(summary)
+        print(f"\n{run}: {seconds:.2f}s wall time, fallbacks {stats.fallbacks or 0}")
+
+    summaries = pd.concat(summaries, ignore_index=True)
+    print("\n===== MODEL ROUTING =====")
+    print(summaries.to_string(index=False))
+    return summaries
+
+
+def run_reorder_job(as_of_date: str, place_orders: bool = True) -> Dict:
+    """
+    Scheduled restock job: plan (and place) every needed stock order for a date without the agents.
+
+    Args:
+        as_of_date (str): Date the orders are placed (YYYY-MM-DD).
+        place_orders (bool, optional): Record the orders; False only prints the plan.
+
+    Returns:
+        Dict: The plan from `plan_reorders`.
+    """
+    plan = plan_reorders(as_of_date, place_orders=place_orders)
+    print(f"\n===== REORDER PLAN {as_of_date} =====")
+    if plan["orders"]:
+        print(pd.DataFrame(plan["orders"]).to_string(index=False))
+    for delivery_date, names in plan["by_delivery_date"].items():
+        print(f"Delivery {delivery_date}: {', '.join(names)}")
+    status = "placed" if plan["placed"] else ("not placed (insufficient cash)" if place_orders and plan["orders"] else "not placed")
+    print(f"{len(plan['orders'])} orders, total ${plan['total_cost']:.2f}, cash ${plan['cash']:.2f}: {status}")
+    return plan
+
+
+# Agent setups the parallel evaluation can compare, as `build_agents` keyword arguments
+EVALUATION_VARIANTS = {
+    "batch_tools": {"use_batch_tools": True},
+    "single_item_tools": {"use_batch_tools": False},
+    "stock_holds": {"use_batch_tools": True, "use_stock_holds": True},
+}
+
+FALLBACK_RESPONSE_PREFIX = "We apologize, but we are currently unable to process your request"
+
+
+def _evaluation_worker(job: Dict) -> Tuple[List[Dict], Dict]:
+    """
+    Run every scenario for one (variant, seed) job against a private copy of the database.
+
+    Runs in a pool process. The module-level `db_engine` and `item_alias_store` are rebound
+    to files in the job's work directory, so no two jobs share ledger state or learned
+    names. Agent console output goes to the job's log file.
+    """
+    global db_engine, item_alias_store
+    import contextlib
+
+    tag = f"{job['variant']}_seed{job['seed']}"
+    db_engine = create_ledger_engine(f"sqlite:///{os.path.join(job['work_dir'], tag + '.db')}")
+    item_alias_store = ItemAliasStore(create_engine(f"sqlite:///{os.path.join(job['work_dir'], tag + '_aliases.db')}"))
+    ledger_cache.clear()
+
+    worker_model = job["model_factory"]() if job["model_factory"] else model
+    scenarios = load_test_scenarios(job["sample_path"])
+    rows = []
+    started = time.perf_counter()
+    with open(os.path.join(job["log_dir"], tag + ".log"), "w") as log, contextlib.redirect_stdout(log):
+        init_database(db_engine, seed=job["seed"])
+        variant_agents = build_agents(worker_model, **EVALUATION_VARIANTS[job["variant"]])
+        tracker = variant_agents["usage_tracker"]
+        for idx, row in scenarios.iterrows():
+            request_date = row["request_date"].strftime("%Y-%m-%d")
+            print(f"\n=== Request {idx+1} ===")
+            tracker.reset()
+            request_started = time.perf_counter()
+            response = run_with_retries(variant_agents["orchestrator"], format_request(row))
+            seconds = time.perf_counter() - request_started
+            report = generate_financial_report(request_date)
+            print(f"Response: {response}")
+            rows.append({
+                "variant": job["variant"],
+                "seed": job["seed"],
+                "request_id": idx + 1,
+                "request_date": request_date,
+                "cash_balance": report["cash_balance"],
+                "inventory_value": report["inventory_value"],
+                "response": response,
+                "seconds": seconds,
+                **tracker.totals(),
+            })
+
+    summary = {
+        "variant": job["variant"],
+        "seed": job["seed"],
+        "requests": len(rows),
+        "failed_requests": sum(str(r["response"]).startswith(FALLBACK_RESPONSE_PREFIX) for r in rows),
+        "seconds": time.perf_counter() - started,
+        "final_cash": rows[-1]["cash_balance"] if rows else None,
+        "final_inventory": rows[-1]["inventory_value"] if rows else None,
+    }
+    return rows, summary
+
+
+def run_parallel_evaluation(
+    variants: Tuple[str, ...] = ("batch_tools", "single_item_tools"),
+    seeds: Tuple[int, ...] = (137,),
+    workers: Optional[int] = None,
+    sample_path: str = "quote_requests_sample.csv",
+    results_path: str = "evaluation_results.csv",
+    report_path: str = "evaluation_report.csv",
+    log_dir: str = "evaluation_logs",
+    model_factory=None,
+) -> pd.DataFrame:
+    """
+    Run the test scenarios for several agent variants and database seeds side by side.
+
+    Every (variant, seed) pair is an independent job in a process pool. Each job seeds its
+    own temporary database from the snapshot for its seed, so jobs never see each other's
+    sales or restocks. Per-request rows of all jobs are merged into `results_path`, in the
+    same columns as test_results.csv plus variant, seed and seconds. The per-job summary
+    with timing and token totals is written to `report_path` and printed.
+
+    Args:
+        variants (Tuple[str, ...], optional): Names from `EVALUATION_VARIANTS`.
+        seeds (Tuple[int, ...], optional): Database seeds to run each variant on.
+        workers (Optional[int], optional): Pool size. Defaults to one process per job, since
+            jobs mostly wait on the model API.
+        sample_path (str, optional): Scenario CSV to replay.
+        results_path (str, optional): Where to write the merged per-request results.
+        report_path (str, optional): Where to write the per-job comparison.
+        log_dir (str, optional): Directory for each job's agent output.
+        model_factory (callable, optional): Picklable zero-argument function returning the model
+            for a job. Defaults to the module-level `model`.
+
+    Returns:
+        pd.DataFrame: The per-job comparison.
+    """
+    import multiprocessing
+    import shutil
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    unknown = [v for v in variants if v not in EVALUATION_VARIANTS]
+    if unknown:
+        raise ValueError(f"Unknown variants {unknown}; choose from {list(EVALUATION_VARIANTS)}")
+
+    os.makedirs(log_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="evaluation_")
+
+    # Build each missing seed snapshot once up front, so jobs only copy it. This uses a
+    # scratch database: the live ledger behind `db_engine` is never touched.
+    for seed in seeds:
+        snapshot_path = _snapshot_path(seed)
+        if not os.path.exists(snapshot_path):
+            scratch_engine = create_ledger_engine(f"sqlite:///{os.path.join(work_dir, f'build_seed{seed}.db')}")
+            try:
+                save_database_snapshot(_build_database(scratch_engine, seed), snapshot_path)
+            finally:
+                scratch_engine.dispose()
+    jobs = [
+        {"variant": variant, "seed": seed, "sample_path": sample_path, "work_dir": work_dir,
+         "log_dir": log_dir, "model_factory": model_factory}
+        for variant in variants for seed in seeds
+    ]
+    workers = workers or len(jobs)
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+
+    print(f"Running {len(jobs)} evaluation jobs on {workers} worker processes (logs in {log_dir}/)...")
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            outputs = list(pool.map(_evaluation_worker, jobs))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    wall_seconds = time.perf_counter() - started
+
+    results = pd.DataFrame([row for rows, _ in outputs for row in rows])
+    results.to_csv(results_path, index=False)
+
+    usage_columns = ["steps", "tool_calls", "input_tokens", "cached_input_tokens", "output_tokens"]
+    report = pd.DataFrame([summary for _, summary in outputs]).set_index(["variant", "seed"])
+    if not results.empty:
+        per_job = results.groupby(["variant", "seed"])
+        report = report.join(per_job[usage_columns].sum()).join(per_job["seconds"].mean().rename("mean_request_seconds"))
+    report = report.reset_index()
+    report.to_csv(report_path, index=False)
+
+    print("\n===== EVALUATION REPORT =====")
+    print(report.to_string(index=False))
+    print(
+        f"Wall time: {wall_seconds:.1f}s for {report['seconds'].sum():.1f}s of job time "
+        f"({report['seconds'].sum() / wall_seconds:.1f}x)"
+    )
+    return report
+
+
+def stress_test_concurrent_writes(
+    num_sales: int = 2000,
+    num_restocks: int = 200,
+    workers: int = 64,
+    item_name: str = "A4 paper",
+    as_of_date: str = "2025-04-05",
+) -> Dict:
+    """
+    Fire thousands of concurrent sales at one item, and concurrent restocks at the cash balance.
+
+    Starts from the seeded database. Every sale asks for one unit, and there are more sales
+    than units in stock, so exactly `stock` sales must succeed and stock must end at zero.
+    Every restock costs a tenth of the starting cash, so exactly ten must succeed and cash
+    must never go negative.
+
+    Args:
+        num_sales (int, optional): Concurrent one-unit sales to fire.
+        num_restocks (int, optional): Concurrent restocks to fire.
+        workers (int, optional): Threads issuing the calls.
+        item_name (str, optional): Item to sell and restock.
+        as_of_date (str, optional): Date of every transaction.
+
+    Returns:
+        Dict: Counts of successful sales and restocks, and the final stock and cash.
+
+    Raises:
+        AssertionError: If the ledger oversold or overspent.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    reset_database(db_engine)
+    start_stock = int(get_stock_level(item_name, as_of_date)["current_stock"].iloc[0])
+    start_cash = get_cash_balance(as_of_date)
+    unit_price = next(p["unit_price"] for p in paper_supplies if p["item_name"] == item_name)
+    restock_units = int(start_cash / 10 / unit_price)
+    expected_restocks = min(num_restocks, int(start_cash // (restock_units * unit_price)))
+    assert num_sales > start_stock, "Use more sales than units in stock to exercise the limit"
+
+    def sell(_):
+        return process_sale(item_name=item_name, quantity=1, price=unit_price, date=as_of_date)
+
+    def restock(_):
+        # Restocks are dated one day earlier than the sales, so their units never refill stock
+        # for the sales and every sale competes for the seeded stock only
+        return restock_item(item_name=item_name, quantity=restock_units, date="2025-01-02")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sale_results = list(pool.map(sell, range(num_sales)))
+    sale_seconds = time.perf_counter() - started
+
+    reset_database(db_engine)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        restock_results = list(pool.map(restock, range(num_restocks)))
+
+    sales_ok = sum(r.startswith("Sale processed") for r in sale_results)
+    restocks_ok = sum(r.startswith("Restock order placed") for r in restock_results)
+    final_cash = get_cash_balance("2025-01-02")
+    summary = {
+        "start_stock": start_stock,
+        "sales_ok": sales_ok,
+        "sales_per_second": num_sales / sale_seconds,
+        "restocks_ok": restocks_ok,
+        "expected_restocks": expected_restocks,
+        "final_cash": final_cash,
+    }
+    print(f"Stress test: {summary}")
+
+    assert sales_ok == start_stock, f"Expected {start_stock} sales, got {sales_ok}"
+    assert restocks_ok == expected_restocks, f"Expected {expected_restocks} restocks, got {restocks_ok}"
+    assert final_cash >= 0, f"Cash went negative: {final_cash}"
+    return summary
+
+
+def compare_sharded_execution(
+    num_events: int = 20000,
+    shard_counts: Tuple[int, ...] = (1, 2, 4, 8),
+    shard_key: str = "hash",
+    seed: int = 7,
+) -> pd.DataFrame:
+    """
+    Benchmark sharded workload execution against the single-process run and check they agree.
+
+    Every run starts from the seeded database and applies the same synthetic workload.
+    The baseline commits in batches of `SHARD_BATCH_SIZE` like the shards, so the speedup
+    column only reflects extra processes; a run committing every event on its own is
+    listed for reference. Each sharded run's final financial report must match the
+    single-process report. This covers the synthetic workload only: request processing
+    by the agents is not sharded.
+
+    Args:
+        num_events (int, optional): Size of the synthetic workload.
+        shard_counts (Tuple[int, ...], optional): Shard process counts to try.
+        shard_key (str, optional): 'category' or 'hash'; see `shard_for_items`.
+        seed (int, optional): Workload seed.
+
+    Returns:
+        pd.DataFrame: Elapsed time, throughput and speedup over the batched single-process
+                      run per configuration.
+
+    Raises:
+        AssertionError: If a run's report differs from the batched single-process report.
+    """
+    events = generate_synthetic_workload(num_events, seed=seed)
+    final_date = events[-1]["date"]
+
+    def summarize(report):
+        return (
+            round(report["cash_balance"], 2),
+            round(report["inventory_value"], 2),
+            # str() so NaN totals compare equal
+            str([(p["item_name"], p["total_units"], round(p["total_revenue"], 2)) for p in report["top_selling_products"]]),
+        )
+
+    configurations = [("single_process", 1, lambda: run_workload_sequential(events))]
+    configurations.append(
+        ("single_process_commit_per_event", 1, lambda: run_workload_sequential(events, batch_size=1))
+    )
+    configurations += [
+        (f"sharded_{shard_key}", num_shards,
+         lambda num_shards=num_shards: run_workload_sharded(events, num_shards=num_shards, shard_key=shard_key))
+        for num_shards in shard_counts
+    ]
+
+    timings, expected = [], None
+    for mode, num_shards, run in configurations:
+        reset_database(db_engine)
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        actual = summarize(generate_financial_report(final_date))
+        expected = expected or actual
+        assert actual == expected, f"{mode} ({num_shards} shards) report differs: {actual} != {expected}"
+        timings.append({"mode": mode, "shards": num_shards, "seconds": elapsed, "events_per_second": num_events / elapsed})
+
+    results = pd.DataFrame(timings)
+    results["speedup"] = results["seconds"].iloc[0] / results["seconds"]
+    print("\n===== SHARDED EXECUTION =====")
+    print(f"{num_events} synthetic events, batches of {SHARD_BATCH_SIZE}, {os.cpu_count()} CPU(s) available")
+    print(results.to_string(index=False))
+    print(f"Final reports match the single-process run (cash ${expected[0]:.2f}, inventory ${expected[1]:.2f}).")
+    return results
+
+
+def benchmark_helper_fast_path(iterations: int = 2000, traced_calls: int = 200) -> pd.DataFrame:
+    """
+    Measure per-call time and memory of the pandas helpers against the typed fast path.
+
+    Compares a stock lookup, an inventory row lookup and recording a sale, each the way
+    the tools used to do it with pandas and the way they do it now. `ledger_cache` is
+    turned off so every call reaches SQLite. Starts from and restores the seeded database.
+
+    Args:
+        iterations (int, optional): Timed calls per operation and path.
+        traced_calls (int, optional): Calls per operation and path run under tracemalloc.
+
+    Returns:
+        pd.DataFrame: Microseconds and peak KiB allocated per call, per operation and path.
+    """
+    import tracemalloc
+
+    reset_database(db_engine)
+    names = get_inventory_reference()["item_name"].tolist()
+    dates = [(datetime(2025, 1, 1) + timedelta(days=day)).strftime("%Y-%m-%d") for day in range(120)]
+    args = [(names[i % len(names)], dates[i % len(dates)]) for i in range(iterations)]
+
+    def pandas_sale(name, date):
+        # Starter-code create_transaction: a one-row DataFrame appended with to_sql
+        pd.DataFrame([{
+            "item_name": name, "transaction_type": "sales", "units": 1, "price": 0.01, "transaction_date": date,
+        }]).to_sql("transactions", db_engine, if_exists="append", index=False)
+        return int(pd.read_sql("SELECT last_insert_rowid() as id", db_engine).iloc[0]["id"])
+
+    operations = {
+        "stock_level": (
+            lambda name, date: int(get_stock_level(name, date)["current_stock"].iloc[0]),
+            lambda name, date: fetch_stock_level(name, date).current_stock,
+        ),
+        "inventory_item": (
+            lambda name, date: pd.read_sql(
+                "SELECT * FROM inventory WHERE item_name = :name", db_engine, params={"name": name}
+            ),
+            lambda name, date: fetch_inventory_item(name),
+        ),
+        "record_sale": (
+            pandas_sale,
+            lambda name, date: create_transaction(name, "sales", 1, 0.01, date),
+        ),
+    }
+
+    rows = []
+    cache_enabled = ledger_cache.enabled
+    ledger_cache.enabled = False
+    try:
+        for operation, paths in operations.items():
+            for path, call in zip(("pandas", "fast_path"), paths):
+                started = time.perf_counter()
+                for name, date in args:
+                    call(name, date)
+                seconds = time.perf_counter() - started
+
+                tracemalloc.start()
+                peaks = []
+                for name, date in args[:traced_calls]:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    call(name, date)
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+                tracemalloc.stop()
+
+                rows.append({
+                    "operation": operation,
+                    "path": path,
+                    "us_per_call": seconds / iterations * 1e6,
+                    "peak_kib_per_call": sum(peaks) / len(peaks) / 1024,
+                })
+    finally:
+        ledger_cache.enabled = cache_enabled
+        reset_database(db_engine)
+
+    results = pd.DataFrame(rows)
+    pandas_us = results[results["path"] == "pandas"].set_index("operation")["us_per_call"]
+    results["speedup"] = results["operation"].map(pandas_us) / results["us_per_call"]
+    print("\n===== HELPER FAST PATH =====")
+    print(results.to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+    return results
+
+
 if __name__ == "__main__":
-    tee = TeeOutput("full_run_output.txt")
+    parser = argparse.ArgumentParser(description="Run the Munder Difflin multi-agent test scenarios.")
+    parser.add_argument(
+        "--measure-batch-tools",
+        action="store_true",
+        help="Compare steps and tokens with and without the multi-item tools instead of a normal run.",
+    )
+    parser.add_argument(
+        "--stress-test",
+        action="store_true",
+        help="Fire thousands of concurrent sales and restocks at the ledger and check it stays consistent.",
+    )
+    parser.add_argument(
+        "--sharded-benchmark",
+        action="store_true",
+        help="Run a large synthetic workload single-process and across shard processes, and compare.",
+    )
+    parser.add_argument(
+        "--benchmark-fast-path",
+        action="store_true",
+        help="Compare per-call time and memory of the pandas helpers and the typed fast path.",
+    )
+    parser.add_argument(
+        "--parallel-eval",
+        action="store_true",
+        help="Run the scenarios for several agent variants and seeds in parallel, each on its own database copy.",
+    )
+    parser.add_argument(
+        "--variants",
+        default="batch_tools,single_item_tools",
+        help=f"Comma-separated variants for --parallel-eval ({', '.join(EVALUATION_VARIANTS)}).",
+    )
+    parser.add_argument("--seeds", default="137", help="Comma-separated database seeds for --parallel-eval.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --parallel-eval.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=f"Continue an interrupted scenario run from {RESULTS_JOURNAL_PATH}, skipping finished requests.",
+    )
+    parser.add_argument(
+        "--reorder-job",
+        metavar="DATE",
+        help="Run the restock planner for DATE (YYYY-MM-DD) and place every needed stock order.",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="With --reorder-job, only print the plan.")
+    parser.add_argument(
+        "--measure-prompt-cache",
+        action="store_true",
+        help="Measure cached vs uncached input tokens and latency against a local stand-in model server.",
+    )
+    parser.add_argument(
+        "--measure-routing",
+        action="store_true",
+        help="Compare one strong model for all agents with per-agent routing, using local stand-in models.",
+    )
+    parser.add_argument(
+        "--stream",
+        metavar="REQUEST",
+        help="Handle one request and print its progress events and the response as they arrive.",
+    )
+    args = parser.parse_args()
+
+    tee = TeeOutput("full_run_output.txt", mode="a" if args.resume else "w")
     sys.stdout = tee
     try:
-        results = run_test_scenarios()
+        if args.measure_batch_tools:
+            measure_batch_tool_savings()
+        elif args.stress_test:
+            stress_test_concurrent_writes()
+        elif args.stream:
+            for event in stream_request(args.stream):
+                if event["type"] == "response_delta":
+                    print(event["text"], end="", flush=True)
+                elif event["type"] != "response":
+                    details = {k: v for k, v in event.items() if k not in ("type", "elapsed")}
+                    print(f"[{event['elapsed']:6.1f}s] {event['type']}: {details}")
+            print()
+        elif args.measure_routing:
+            measure_model_routing()
+        elif args.measure_prompt_cache:
+            measure_prompt_caching()
+        elif args.reorder_job:
+            run_reorder_job(args.reorder_job, place_orders=not args.dry_run)
+        elif args.sharded_benchmark:
+            compare_sharded_execution()
+        elif args.benchmark_fast_path:
+            benchmark_helper_fast_path()
+        elif args.parallel_eval:
+            run_parallel_evaluation(
+                variants=tuple(v.strip() for v in args.variants.split(",") if v.strip()),
+                seeds=tuple(int(seed) for seed in args.seeds.split(",")),
+                workers=args.workers,
+            )
+        else:
+            results = run_test_scenarios(resume=args.resume)
     finally:
         tee.close()
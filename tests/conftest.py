@@ -0,0 +1,34 @@
+"""Shared fixtures: import the module with a placeholder API key and a seeded temp database."""
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+os.environ.setdefault("UDACITY_OPENAI_API_KEY", "test-key")
+
+import project_starter as ps  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def workdir(tmp_path_factory):
+    """Directory holding copies of the source CSVs, so snapshots are built outside the repo."""
+    path = tmp_path_factory.mktemp("ledger")
+    for name in ps.SNAPSHOT_SOURCE_FILES:
+        shutil.copy2(REPO_DIR / name, path / name)
+    return path
+
+
+@pytest.fixture
+def ledger(workdir, tmp_path, monkeypatch):
+    """Seeded database in a temp file, installed as the module's `db_engine`."""
+    monkeypatch.chdir(workdir)
+    engine = ps.create_ledger_engine(f"sqlite:///{tmp_path / 'munder_difflin.db'}")
+    monkeypatch.setattr(ps, "db_engine", engine)
+    ps.init_database(engine)
+    yield engine
+    ps.ledger_cache.clear()
+    engine.dispose()
@@ -0,0 +1,123 @@
+"""Request handling: streaming, retries after failures, and model routing."""
+import pytest
+from smolagents.memory import FinalAnswerStep, ToolCall
+from sqlalchemy import text
+
+import project_starter as ps
+
+REQUEST = "I need 100 sheets of A4 paper for a meeting. (Date of request: 2025-04-05)"
+
+
+class FakeOrchestrator:
+    """Stands in for the orchestrator: each run follows the next script in `attempts`."""
+
+    def __init__(self, attempts, stream_outputs=False):
+        self.attempts = list(attempts)
+        self.stream_outputs = stream_outputs
+        self.runs = 0
+
+    def run(self, request, stream=False):
+        script = self.attempts[min(self.runs, len(self.attempts) - 1)]
+        self.runs += 1
+        steps = script()
+        return steps if stream else _last_answer(steps)
+
+
+def _last_answer(steps):
+    answer = None
+    for step in steps:
+        if isinstance(step, FinalAnswerStep):
+            answer = step.output
+    return answer
+
+
+def sell_then_fail():
+    yield ToolCall(name="order_agent", arguments={}, id="call_1")
+    ps.process_sale(item_name="A4 paper", quantity=100, price=5.0, date="2025-04-05")
+    raise RuntimeError("model connection dropped")
+
+
+def fail_at_once():
+    raise RuntimeError("model connection dropped")
+    yield
+
+
+def answer():
+    yield FinalAnswerStep(output="Your order has been processed.")
+
+
+def sales_count():
+    with ps.db_engine.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM transactions WHERE transaction_type = 'sales'")).scalar()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ps.time, "sleep", lambda seconds: None)
+
+
+@pytest.mark.parametrize("stream_outputs", [False, True])
+def test_failure_after_a_sale_is_not_retried(ledger, stream_outputs):
+    orchestrator = FakeOrchestrator([sell_then_fail, answer], stream_outputs)
+    before = sales_count()
+
+    events = list(ps.stream_request(REQUEST, agents={"orchestrator": orchestrator}))
+
+    assert sales_count() == before + 1
+    assert orchestrator.runs == 1
+    assert [e["type"] for e in events].count("sale_recorded") == 1
+    assert events[-1]["text"] == ps.PARTIAL_FAILURE_RESPONSE
+
+
+@pytest.mark.parametrize("stream_outputs", [False, True])
+def test_failure_before_any_tool_is_retried(ledger, stream_outputs):
+    orchestrator = FakeOrchestrator([fail_at_once, answer], stream_outputs)
+
+    events = list(ps.stream_request(REQUEST, agents={"orchestrator": orchestrator}))
+
+    assert orchestrator.runs == 2
+    assert [e["type"] for e in events].count("error") == 1
+    assert events[-1]["text"] == "Your order has been processed."
+
+
+def test_repeated_failures_end_in_an_apology(ledger):
+    orchestrator = FakeOrchestrator([fail_at_once])
+
+    events = list(ps.stream_request(REQUEST, agents={"orchestrator": orchestrator}, max_retries=3))
+
+    assert orchestrator.runs == 3
+    assert events[-1]["text"] == ps.UNAVAILABLE_RESPONSE
+
+
+def test_streamed_answer_matches_final_response(ledger):
+    agents = ps.build_agents(ps.StandInModel(), stream_outputs=True)
+
+    events = list(ps.stream_request(REQUEST, agents=agents))
+
+    deltas = "".join(e["text"] for e in events if e["type"] == "response_delta")
+    assert events[-1]["text"] == deltas == "Your order has been processed."
+    assert "response_reset" not in [e["type"] for e in events]
+
+
+def test_routed_orchestrator_falls_back_without_leaking_the_bad_reply(ledger):
+    stats = ps.ModelCallStats()
+    routed = ps.build_routed_models(
+        {"default": ["good"], "agents": {"orchestrator": ["bad", "good"]}},
+        registry={"bad": ps.StandInModel("bad", malformed_rate=1.0), "good": ps.StandInModel("good")},
+        stats=stats,
+    )
+    agents = ps.build_agents(ps.StandInModel(), models=routed, stream_outputs=True)
+
+    events = list(ps.stream_request(REQUEST, agents=agents))
+
+    assert "nonexistent_tool" not in str(events)
+    deltas = "".join(e["text"] for e in events if e["type"] == "response_delta")
+    assert events[-1]["text"] == deltas == "Your order has been processed."
+    assert stats.fallbacks["orchestrator"] >= 1
+    summary = stats.summary().set_index("model")
+    assert summary.loc["bad", "malformed"] >= 1
+
+
+def test_build_routed_models_rejects_an_empty_chain():
+    with pytest.raises(ValueError):
+        ps.build_routed_models({})
@@ -0,0 +1,246 @@
+"""Ledger consistency checks: concurrent writes, cache invalidation and sales aggregates."""
+import asyncio
+import threading
+import time
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import project_starter as ps
+
+
+def test_concurrent_sales_and_restocks_never_oversell_or_overspend(ledger):
+    summary = ps.stress_test_concurrent_writes(num_sales=400, num_restocks=30, workers=16)
+
+    assert summary["sales_ok"] == summary["start_stock"]
+    assert summary["restocks_ok"] == summary["expected_restocks"]
+    assert summary["final_cash"] >= 0
+
+
+def test_ledger_cache_invalidates_only_affected_entries():
+    cache = ps.LedgerCache()
+    keys = [
+        ("stock_level", "A4 paper", "2025-01-01"),
+        ("stock_level", "A4 paper", "2025-01-05"),
+        ("stock_level", "Cardstock", "2025-01-05"),
+        ("all_inventory", None, "2025-01-01"),
+        ("all_inventory", None, "2025-01-05"),
+    ]
+    for key in keys:
+        cache.get_or_compute(*key, lambda: "before")
+
+    cache.invalidate("A4 paper", "2025-01-03")
+
+    after = {key: cache.get_or_compute(*key, lambda: "after") for key in keys}
+    assert after == {
+        ("stock_level", "A4 paper", "2025-01-01"): "before",
+        ("stock_level", "A4 paper", "2025-01-05"): "after",
+        ("stock_level", "Cardstock", "2025-01-05"): "before",
+        ("all_inventory", None, "2025-01-01"): "before",
+        ("all_inventory", None, "2025-01-05"): "after",
+    }
+
+
+def test_ledger_cache_does_not_store_results_computed_during_a_write():
+    cache = ps.LedgerCache()
+
+    def compute_racing_a_write():
+        cache.invalidate("Cardstock", "2025-01-01")
+        return "stale"
+
+    assert cache.get_or_compute("stock_level", "A4 paper", "2025-01-05", compute_racing_a_write) == "stale"
+    assert cache.get_or_compute("stock_level", "A4 paper", "2025-01-05", lambda: "fresh") == "fresh"
+
+
+def test_cached_stock_reads_see_new_transactions(ledger):
+    before = int(ps.get_stock_level("A4 paper", "2025-04-05")["current_stock"].iloc[0])
+    earlier = ps.fetch_stock_level("A4 paper", "2025-01-01").current_stock
+    assert ps.fetch_stock_level("A4 paper", "2025-04-05").current_stock == before
+
+    ps.create_transaction("A4 paper", "sales", 5, 0.25, "2025-04-01")
+
+    assert int(ps.get_stock_level("A4 paper", "2025-04-05")["current_stock"].iloc[0]) == before - 5
+    assert ps.fetch_stock_level("A4 paper", "2025-04-05").current_stock == before - 5
+    assert ps.fetch_stock_level("A4 paper", "2025-01-01").current_stock == earlier
+
+
+def test_sales_daily_triggers_match_ledger(ledger):
+    first = ps.create_transaction("A4 paper", "sales", 10, 0.50, "2025-02-01")
+    second = ps.create_transaction("A4 paper", "sales", 4, 0.20, "2025-02-01")
+    ps.create_transaction("Cardstock", "sales", 3, 0.45, "2025-02-02")
+    ps.create_transaction("Cardstock", "stock_orders", 50, 7.50, "2025-02-02")
+    with ps.ledger_write_transaction() as conn:
+        conn.execute(text("UPDATE transactions SET units = 6, price = 0.30 WHERE rowid = :id"), {"id": first})
+        conn.execute(text("UPDATE transactions SET transaction_date = '2025-02-03' WHERE rowid = :id"), {"id": second})
+        conn.execute(text("DELETE FROM transactions WHERE item_name = 'Cardstock' AND transaction_type = 'sales'"))
+
+    assert ps.check_sales_aggregates().empty
+    totals = ps.get_sales_revenue("2025-02-01", "2025-02-03", item_name="A4 paper")
+    assert totals["units"] == 10
+    assert totals["revenue"] == pytest.approx(0.50)
+
+
+def test_check_sales_aggregates_detects_and_repairs_drift(ledger):
+    ps.create_transaction("A4 paper", "sales", 10, 0.50, "2025-02-01")
+    with ledger.begin() as conn:
+        conn.execute(text("UPDATE sales_daily SET units = units + 1 WHERE sale_date = '2025-02-01'"))
+
+    assert len(ps.check_sales_aggregates(repair=True)) == 1
+    assert ps.check_sales_aggregates().empty
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_single_flight_cancelling_the_leader_keeps_followers_result():
+    flight = ps.SingleFlight()
+    release = threading.Event()
+
+    def compute():
+        release.wait(5)
+        return "result"
+
+    thread_result = {}
+    thread_caller = threading.Thread(target=lambda: thread_result.update(value=flight.do("key", compute)))
+
+    async def scenario():
+        leader = asyncio.create_task(flight.do_async("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do_async("key", compute))
+        thread_caller.start()
+        await asyncio.to_thread(_wait_for, lambda: flight.stats()["calls"] == 3)
+
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+
+        assert await follower == "result"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(scenario())
+    thread_caller.join(5)
+    assert thread_result["value"] == "result"
+    assert flight.stats()["executions"] == 1
+    _wait_for(lambda: flight.stats()["in_flight"] == 0)
+
+
+def test_single_flight_async_leader_does_not_wait_for_busy_db_executor():
+    flight = ps.SingleFlight()
+    gate = threading.Event()
+
+    def follow():
+        gate.wait(5)
+        return flight.do("key", lambda: "follower ran")
+
+    async def scenario():
+        followers = [
+            asyncio.ensure_future(ps.db_executor.run(follow)) for _ in range(ps.DB_EXECUTOR_WORKERS)
+        ]
+        joined = lambda: flight.stats()["calls"] == 1 + len(followers)  # noqa: E731
+        leader = asyncio.ensure_future(flight.do_async("key", lambda: _wait_for(joined) or "leader ran"))
+        await asyncio.sleep(0)
+        gate.set()
+        return await asyncio.wait_for(asyncio.gather(leader, *followers), 5)
+
+    assert set(asyncio.run(scenario())) == {"leader ran"}
+    assert flight.stats()["executions"] == 1
+
+
+def test_async_cash_balance_joins_a_threads_query(ledger):
+    release = threading.Event()
+    original = ps._query_cash_balance
+
+    def slow_query(as_of_date):
+        release.wait(5)
+        return original(as_of_date)
+
+    ps.query_flight.reset_stats()
+    thread_result = {}
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(ps, "_query_cash_balance", slow_query)
+        thread_caller = threading.Thread(
+            target=lambda: thread_result.update(value=ps.get_cash_balance("2025-04-05"))
+        )
+        thread_caller.start()
+        _wait_for(lambda: ps.query_flight.stats()["in_flight"] == 1)
+
+        async def scenario():
+            waiter = asyncio.ensure_future(ps.aget_cash_balance("2025-04-05"))
+            await asyncio.to_thread(_wait_for, lambda: ps.query_flight.stats()["calls"] == 2)
+            release.set()
+            return await waiter
+
+        async_result = asyncio.run(scenario())
+        thread_caller.join(5)
+
+    assert async_result == thread_result["value"] == ps.get_cash_balance("2025-04-05")
+    assert ps.query_flight.stats()["executions"] == 1
+
+
+def test_plan_reorders_counts_a_held_pending_order_once(ledger):
+    stock = ps.fetch_stock_level("A4 paper", "2025-04-05").current_stock
+    min_level = ps.fetch_inventory_item("A4 paper").min_stock_level
+    hold_id, _ = ps.create_stock_hold({"A4 paper": 50}, "2025-04-05")
+    demand = {"A4 paper": stock}
+
+    def a4_order(**kwargs):
+        plan = ps.plan_reorders("2025-04-05", pending_demand=demand, place_orders=False, **kwargs)
+        return next(order for order in plan["orders"] if order["item_name"] == "A4 paper")
+
+    own_hold = a4_order(hold_id=hold_id)
+    assert own_hold["held"] == 0
+    assert own_hold["projected"] == 0
+    assert own_hold["quantity"] == ps.REORDER_UP_TO_FACTOR * min_level
+
+    other_hold = a4_order()
+    assert other_hold["held"] == 50
+    assert other_hold["projected"] == -50
+
+
+def test_plan_reorders_places_all_orders_or_none(ledger):
+    plan = ps.plan_reorders("2025-04-05", pending_demand={"A4 paper": 10_000_000}, place_orders=True)
+    assert not plan["placed"]
+    assert plan["total_cost"] > plan["cash"]
+    assert plan["transaction_ids"] == []
+
+    plan = ps.plan_reorders("2025-04-05", pending_demand={"A4 paper": 500})
+    assert plan["placed"]
+    assert len(plan["transaction_ids"]) == len(plan["orders"])
+    assert ps.plan_reorders("2025-04-05", pending_demand={"A4 paper": 500}, place_orders=False)["orders"] == []
+
+
+def test_async_helpers_match_blocking_helpers(ledger):
+    date = "2025-04-05"
+    ps.create_transaction("A4 paper", "sales", 5, 0.25, "2025-04-01")
+
+    async def read_all():
+        return await asyncio.gather(
+            ps.aget_stock_level("A4 paper", date),
+            ps.aget_all_inventory(date),
+            ps.aget_cash_balance(date),
+            ps.asearch_quote_history(["paper"], limit=3),
+            ps.agenerate_financial_report(date),
+        )
+
+    # Once with an empty ledger cache, so the async paths run their own queries
+    ps.ledger_cache.clear()
+    stock, inventory, cash, quotes, report = asyncio.run(read_all())
+
+    assert stock.equals(ps.get_stock_level("A4 paper", date))
+    assert inventory == ps.get_all_inventory(date)
+    assert cash == ps.get_cash_balance(date)
+    assert quotes == ps.search_quote_history(["paper"], limit=3)
+    expected = ps.generate_financial_report(date)
+    assert report.keys() == expected.keys()
+    for key, value in expected.items():
+        # Compare record lists as frames, where NaN equals NaN
+        if isinstance(value, list):
+            assert pd.DataFrame(report[key]).equals(pd.DataFrame(value)), key
+        else:
+            assert report[key] == value, key